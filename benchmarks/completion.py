@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Measure the latency of tab completion
+
+Each scenario builds a cmd2 app and calls Cmd.complete() the way readline does when tab is pressed,
+with readline's line buffer replaced by the line being completed. The time each completion takes is
+measured repeatedly and reported as percentiles, so changes which slow down completion show up when
+the results of two versions are compared.
+
+Usage: python benchmarks/completion.py [--iterations N] [--scenarios NAME [NAME ...]]
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cmd2  # noqa: E402
+from cmd2 import Cmd2ArgumentParser, CompletionIndex, CompletionItem, with_argparser  # noqa: E402
+from cmd2.rl_utils import readline  # noqa: E402
+
+# Number of entries in the directory path completion searches
+NUM_FILES = 50000
+
+# Number of choices of the argument in the choices scenarios
+NUM_CHOICES = 100000
+
+
+class LineBuffer:
+    """Stands in for readline's line buffer while a completion runs"""
+    def __init__(self) -> None:
+        self.line = ''
+        self.begidx = 0
+        self.endidx = 0
+
+    def set(self, line: str) -> str:
+        """Set the line being completed, with the cursor at its end, and return the text being completed"""
+        self.line = line
+        self.endidx = len(line)
+        self.begidx = line.rfind(' ') + 1
+        return line[self.begidx:]
+
+    @contextlib.contextmanager
+    def patch_readline(self):
+        """Make readline return this buffer's line and indexes"""
+        originals = [(name, getattr(readline, name)) for name in ('get_line_buffer', 'get_begidx', 'get_endidx')]
+        readline.get_line_buffer = lambda: self.line
+        readline.get_begidx = lambda: self.begidx
+        readline.get_endidx = lambda: self.endidx
+        try:
+            yield
+        finally:
+            for name, original in originals:
+                setattr(readline, name, original)
+
+
+def many_commands_app() -> cmd2.Cmd:
+    """An app with 1,000 commands"""
+    def do_command(self, _):
+        pass
+
+    commands = {'do_command{:03}'.format(i): do_command for i in range(1000)}
+    return type('ManyCommandsApp', (cmd2.Cmd,), commands)()
+
+
+def subcommands_app() -> cmd2.Cmd:
+    """
+    An app with a command whose subcommands are nested 8 levels deep. Each level has 10 subcommands and
+    the last one has the subcommands of the next level.
+    """
+    def add_levels(parser: argparse.ArgumentParser, depth: int) -> None:
+        parser.add_argument('--color', choices=['red', 'green', 'blue', 'yellow', 'black'])
+        if depth == 0:
+            return
+        subparsers = parser.add_subparsers()
+        for i in range(10):
+            subparser = subparsers.add_parser('level{}sub{}'.format(depth, i))
+            if i == 9:
+                add_levels(subparser, depth - 1)
+
+    deep_parser = Cmd2ArgumentParser()
+    add_levels(deep_parser, 8)
+
+    class SubcommandsApp(cmd2.Cmd):
+        @with_argparser(deep_parser)
+        def do_deep(self, _):
+            pass
+
+    return SubcommandsApp()
+
+
+def choices_app() -> cmd2.Cmd:
+    """An app with arguments which have 100,000 choices and one with 1,000 CompletionItems"""
+    hosts = ['host{:06}.example.com'.format(i) for i in range(NUM_CHOICES)]
+    host_index = CompletionIndex(hosts)
+    items = [CompletionItem('item{:04}'.format(i), 'Description of item number {}'.format(i)) for i in range(1000)]
+
+    parser = Cmd2ArgumentParser()
+    parser.add_argument('--host', choices=hosts)
+    parser.add_argument('--indexed', choices=host_index)
+    parser.add_argument('--fuzzy', choices=host_index, completion_mode='fuzzy')
+    parser.add_argument('--item', choices_function=lambda: items, descriptive_header='Description')
+
+    class ChoicesApp(cmd2.Cmd):
+        @with_argparser(parser)
+        def do_choose(self, _):
+            pass
+
+    app = ChoicesApp()
+
+    # Let all of the CompletionItems be formatted with their descriptions
+    app.max_completion_items = len(items)
+    return app
+
+
+def make_files(directory: str) -> None:
+    """Fill a directory with NUM_FILES empty files and a few subdirectories"""
+    for i in range(NUM_FILES - 100):
+        open(os.path.join(directory, 'file{:05}.txt'.format(i)), 'w').close()
+    for i in range(100):
+        os.mkdir(os.path.join(directory, 'dir{:03}'.format(i)))
+
+
+def scenarios(test_dir: str) -> List[Tuple[str, Callable[[], cmd2.Cmd], str]]:
+    """Return the name of each scenario, a function which builds its app, and the line being completed"""
+    def path_app(cache_ttl: float) -> Callable[[], cmd2.Cmd]:
+        def make_app() -> cmd2.Cmd:
+            app = cmd2.Cmd()
+            app.path_complete_cache_ttl = cache_ttl
+            return app
+        return make_app
+
+    return [
+        ('commands', many_commands_app, 'command5'),
+        ('subcommands', subcommands_app, 'deep ' + ' '.join('level{}sub9'.format(i) for i in range(8, 1, -1))
+         + ' level1sub'),
+        ('subcommand_flag', subcommands_app, 'deep ' + ' '.join('level{}sub9'.format(i) for i in range(8, 0, -1))
+         + ' --color b'),
+        ('path', path_app(0.0), 'edit {}{}file1'.format(test_dir, os.path.sep)),
+        ('path_cached', path_app(60.0), 'edit {}{}file1'.format(test_dir, os.path.sep)),
+        ('choices_list', choices_app, 'choose --host host01'),
+        ('choices_index', choices_app, 'choose --indexed host01'),
+        ('choices_fuzzy', choices_app, 'choose --fuzzy h0123'),
+        ('choices_fuzzy_char', choices_app, 'choose --fuzzy 7'),
+        ('completion_items', choices_app, 'choose --item item'),
+    ]
+
+
+def measure(app: cmd2.Cmd, buffer: LineBuffer, line: str, iterations: int) -> Tuple[int, List[float]]:
+    """Complete a line repeatedly and return the number of matches and the seconds each completion took"""
+    text = buffer.set(line)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        app.complete(text, 0)
+        times.append(time.perf_counter() - start)
+
+    if not app.completion_matches:
+        raise RuntimeError('Completing {!r} found no matches'.format(line))
+
+    # When fuzzy matches are kept from replacing the text, completion_matches only holds the text
+    return len(app.display_matches or app.completion_matches), times
+
+
+def percentile(sorted_times: List[float], percent: float) -> float:
+    """Return a percentile of a sorted list of times using the nearest rank"""
+    rank = max(int(round(percent / 100 * len(sorted_times))), 1)
+    return sorted_times[rank - 1]
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as test_dir:
+        all_scenarios = scenarios(test_dir)
+        names = [name for name, _, _ in all_scenarios]
+
+        parser = argparse.ArgumentParser(description='Measure the latency of tab completion')
+        parser.add_argument('--iterations', type=int, default=50, help='completions to time in each scenario')
+        parser.add_argument('--scenarios', nargs='+', choices=names, default=names, help='scenarios to run')
+        args = parser.parse_args()
+
+        if any(name.startswith('path') for name in args.scenarios):
+            make_files(test_dir)
+
+        buffer = LineBuffer()
+        apps = {}
+
+        print('{:<18}  {:>8}  {:>9}  {:>9}  {:>9}  {:>9}'.format('scenario', 'matches', 'p50 (ms)', 'p90 (ms)',
+                                                                 'p99 (ms)', 'max (ms)'))
+        with buffer.patch_readline():
+            for name, make_app, line in all_scenarios:
+                if name not in args.scenarios:
+                    continue
+                if make_app not in apps:
+                    apps[make_app] = make_app()
+                num_matches, times = measure(apps[make_app], buffer, line, args.iterations)
+                times.sort()
+                row = '{:<18}  {:>8}  {:>9.2f}  {:>9.2f}  {:>9.2f}  {:>9.2f}'
+                print(row.format(name, num_matches, *[percentile(times, percent) * 1000 for percent in (50, 90, 99)],
+                                 times[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
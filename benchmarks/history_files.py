@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Measure the size and load time of persistent history files
+
+For each number of items, a history file is written uncompressed and with each compression
+cmd2 supports. Then the time HistoryLog takes to load it the way cmd2.Cmd does at startup is
+measured. Loading keeps the lines of every item in memory, so the largest sizes need several
+gigabytes of memory.
+
+Usage: python benchmarks/history_files.py [--items N [N ...]] [--extensions EXT [EXT ...]]
+"""
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cmd2 import Cmd  # noqa: E402
+from cmd2.history import COMPRESSED_HISTORY_EXTENSIONS, HistoryItem, HistoryLog  # noqa: E402
+from cmd2.parsing import StatementParser  # noqa: E402
+
+# Commands which the items of the generated files cycle through
+COMMANDS = ['help', 'help history', 'alias create ls !ls -l', 'history -a -s', 'set editor vim',
+            'run_script ~/scripts/setup.txt', 'shell grep -r "def " cmd2 | wc -l', 'edit notes.txt',
+            'history --since 2d --stats', 'say hello world > out.txt']
+
+OPENERS = {'': open, '.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def write_file(path: str, count: int) -> float:
+    """Write a history file with count items and return the seconds it took"""
+    parser = StatementParser()
+    sources = [HistoryItem(parser.parse(command), 0).to_dict() for command in COMMANDS]
+    start = time.perf_counter()
+    with OPENERS[os.path.splitext(path)[1]](path, 'wb') as fobj:
+        fobj.write(HistoryLog.HEADER.encode() + b'\n')
+        for i in range(count):
+            source = sources[i % len(sources)]
+            source['outcome'] = [1600000000.0 + i, 0.001 * (i % 100), 0, 0]
+            fobj.write(json.dumps(source).encode() + b'\n')
+    return time.perf_counter() - start
+
+
+def load_file(path: str, count: int) -> float:
+    """Load a history file the way cmd2.Cmd does at startup and return the seconds it took"""
+    log = HistoryLog(path, max_length=count)
+    start = time.perf_counter()
+    older_lines, items = log.load_recent(Cmd.HISTORY_PRELOAD_LENGTH)
+    elapsed = time.perf_counter() - start
+    assert len(older_lines) + len(items) == count
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the size and load time of persistent history files')
+    parser.add_argument('--items', type=int, nargs='+', default=[100000, 1000000, 10000000],
+                        help='numbers of items in the files')
+    parser.add_argument('--extensions', nargs='+', default=[''] + sorted(COMPRESSED_HISTORY_EXTENSIONS),
+                        help="file extensions to measure, where '' is uncompressed")
+    args = parser.parse_args()
+
+    print('{:>10}  {:<6}  {:>12}  {:>10}  {:>10}'.format('items', 'ext', 'size (bytes)', 'write (s)', 'load (s)'))
+    with tempfile.TemporaryDirectory() as test_dir:
+        for count in args.items:
+            for ext in args.extensions:
+                path = os.path.join(test_dir, 'history' + ext)
+                write_time = write_file(path, count)
+                size = os.path.getsize(path)
+                load_time = load_file(path, count)
+                os.remove(path)
+                row = '{:>10}  {:<6}  {:>12}  {:>10.2f}  {:>10.2f}'
+                print(row.format(count, ext or '-', size, write_time, load_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,25 +7,27 @@ See the header of argparse_custom.py for instructions on how to use these featur
 """
 
 import argparse
-import inspect
 import numbers
 import shutil
+import weakref
 from collections import deque
-from typing import Dict, List, Optional, Union
+from typing import Dict, Hashable, List, Optional, Tuple, Union
 
-from . import ansi
+from . import ansi, constants
 from . import cmd2
-from .argparse_custom import ATTR_CHOICES_CALLABLE, INFINITY, generate_range_error
+from .argparse_custom import ARG_TOKENS, ATTR_CHOICES_CACHE, ATTR_CHOICES_CALLABLE, ATTR_COMPLETION_MODE, INFINITY
 from .argparse_custom import ATTR_SUPPRESS_TAB_HINT, ATTR_DESCRIPTIVE_COMPLETION_HEADER, ATTR_NARGS_RANGE
-from .argparse_custom import ChoicesCallable, CompletionItem
-from .utils import basic_complete, CompletionError
+from .argparse_custom import ChoicesCallable, CompletionItem, generate_range_error
+from .choices_cache import CacheSettings
+from .utils import basic_complete, CompletionError, CompletionIndex
 
 # If no descriptive header is supplied, then this will be used instead
 DEFAULT_DESCRIPTIVE_HEADER = 'Description'
 
-# Name of the choice/completer function argument that, if present, will be passed a dictionary of
-# command line tokens up through the token being completed mapped to their argparse destination name.
-ARG_TOKENS = 'arg_tokens'
+# Attributes of the cmd2 app which completers set to change how their results are displayed. These are
+# cached along with the results of a completer.
+_COMPLETION_SETTINGS = ('allow_appended_space', 'allow_closing_quote', 'completion_header', 'display_matches',
+                        'matches_delimited', 'matches_fuzzy', 'matches_sorted')
 
 
 def _single_prefix_char(token: str, parser: argparse.ArgumentParser) -> bool:
@@ -132,6 +134,65 @@ class _NoResultsError(CompletionError):
         super().__init__(hint_str, apply_style=False)
 
 
+# noinspection PyProtectedMember
+class _ParserInfo:
+    """
+    The metadata about a parser's actions which ArgparseCompleter needs. Walking a large parser's actions
+    on every Tab press is slow, so _ParserInfo.get() builds this once per parser and only rebuilds it after
+    arguments or mutually exclusive groups are added to or removed from the parser.
+    """
+    # Metadata of each parser it has been built for
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, parser: argparse.ArgumentParser) -> None:
+        self.fingerprint = self._fingerprint(parser)
+
+        self.flags = []                      # all flags in this command
+        self.flag_to_action = {}             # maps flags to the argparse action object
+        self.flag_actions = set()            # actions for flags
+        self.positional_actions = []         # actions for positional arguments (by position index)
+        self.subcommand_action = None        # this will be set if the parser has subcommands
+        self.mutex_groups = {}               # maps actions to the mutually exclusive group they belong to
+
+        # Start digging through the argparse structures.
+        # _actions is the top level container of parameter definitions
+        for action in parser._actions:
+            # if the parameter is flag based, it will have option_strings
+            if action.option_strings:
+                # record each option flag
+                for option in action.option_strings:
+                    self.flags.append(option)
+                    self.flag_to_action[option] = action
+                self.flag_actions.add(action)
+
+            # Otherwise this is a positional parameter
+            else:
+                self.positional_actions.append(action)
+                # Check if this action defines subcommands
+                if isinstance(action, argparse._SubParsersAction):
+                    self.subcommand_action = action
+
+        # An arg can only be in one group
+        for group in parser._mutually_exclusive_groups:
+            for action in group._group_actions:
+                self.mutex_groups.setdefault(action, group)
+
+    @staticmethod
+    def _fingerprint(parser: argparse.ArgumentParser) -> Tuple[int, int, int]:
+        """Return values which change when arguments or mutually exclusive groups are added to or removed from
+        a parser. Adding an argument to a group also adds it to the parser."""
+        return len(parser._actions), len(parser._option_string_actions), len(parser._mutually_exclusive_groups)
+
+    @classmethod
+    def get(cls, parser: argparse.ArgumentParser) -> '_ParserInfo':
+        """Return the metadata of a parser, building it if it hasn't been built or the parser has changed"""
+        info = cls._cache.get(parser)
+        if info is None or info.fingerprint != cls._fingerprint(parser):
+            info = cls(parser)
+            cls._cache[parser] = info
+        return info
+
+
 # noinspection PyProtectedMember
 class ArgparseCompleter:
     """Automatic command line tab completion based on argparse parameters"""
@@ -153,27 +214,14 @@ class ArgparseCompleter:
             parent_tokens = dict()
         self._parent_tokens = parent_tokens
 
-        self._flags = []                      # all flags in this command
-        self._flag_to_action = {}             # maps flags to the argparse action object
-        self._positional_actions = []         # actions for positional arguments (by position index)
-        self._subcommand_action = None        # this will be set if self._parser has subcommands
-
-        # Start digging through the argparse structures.
-        # _actions is the top level container of parameter definitions
-        for action in self._parser._actions:
-            # if the parameter is flag based, it will have option_strings
-            if action.option_strings:
-                # record each option flag
-                for option in action.option_strings:
-                    self._flags.append(option)
-                    self._flag_to_action[option] = action
-
-            # Otherwise this is a positional parameter
-            else:
-                self._positional_actions.append(action)
-                # Check if this action defines subcommands
-                if isinstance(action, argparse._SubParsersAction):
-                    self._subcommand_action = action
+        # The metadata is shared by every completer for the parser, so it must not be modified
+        info = _ParserInfo.get(parser)
+        self._flags = info.flags
+        self._flag_to_action = info.flag_to_action
+        self._flag_actions = info.flag_actions
+        self._positional_actions = info.positional_actions
+        self._subcommand_action = info.subcommand_action
+        self._mutex_groups = info.mutex_groups
 
     def complete_command(self, tokens: List[str], text: str, line: str, begidx: int, endidx: int) -> List[str]:
         """
@@ -219,37 +267,35 @@ class ArgparseCompleter:
             :raises: CompletionError if the group is already completed
             """
             # Check if this action is in a mutually exclusive group
-            for group in self._parser._mutually_exclusive_groups:
-                if arg_action in group._group_actions:
-
-                    # Check if the group this action belongs to has already been completed
-                    if group in completed_mutex_groups:
-
-                        # If this is the action that completed the group, then there is no error
-                        # since it's allowed to appear on the command line more than once.
-                        completer_action = completed_mutex_groups[group]
-                        if arg_action == completer_action:
-                            return
-
-                        error = ("Error: argument {}: not allowed with argument {}".
-                                 format(argparse._get_action_name(arg_action),
-                                        argparse._get_action_name(completer_action)))
-                        raise CompletionError(error)
-
-                    # Mark that this action completed the group
-                    completed_mutex_groups[group] = arg_action
-
-                    # Don't tab complete any of the other args in the group
-                    for group_action in group._group_actions:
-                        if group_action == arg_action:
-                            continue
-                        elif group_action in self._flag_to_action.values():
-                            matched_flags.extend(group_action.option_strings)
-                        elif group_action in remaining_positionals:
-                            remaining_positionals.remove(group_action)
-
-                    # Arg can only be in one group, so we are done
-                    break
+            group = self._mutex_groups.get(arg_action)
+            if group is None:
+                return
+
+            # Check if the group this action belongs to has already been completed
+            if group in completed_mutex_groups:
+
+                # If this is the action that completed the group, then there is no error
+                # since it's allowed to appear on the command line more than once.
+                completer_action = completed_mutex_groups[group]
+                if arg_action == completer_action:
+                    return
+
+                error = ("Error: argument {}: not allowed with argument {}".
+                         format(argparse._get_action_name(arg_action),
+                                argparse._get_action_name(completer_action)))
+                raise CompletionError(error)
+
+            # Mark that this action completed the group
+            completed_mutex_groups[group] = arg_action
+
+            # Don't tab complete any of the other args in the group
+            for group_action in group._group_actions:
+                if group_action == arg_action:
+                    continue
+                elif group_action in self._flag_actions:
+                    matched_flags.extend(group_action.option_strings)
+                elif group_action in remaining_positionals:
+                    remaining_positionals.remove(group_action)
 
         #############################################################################################
         # Parse all but the last token
@@ -507,7 +553,8 @@ class ArgparseCompleter:
                     return completer.complete_subcommand_help(tokens[token_index:], text, line, begidx, endidx)
                 elif token_index == len(tokens) - 1:
                     # Since this is the last token, we will attempt to complete it
-                    return basic_complete(text, line, begidx, endidx, self._subcommand_action.choices)
+                    return self._cmd2_app._complete_in_mode(text, line, begidx, endidx,
+                                                            self._subcommand_action.choices)
                 else:
                     break
         return []
@@ -549,13 +596,17 @@ class ArgparseCompleter:
         # If we are going to call a completer/choices function, then set up the common arguments
         args = []
         kwargs = {}
+        cache_settings = None
+        arg_tokens = None
         if isinstance(arg_choices, ChoicesCallable):
             if arg_choices.is_method:
                 args.append(self._cmd2_app)
 
-            # Check if arg_choices.to_call expects arg_tokens
-            to_call_params = inspect.signature(arg_choices.to_call).parameters
-            if ARG_TOKENS in to_call_params:
+            # Settings passed to add_argument() take precedence over those of the cached_choices decorator
+            cache_settings = getattr(arg_action, ATTR_CHOICES_CACHE, None) or arg_choices.cache
+
+            # Check if arg_choices.to_call expects arg_tokens or they are needed for the cache key
+            if arg_choices.takes_arg_tokens or (cache_settings is not None and cache_settings.key is not None):
                 # Merge self._parent_tokens and consumed_arg_values
                 arg_tokens = {**self._parent_tokens, **consumed_arg_values}
 
@@ -563,38 +614,92 @@ class ArgparseCompleter:
                 arg_tokens.setdefault(arg_action.dest, [])
                 arg_tokens[arg_action.dest].append(text)
 
+            if arg_choices.takes_arg_tokens:
                 # Add the namespace to the keyword arguments for the function we are calling
                 kwargs[ARG_TOKENS] = arg_tokens
 
         # Check if the argument uses a specific tab completion function to provide its choices
         if isinstance(arg_choices, ChoicesCallable) and arg_choices.is_completer:
             args.extend([text, line, begidx, endidx])
-            results = arg_choices.to_call(*args, **kwargs)
+            if cache_settings is None:
+                results = arg_choices.to_call(*args, **kwargs)
+            else:
+                results = self._call_cached_completer(arg_action, arg_choices, cache_settings, arg_tokens,
+                                                      args, kwargs)
 
         # Otherwise use basic_complete on the choices
         else:
             # Check if the choices come from a function
             if isinstance(arg_choices, ChoicesCallable) and not arg_choices.is_completer:
-                arg_choices = arg_choices.to_call(*args, **kwargs)
+                if cache_settings is None:
+                    arg_choices = arg_choices.to_call(*args, **kwargs)
+                else:
+                    to_call = arg_choices.to_call
 
-            # Since arg_choices can be any iterable type, convert to a list
-            arg_choices = list(arg_choices)
+                    def fetch():
+                        choices = to_call(*args, **kwargs)
+                        # An iterator can only be used once, so cache a list of its choices
+                        return choices if isinstance(choices, CompletionIndex) else list(choices)
 
-            # If these choices are numbers, and have not yet been sorted, then sort them now
-            if not self._cmd2_app.matches_sorted and all(isinstance(x, numbers.Number) for x in arg_choices):
-                arg_choices.sort()
-                self._cmd2_app.matches_sorted = True
+                    arg_choices = self._cmd2_app._choices_cache.get(
+                        arg_action, to_call, cache_settings, self._cache_key(cache_settings, arg_tokens), fetch)
+
+            # Values of this argument which are already on the command line are left out of the results
+            used_values = set(consumed_arg_values.get(arg_action.dest, []))
+            mode = getattr(arg_action, ATTR_COMPLETION_MODE, None) or self._cmd2_app.completion_mode
+
+            # A CompletionIndex finds its matches without checking every choice
+            if isinstance(arg_choices, CompletionIndex):
+                results = arg_choices.complete(text, exclude=used_values, mode=mode)
+                if mode != constants.COMPLETION_MODE_PREFIX and text:
+                    self._cmd2_app.matches_sorted = True
+                    self._cmd2_app.matches_fuzzy = True
+
+            else:
+                # Since arg_choices can be any iterable type, convert to a list
+                arg_choices = list(arg_choices)
+
+                # If these choices are numbers, and have not yet been sorted, then sort them now
+                if not self._cmd2_app.matches_sorted and all(isinstance(x, numbers.Number) for x in arg_choices):
+                    arg_choices.sort()
+                    self._cmd2_app.matches_sorted = True
 
-            # Since choices can be various types like int, we must convert them to strings
-            for index, choice in enumerate(arg_choices):
-                if not isinstance(choice, str):
-                    arg_choices[index] = str(choice)
+                # Since choices can be various types like int, we must convert them to strings
+                arg_choices = [choice if isinstance(choice, str) else str(choice) for choice in arg_choices]
 
-            # Filter out arguments we already used
-            used_values = consumed_arg_values.get(arg_action.dest, [])
-            arg_choices = [choice for choice in arg_choices if choice not in used_values]
+                # Filter out arguments we already used
+                arg_choices = [choice for choice in arg_choices if choice not in used_values]
 
-            # Do tab completion on the choices
-            results = basic_complete(text, line, begidx, endidx, arg_choices)
+                # Do tab completion on the choices
+                results = self._cmd2_app._complete_in_mode(text, line, begidx, endidx, arg_choices, mode=mode)
 
         return self._format_completions(arg_action, results)
+
+    @staticmethod
+    def _cache_key(cache_settings: CacheSettings, arg_tokens: Optional[Dict[str, List[str]]]) -> Hashable:
+        """Return the key which identifies cached results among those of the same argument"""
+        if cache_settings.key is None:
+            return None
+        return cache_settings.key(arg_tokens)
+
+    def _call_cached_completer(self, arg_action: argparse.Action, arg_choices: ChoicesCallable,
+                               cache_settings: CacheSettings, arg_tokens: Optional[Dict[str, List[str]]],
+                               args: List, kwargs: Dict) -> List[str]:
+        """
+        Call a completer through the app's choices cache. Completers can change the completion settings of
+        the app, so the settings are cached with the results and restored when the results are reused.
+        """
+        def fetch():
+            completions = list(arg_choices.to_call(*args, **kwargs))
+            settings = {attr: getattr(self._cmd2_app, attr) for attr in _COMPLETION_SETTINGS}
+            settings['display_matches'] = list(settings['display_matches'])
+            return completions, settings
+
+        # The results depend on the text being completed and where it is on the line
+        key = (self._cache_key(cache_settings, arg_tokens), tuple(args[-4:]))
+        completions, settings = self._cmd2_app._choices_cache.get(arg_action, arg_choices.to_call, cache_settings,
+                                                                  key, fetch, allow_background=False)
+        for attr, value in settings.items():
+            setattr(self._cmd2_app, attr, value)
+        self._cmd2_app.display_matches = list(self._cmd2_app.display_matches)
+        return list(completions)
@@ -139,6 +139,34 @@ values. All tokens are stored in the dictionary as the raw strings provided on
 the command line. It is up to the developer to determine if the user entered
 the correct argument type (e.g. int) and validate their values.
 
+Choices and completer functions/methods which are slow, like those which query a
+remote server, can have their results cached by ArgparseCompleter. Pass the
+number of seconds to keep the results as choices_cache_ttl. To cache results
+separately for different values of earlier arguments, pass a function which
+builds a key from arg_tokens as choices_cache_key. The cached_choices decorator
+in cmd2.decorators enables the same caching for every argument which uses a
+function. Cached results are kept per cmd2 app and can be removed early with
+cmd2.Cmd.invalidate_choices_cache().
+
+    Example::
+
+        parser.add_argument('host', choices_method=query_hosts, choices_cache_ttl=30)
+        parser.add_argument('--disk', choices_method=query_disks, choices_cache_ttl=30,
+                            choices_cache_key=lambda arg_tokens: arg_tokens['host'][0])
+
+Choices functions/methods which provide hundreds of thousands of choices can
+return a cmd2.utils.CompletionIndex, which ArgparseCompleter searches without
+checking every choice. It can also be passed as the choices parameter.
+
+The completion_mode setting of cmd2.Cmd chooses whether argument values must
+begin with the text being completed or can contain it, or its characters in
+order, anywhere. To use a different mode for one argument, pass one of the
+modes in cmd2.constants.COMPLETION_MODES as completion_mode.
+
+    Example::
+
+        parser.add_argument('host', choices_method=query_hosts, completion_mode='fuzzy')
+
 CompletionItem Class - This class was added to help in cases where
 uninformative data is being tab completed. For instance, tab completing ID
 numbers isn't very helpful to a user without context. Returning a list of
@@ -203,17 +231,23 @@ argparse.ArgumentParser._match_argument - adds support to for nargs ranges See
 """
 
 import argparse
+import inspect
 import re
 import sys
 # noinspection PyUnresolvedReferences,PyProtectedMember
 from argparse import ZERO_OR_MORE, ONE_OR_MORE, ArgumentError, _
-from typing import Callable, Optional, Tuple, Type, Union
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Type, Union
 
-from . import ansi
+from . import ansi, constants
+from .choices_cache import CacheSettings
 
 # Used in nargs ranges to signify there is no maximum
 INFINITY = float('inf')
 
+# Name of the choice/completer function argument that, if present, will be passed a dictionary of
+# command line tokens up through the token being completed mapped to their argparse destination name.
+ARG_TOKENS = 'arg_tokens'
+
 ############################################################################################################
 # The following are names of custom argparse argument attributes added by cmd2
 ############################################################################################################
@@ -231,6 +265,12 @@ ATTR_SUPPRESS_TAB_HINT = 'suppress_tab_hint'
 # Descriptive header that prints when using CompletionItems
 ATTR_DESCRIPTIVE_COMPLETION_HEADER = 'desc_completion_header'
 
+# CacheSettings object used when caching the results of the argument's ChoicesCallable
+ATTR_CHOICES_CACHE = 'choices_cache'
+
+# Completion mode used to match the argument's choices instead of the completion_mode setting
+ATTR_COMPLETION_MODE = 'completion_mode'
+
 
 def generate_range_error(range_min: int, range_max: Union[int, float]) -> str:
     """Generate an error message when the the number of arguments provided is not within the expected range"""
@@ -296,6 +336,17 @@ class ChoicesCallable:
         self.is_completer = is_completer
         self.to_call = to_call
 
+        # Whether to_call has an arg_tokens parameter. This is checked once here instead of each time
+        # it is called since inspect.signature() is slow.
+        try:
+            self.takes_arg_tokens = ARG_TOKENS in inspect.signature(to_call).parameters
+        except (TypeError, ValueError):
+            # Some built-in functions don't provide a signature
+            self.takes_arg_tokens = False
+
+        # Set by the cached_choices decorator
+        self.cache = getattr(to_call, constants.CHOICES_ATTR_CACHE, None)
+
 
 def _set_choices_callable(action: argparse.Action, choices_callable: ChoicesCallable) -> None:
     """
@@ -354,6 +405,9 @@ def _add_argument_wrapper(self, *args,
                           completer_method: Optional[Callable] = None,
                           suppress_tab_hint: bool = False,
                           descriptive_header: Optional[str] = None,
+                          choices_cache_ttl: Optional[float] = None,
+                          choices_cache_key: Optional[Callable[[Dict[str, List[str]]], Hashable]] = None,
+                          completion_mode: Optional[str] = None,
                           **kwargs) -> argparse.Action:
     """
     Wrapper around _ActionsContainer.add_argument() which supports more settings used by cmd2
@@ -377,6 +431,14 @@ def _add_argument_wrapper(self, *args,
                               regardless of the value passed for suppress_tab_hint. Defaults to False.
     :param descriptive_header: if the provided choices are CompletionItems, then this header will display
                                during tab completion. Defaults to None.
+    :param choices_cache_ttl: number of seconds ArgparseCompleter keeps the results of this argument's choices or
+                              completer function/method before calling it again. Defaults to None, which uses the
+                              settings of the cached_choices decorator if the function has one and otherwise
+                              calls it for every completion.
+    :param choices_cache_key: function which receives the arg_tokens dictionary and returns a hashable value.
+                              Results are cached separately for each value. Only used with choices_cache_ttl.
+    :param completion_mode: one of the modes in constants.COMPLETION_MODES used to match this argument's choices.
+                            Defaults to None, which uses the completion_mode setting of the cmd2 app.
 
     # Args from original function
     :param kwargs: keyword-arguments recognized by argparse._ActionsContainer.add_argument
@@ -398,6 +460,17 @@ def _add_argument_wrapper(self, *args,
                    "choices_function, choices_method, completer_function, completer_method")
         raise (ValueError(err_msg))
 
+    if choices_cache_ttl is None:
+        if choices_cache_key is not None:
+            raise ValueError('choices_cache_key can only be used with choices_cache_ttl')
+    elif num_params_set == 0:
+        err_msg = ("choices_cache_ttl can only be used with one of the following parameters:\n"
+                   "choices_function, choices_method, completer_function, completer_method")
+        raise (ValueError(err_msg))
+
+    if completion_mode is not None and completion_mode not in constants.COMPLETION_MODES:
+        raise ValueError('completion_mode must be one of {}'.format(constants.COMPLETION_MODES))
+
     # Pre-process special ranged nargs
     nargs_range = None
 
@@ -466,6 +539,12 @@ def _add_argument_wrapper(self, *args,
     setattr(new_arg, ATTR_SUPPRESS_TAB_HINT, suppress_tab_hint)
     setattr(new_arg, ATTR_DESCRIPTIVE_COMPLETION_HEADER, descriptive_header)
 
+    if choices_cache_ttl is not None:
+        setattr(new_arg, ATTR_CHOICES_CACHE, CacheSettings(choices_cache_ttl, key=choices_cache_key))
+
+    if completion_mode is not None:
+        setattr(new_arg, ATTR_COMPLETION_MODE, completion_mode)
+
     return new_arg
 
 
@@ -0,0 +1,169 @@
+# coding=utf-8
+"""
+Cache of the results of choices and completer providers
+
+Providers which look up their results somewhere slow, like a remote inventory, can be cached by
+:class:`~cmd2.argparse_completer.ArgparseCompleter` for a period of time. Caching is enabled for a provider
+with the :func:`~cmd2.decorators.cached_choices` decorator or for one argument with the ``choices_cache_ttl``
+parameter of ``add_argument()``. Each :class:`~cmd2.Cmd` keeps its own :class:`ChoicesCache`, and entries are
+removed before they expire with :meth:`cmd2.Cmd.invalidate_choices_cache`.
+"""
+
+import argparse
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class CacheSettings:
+    """How the results of a choices or completer provider are cached"""
+    def __init__(self, ttl: float, *, key: Optional[Callable[[Dict[str, List[str]]], Hashable]] = None,
+                 refresh_in_background: bool = False) -> None:
+        """
+        CacheSettings initializer
+
+        :param ttl: number of seconds the results are used before the provider is called again
+        :param key: function which receives the arg_tokens dictionary of the argument being completed and returns
+                    a hashable value. Results are cached separately for each value it returns. Defaults to None,
+                    which caches one set of results for the argument.
+        :param refresh_in_background: if True, then results which have expired are still returned while the
+                                      provider is called in a background thread to refresh them. This is not
+                                      done for completers since they change the app's completion settings.
+        :raises: ValueError if ttl is negative
+        """
+        if ttl < 0:
+            raise ValueError('ttl cannot be negative')
+        self.ttl = ttl
+        self.key = key
+        self.refresh_in_background = refresh_in_background
+
+
+class _CacheEntry:
+    """Results of one call to a provider"""
+    def __init__(self, action: argparse.Action, provider: Callable, value: Any, settings: CacheSettings) -> None:
+        self.action = action
+        self.provider = provider
+        self.value = value
+        self.settings = settings
+        self.created = time.monotonic()
+
+    def expired(self, now: float) -> bool:
+        """Return whether the entry has expired and won't be used again. Expired entries whose settings
+        refresh them in the background are still used."""
+        return not self.settings.refresh_in_background and now - self.created >= self.settings.ttl
+
+
+def _unwrap(provider: Callable) -> Callable:
+    """Return the function of a bound method so it matches the function a ChoicesCallable calls"""
+    return getattr(provider, '__func__', provider)
+
+
+class ChoicesCache:
+    """Results of choices and completer providers, kept for the ttl of their CacheSettings"""
+    # Maximum number of entries. Completer results are cached separately for each line being completed,
+    # so the least recently used entries are removed once there are more than this.
+    MAX_ENTRIES = 1000
+
+    def __init__(self) -> None:
+        self._entries = collections.OrderedDict()  # type: Dict[Tuple, _CacheEntry]
+        self._lock = threading.Lock()
+
+        # Keys being refreshed in a background thread
+        self._refreshing = set()
+
+        # Incremented by invalidate() so background refreshes which started before it don't store their results
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, action: argparse.Action, provider: Callable, settings: CacheSettings, key: Hashable,
+            fetch: Callable[[], Any], *, allow_background: bool = True) -> Any:
+        """
+        Return cached results or call fetch to get new ones
+
+        :param action: the argument being completed
+        :param provider: the function fetch calls, which invalidate() matches entries against
+        :param settings: how the results are cached
+        :param key: identifies the results among others of the same argument and provider
+        :param fetch: function which calls the provider and returns the results to cache
+        :param allow_background: False if fetch can't be called from a background thread
+        :return: the results
+        :raises: any exception fetch raises, in which case nothing is cached
+        """
+        full_key = (action, provider, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self._entries.move_to_end(full_key)
+                if time.monotonic() - entry.created < settings.ttl:
+                    return entry.value
+                if settings.refresh_in_background and allow_background:
+                    if full_key not in self._refreshing:
+                        self._refreshing.add(full_key)
+                        thread = threading.Thread(target=self._refresh, daemon=True,
+                                                  args=(full_key, fetch, settings, self._generation))
+                        thread.start()
+                    return entry.value
+
+        value = fetch()
+        with self._lock:
+            self._store(full_key, _CacheEntry(action, provider, value, settings))
+        return value
+
+    def _store(self, full_key: Tuple, entry: _CacheEntry) -> None:
+        """Add or replace an entry and remove those which have expired or are over MAX_ENTRIES. The lock must be held."""
+        self._entries[full_key] = entry
+        self._entries.move_to_end(full_key)
+
+        now = time.monotonic()
+        for key in [key for key, cur_entry in self._entries.items() if key != full_key and cur_entry.expired(now)]:
+            del self._entries[key]
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def _refresh(self, full_key: Tuple, fetch: Callable[[], Any], settings: CacheSettings, generation: int) -> None:
+        """Replace the results of an entry. Runs in a background thread."""
+        try:
+            value = fetch()
+        except Exception:
+            # Drop the stale results so the next completion calls the provider and reports the error
+            value = None
+            failed = True
+        else:
+            failed = False
+
+        with self._lock:
+            self._refreshing.discard(full_key)
+            if generation != self._generation:
+                return
+            if failed:
+                self._entries.pop(full_key, None)
+            else:
+                action, provider, _ = full_key
+                self._store(full_key, _CacheEntry(action, provider, value, settings))
+
+    def invalidate(self, target: Optional[Any] = None) -> int:
+        """
+        Remove cached results so the providers are called again the next time they are needed
+
+        :param target: a provider function or method, or an argparse action, whose results are removed.
+                       Defaults to None, which removes all results.
+        :return: number of entries removed
+        """
+        with self._lock:
+            self._generation += 1
+            if target is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+
+            if isinstance(target, argparse.Action):
+                remove = [key for key, entry in self._entries.items() if entry.action is target]
+            else:
+                target = _unwrap(target)
+                remove = [key for key, entry in self._entries.items() if _unwrap(entry.provider) is target]
+            for key in remove:
+                del self._entries[key]
+            return len(remove)
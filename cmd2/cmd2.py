@@ -30,27 +30,34 @@ Git repository on GitHub at https://github.com/python-cmd2/cmd2
 # setting is True
 import argparse
 import cmd
-import glob
+import concurrent.futures
 import inspect
 import os
-import pickle
 import re
 import sys
 import threading
 from code import InteractiveConsole
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from contextlib import redirect_stdout
 from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Type, Union
 
 from . import ansi
 from . import constants
+from . import memory
+from . import metrics
 from . import plugin
+from . import profiling
+from . import tracing
 from . import utils
+from . import watchdog
 from .argparse_custom import CompletionItem, DEFAULT_ARGUMENT_PARSER
+from .choices_cache import ChoicesCache
 from .clipboard import can_clip, get_paste_buffer, write_to_paste_buffer
+from .compact_history import CompactHistory
 from .decorators import with_argparser
 from .exceptions import Cmd2ArgparseError, Cmd2ShlexError, EmbeddedConsoleExit, EmptyStatement
-from .history import History, HistoryItem
+from .history import BoundedHistory, History, HistoryItem, HistoryLog, SQLITE_HISTORY_EXTENSIONS
+from .history import history_stats, parse_history_time
 from .parsing import StatementParser, Statement, Macro, MacroArg, shlex_split
 from .rl_utils import rl_type, RlType, rl_get_point, rl_set_prompt, vt100_support, rl_make_safe_prompt, rl_warning
 from .utils import CompletionError, Settable
@@ -106,6 +113,49 @@ class _SavedCmd2Env:
         self.sys_stdin = None
 
 
+# Holds a _CompletionState in a thread while it finds completion matches in the background
+_background_completion = threading.local()
+
+
+class _CompletionState:
+    """Tab completion settings of a completion which runs in the background. See Cmd._complete_with_timeout()."""
+    def __init__(self, app: 'Cmd') -> None:
+        self.app = app
+        self.settings = {}
+
+
+class _CompletionSetting:
+    """
+    Descriptor of a tab completion setting of Cmd. It is stored as an instance attribute, except in a thread which
+    finds completion matches in the background for the instance. There it is stored in the thread's _CompletionState,
+    so it doesn't change the settings of the completion readline is displaying.
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def _settings(self, obj: 'Cmd') -> Dict[str, Any]:
+        """Return the dictionary which holds the setting of an instance in the current thread"""
+        state = getattr(_background_completion, 'state', None)
+        return state.settings if state is not None and state.app is obj else obj.__dict__
+
+    def __get__(self, obj: Optional['Cmd'], objtype=None) -> Any:
+        if obj is None:
+            return self
+        try:
+            return self._settings(obj)[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, obj: 'Cmd', value: Any) -> None:
+        self._settings(obj)[self.name] = value
+
+    def __delete__(self, obj: 'Cmd') -> None:
+        try:
+            del self._settings(obj)[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+
 # Contains data about a disabled command which is used to restore its original functions when the command is enabled
 DisabledCommand = namedtuple('DisabledCommand', ['command_function', 'help_function', 'completer_function'])
 
@@ -128,10 +178,28 @@ class Cmd(cmd.Cmd):
     ALPHABETICAL_SORT_KEY = utils.norm_fold
     NATURAL_SORT_KEY = utils.natural_keys
 
+    # Number of the most recent persistent history items which are loaded before the first prompt and added
+    # to the readline history. Older items are loaded in a background thread.
+    HISTORY_PRELOAD_LENGTH = 1000
+
+    # Number of the slowest commands listed by 'history --stats'
+    HISTORY_STATS_SLOWEST = 10
+
+    # Tab completion settings, which are described in __init__(). See _CompletionSetting.
+    allow_appended_space = _CompletionSetting('allow_appended_space')
+    allow_closing_quote = _CompletionSetting('allow_closing_quote')
+    completion_header = _CompletionSetting('completion_header')
+    completion_matches = _CompletionSetting('completion_matches')
+    display_matches = _CompletionSetting('display_matches')
+    matches_delimited = _CompletionSetting('matches_delimited')
+    matches_sorted = _CompletionSetting('matches_sorted')
+    matches_fuzzy = _CompletionSetting('matches_fuzzy')
+
     def __init__(self, completekey: str = 'tab', stdin=None, stdout=None, *,
                  persistent_history_file: str = '', persistent_history_length: int = 1000,
-                 startup_script: str = '', use_ipython: bool = False,
-                 allow_cli_args: bool = True, transcript_files: Optional[List[str]] = None,
+                 persistent_history_fsync: bool = False, compact_history: bool = False, bounded_history: bool = False,
+                 startup_script: str = '', use_ipython: bool = False, allow_cli_args: bool = True,
+                 transcript_files: Optional[List[str]] = None,
                  allow_redirection: bool = True, multiline_commands: Optional[List[str]] = None,
                  terminators: Optional[List[str]] = None, shortcuts: Optional[Dict[str, str]] = None) -> None:
         """An easy but powerful framework for writing line-oriented command
@@ -143,6 +211,18 @@ class Cmd(cmd.Cmd):
         :param persistent_history_file: file path to load a persistent cmd2 command history from
         :param persistent_history_length: max number of history items to write
                                           to the persistent history file
+        :param persistent_history_fsync: if ``True``, then each command is flushed to disk
+                                         with ``os.fsync()`` after it is written to the
+                                         persistent history file
+        :param compact_history: if ``True``, then history is stored in compact columns instead of
+                                as objects, which uses much less memory in long sessions. See
+                                :class:`cmd2.compact_history.CompactHistory`. This does not apply
+                                to persistent history stored in an SQLite database.
+        :param bounded_history: if ``True``, then the oldest commands are evicted from history and
+                                ``readline`` history as new ones are added so they never hold more
+                                than ``persistent_history_length`` commands, instead of history
+                                only being truncated at exit. See :class:`cmd2.history.BoundedHistory`.
+                                This does not apply to persistent history stored in an SQLite database.
         :param startup_script: file path to a script to execute at startup
         :param use_ipython: should the "ipy" command be included for an embedded IPython shell
         :param allow_cli_args: if ``True``, then :meth:`cmd2.Cmd.__init__` will process command
@@ -190,18 +270,58 @@ class Cmd(cmd.Cmd):
         self.allow_redirection = allow_redirection  # Security setting to prevent redirection of stdout
 
         # Attributes which ARE dynamically settable via the set command at runtime
+        self.completion_mode = constants.COMPLETION_MODE_PREFIX  # How the text being tab completed is matched
+        self.completion_timeout = 0.0  # Finish tab completions which take longer than this many seconds in the background
         self.debug = False
         self.echo = False
         self.editor = Cmd.DEFAULT_EDITOR
         self.feedback_to_output = False  # Do not include nonessentials in >, | output by default (things like timing)
+        self.profile = False  # Profile each command and save the results of the slow ones
+        self.profile_dir = profiling.DEFAULT_PROFILE_DIR  # Directory where profile and sample results are saved
+        self.profile_threshold = 1.0  # Only save profile results of commands which took at least this many seconds
+        self.sample = False  # Sample the stack of each command and save the results of the slow ones
+        self.sample_interval = 0.01  # Seconds between stack samples
+        self.slow_command_threshold = 0.0  # Report the stack of commands which run longer than this many seconds
+        self.slow_command_timeout = 0.0  # Cancel commands which run longer than this many seconds
         self.quiet = False  # Do not suppress nonessential output
         self.timing = False  # Prints elapsed time for each command
 
+        # Tab completion hint displayed when completion_timeout passes before the results are ready
+        self.completion_loading_hint = 'Still loading completions' + constants.HORIZONTAL_ELLIPSIS
+
+        # Runs tab completions when completion_timeout is set. The last completion requested is kept until it
+        # finishes so pressing tab again on the same text uses its results. Completions of text nobody is
+        # waiting for any more are abandoned so they don't hold up new ones.
+        self._completion_worker = utils.BackgroundWorker('cmd2 completion')
+        self._pending_completion = None
+
+        # If greater than 0, path completion reuses directory listings for this many seconds while the directory's
+        # modification time stays the same. This speeds up completing in huge directories or on network file systems.
+        self.path_complete_cache_ttl = 0.0
+
+        # Path completion caches the users in the password database for this many seconds to complete ~user.
+        # If there are more than user_complete_max_users, only user names which were typed in full are completed.
+        self.user_complete_cache_ttl = 60.0
+        self.user_complete_max_users = 10000
+
         # The maximum number of CompletionItems to display during tab completion. If the number of completion
         # suggestions exceeds this number, they will be displayed in the typical columnized format and will
         # not include the description value of the CompletionItems.
         self.max_completion_items = 50
 
+        # The maximum number of profile results to keep in profile_dir. When a new result is saved, the oldest
+        # ones are deleted to stay within this limit. 0 means there is no limit.
+        self.profile_max_files = 100
+
+        # True while a command is being profiled or sampled since profilers can't be nested
+        self._profiling = False
+
+        # File which slow command reports are appended to. If None, they are printed to stderr.
+        self.slow_command_log = None
+
+        # If True, slow command reports include the stacks of all threads instead of just the command's thread
+        self.slow_command_all_threads = False
+
         # A dictionary mapping settable names to their Settable instance
         self.settables = dict()
         self.build_settables()
@@ -215,8 +335,15 @@ class Cmd(cmd.Cmd):
         # Commands to exclude from the help menu and tab completion
         self.hidden_commands = ['eof', '_relative_load', '_relative_run_script']
 
+        self.statement_parser = StatementParser(terminators=terminators,
+                                                multiline_commands=multiline_commands,
+                                                shortcuts=shortcuts)
+
         # Initialize history
+        self._compact_history = compact_history
+        self._bounded_history = bounded_history
         self._persistent_history_length = persistent_history_length
+        self._persistent_history_fsync = persistent_history_fsync
         self._initialize_history(persistent_history_file)
 
         # Commands to exclude from the history command
@@ -237,10 +364,6 @@ class Cmd(cmd.Cmd):
         # True if running inside a Python script or interactive console, False otherwise
         self._in_py = False
 
-        self.statement_parser = StatementParser(terminators=terminators,
-                                                multiline_commands=multiline_commands,
-                                                shortcuts=shortcuts)
-
         # Verify commands don't have invalid names (like starting with a shortcut)
         for cur_cmd in self.get_all_commands():
             valid, errmsg = self.statement_parser.is_valid_command(cur_cmd)
@@ -257,6 +380,27 @@ class Cmd(cmd.Cmd):
         # Context manager used to protect critical sections in the main thread from stopping due to a KeyboardInterrupt
         self.sigint_protection = utils.ContextFlag()
 
+        # Results of choices and completer functions which ArgparseCompleter caches. See invalidate_choices_cache().
+        self._choices_cache = ChoicesCache()
+
+        # Per-command latency and throughput metrics which are displayed by the stats command
+        self.metrics = metrics.MetricsRegistry()
+
+        # Seconds between writes of the metrics to the metrics_file setting
+        self._metrics_interval = 60.0
+
+        # Per-command memory usage which is recorded when track_memory is True and displayed by the memstats command
+        self.memory_tracker = memory.MemoryTracker()
+
+        # Creates a trace of spans for every command when set. See the trace_file setting for a simple way to set it.
+        self.tracer = None
+
+        # Trace of the command currently running, used to add steps to it
+        self._current_trace = None
+
+        # Watches commands when slow_command_threshold or slow_command_timeout are set
+        self._watchdog = watchdog.Watchdog(report=self._report_slow_command, cancel=self._cancel_slow_command)
+
         # If the current command created a process to pipe to, then this will be a ProcReader object.
         # Otherwise it will be None. Its used to know when a pipe process can be killed and/or waited upon.
         self._cur_pipe_proc_reader = None
@@ -384,6 +528,11 @@ class Cmd(cmd.Cmd):
         # If False, then complete() will sort the matches using self.default_sort_key before they are displayed.
         self.matches_sorted = False
 
+        # Set to True when the matches may not begin with the text being completed, like those found by the
+        # substring and fuzzy completion modes. complete() then keeps readline from replacing the text with the
+        # common prefix of the matches unless that prefix still matches the text.
+        self.matches_fuzzy = False
+
     def add_settable(self, settable: Settable) -> None:
         """
         Convenience method to add a settable parameter to ``self.settables``
@@ -413,14 +562,40 @@ class Cmd(cmd.Cmd):
                                                         ansi.STYLE_NEVER),
                                    choices=[ansi.STYLE_TERMINAL, ansi.STYLE_ALWAYS, ansi.STYLE_NEVER]))
 
+        self.add_settable(Settable('completion_mode', str,
+                                   'How tab completion matches text (valid values: '
+                                   '{}, {}, {})'.format(*constants.COMPLETION_MODES),
+                                   choices=constants.COMPLETION_MODES))
+        self.add_settable(Settable('completion_timeout', float,
+                                   "Seconds to wait for tab completion before finishing it in the background "
+                                   "(0 to always wait)"))
         self.add_settable(Settable('debug', bool, "Show full traceback on exception"))
         self.add_settable(Settable('echo', bool, "Echo command issued into output"))
         self.add_settable(Settable('editor', str, "Program used by 'edit'"))
         self.add_settable(Settable('feedback_to_output', bool, "Include nonessentials in '|', '>' results"))
         self.add_settable(Settable('max_completion_items', int,
                                    "Maximum number of CompletionItems to display during tab completion"))
+        self.add_settable(Settable('metrics_file', str, "File where command metrics are periodically written as JSON "
+                                                        "(empty to disable)", completer_method=Cmd.path_complete))
+        self.add_settable(Settable('metrics_interval', float, "Seconds between writes of metrics_file"))
+        self.add_settable(Settable('profile', bool, "Profile commands and save the results of slow ones"))
+        self.add_settable(Settable('profile_dir', str, "Directory where 'profile' and 'sample' save results",
+                                   completer_method=Cmd.path_complete))
+        self.add_settable(Settable('profile_threshold', float,
+                                   "Seconds a command must run for 'profile' and 'sample' to save its results"))
         self.add_settable(Settable('quiet', bool, "Don't print nonessential feedback"))
+        self.add_settable(Settable('sample', bool, "Sample the stacks of commands and save the results of slow ones"))
+        self.add_settable(Settable('sample_interval', float, "Seconds between stack samples"))
+        self.add_settable(Settable('share_history', bool,
+                                   "Add commands other sessions write to the persistent history file"))
+        self.add_settable(Settable('slow_command_threshold', float,
+                                   "Seconds after which the stack of a running command is reported (0 to disable)"))
+        self.add_settable(Settable('slow_command_timeout', float,
+                                   "Seconds after which a running command is cancelled (0 to disable)"))
         self.add_settable(Settable('timing', bool, "Report execution times"))
+        self.add_settable(Settable('trace_file', str, "File where command traces are written as JSON lines "
+                                                      "(empty to disable)", completer_method=Cmd.path_complete))
+        self.add_settable(Settable('track_memory', bool, "Record the memory used by each command"))
 
     # -----  Methods related to presenting output to the user -----
 
@@ -439,6 +614,91 @@ class Cmd(cmd.Cmd):
             raise ValueError("must be {}, {}, or {} (case-insensitive)".format(ansi.STYLE_TERMINAL, ansi.STYLE_ALWAYS,
                                                                                ansi.STYLE_NEVER))
 
+    @property
+    def metrics_file(self) -> str:
+        """Read-only property needed to support do_set when it reads metrics_file"""
+        path = self.metrics.dump_path
+        return '' if path is None else path
+
+    @metrics_file.setter
+    def metrics_file(self, new_val: str) -> None:
+        """Setter property needed to support do_set when it updates metrics_file"""
+        old_path = self.metrics.dump_path
+        if new_val:
+            # Write the file right away so a path which can't be written is reported and the current dump is kept
+            path = os.path.expanduser(new_val)
+            self.metrics.dump(path)
+            self.metrics.start_periodic_dump(path, self._metrics_interval)
+        elif old_path is not None:
+            # Write the metrics recorded since the last periodic dump
+            self.metrics.stop_periodic_dump()
+            self.metrics.dump(old_path)
+
+    @property
+    def metrics_interval(self) -> float:
+        """Read-only property needed to support do_set when it reads metrics_interval"""
+        return self._metrics_interval
+
+    @metrics_interval.setter
+    def metrics_interval(self, new_val: float) -> None:
+        """Setter property needed to support do_set when it updates metrics_interval"""
+        if new_val <= 0:
+            raise ValueError("must be greater than 0")
+        self._metrics_interval = new_val
+
+        path = self.metrics.dump_path
+        if path is not None:
+            self.metrics.start_periodic_dump(path, new_val)
+
+    @property
+    def share_history(self) -> bool:
+        """Read-only property needed to support do_set when it reads share_history"""
+        persistent_log = self.history.persistent_log
+        return persistent_log is not None and persistent_log.share
+
+    @share_history.setter
+    def share_history(self, new_val: bool) -> None:
+        """Setter property needed to support do_set when it updates share_history"""
+        persistent_log = self.history.persistent_log
+        if persistent_log is None:
+            if new_val:
+                raise ValueError("requires a persistent history file")
+            return
+        persistent_log.share = new_val
+
+    @property
+    def track_memory(self) -> bool:
+        """Read-only property needed to support do_set when it reads track_memory"""
+        return self.memory_tracker.tracking
+
+    @track_memory.setter
+    def track_memory(self, new_val: bool) -> None:
+        """Setter property needed to support do_set when it updates track_memory"""
+        if new_val:
+            self.memory_tracker.start()
+        else:
+            self.memory_tracker.stop()
+
+    @property
+    def trace_file(self) -> str:
+        """Read-only property needed to support do_set when it reads trace_file"""
+        if self.tracer is not None and isinstance(self.tracer.exporter, tracing.JsonLinesExporter):
+            return self.tracer.exporter.path
+        return ''
+
+    @trace_file.setter
+    def trace_file(self, new_val: str) -> None:
+        """Setter property needed to support do_set when it updates trace_file. This replaces any existing tracer."""
+        # Create the new tracer first so the current one is kept if the file can't be opened
+        new_tracer = None
+        if new_val:
+            new_tracer = tracing.Tracer(tracing.JsonLinesExporter(os.path.expanduser(new_val)))
+
+        old_tracer = self.tracer
+        self.tracer = new_tracer
+        if old_tracer is not None:
+            old_tracer.shutdown()
+
     def _completion_supported(self) -> bool:
         """Return whether tab completion is supported"""
         return self.use_rawinput and self.completekey and rl_type != RlType.NONE
@@ -601,11 +861,8 @@ class Cmd(cmd.Cmd):
 
     # -----  Methods related to tab completion -----
 
-    def _reset_completion_defaults(self) -> None:
-        """
-        Resets tab completion settings
-        Needs to be called each time readline runs tab completion
-        """
+    def _reset_completion_settings(self) -> None:
+        """Resets the tab completion settings which completer functions change"""
         self.allow_appended_space = True
         self.allow_closing_quote = True
         self.completion_header = ''
@@ -613,6 +870,14 @@ class Cmd(cmd.Cmd):
         self.display_matches = []
         self.matches_delimited = False
         self.matches_sorted = False
+        self.matches_fuzzy = False
+
+    def _reset_completion_defaults(self) -> None:
+        """
+        Resets tab completion settings
+        Needs to be called each time readline runs tab completion
+        """
+        self._reset_completion_settings()
 
         if rl_type == RlType.GNU:
             readline.set_completion_display_matches_hook(self._display_matches_gnu_readline)
@@ -620,6 +885,18 @@ class Cmd(cmd.Cmd):
             # noinspection PyUnresolvedReferences
             readline.rl.mode._display_completions = self._display_matches_pyreadline
 
+    def invalidate_choices_cache(self, target: Optional[Any] = None) -> int:
+        """
+        Remove results of choices and completer functions/methods which were cached during tab completion,
+        so they are called again the next time they are needed. Results are cached when the function uses the
+        :func:`~cmd2.decorators.cached_choices` decorator or its argument was added with ``choices_cache_ttl``.
+
+        :param target: a choices or completer function/method, or an argparse action, whose results are removed.
+                       Defaults to None, which removes all cached results.
+        :return: number of cached results removed
+        """
+        return self._choices_cache.invalidate(target)
+
     def tokens_for_completion(self, line: str, begidx: int, endidx: int) -> Tuple[List[str], List[str]]:
         """Used by tab completion functions to get all tokens through the one being completed.
 
@@ -683,6 +960,23 @@ class Cmd(cmd.Cmd):
 
         return tokens, raw_tokens
 
+    def _complete_in_mode(self, text: str, line: str, begidx: int, endidx: int, match_against: Iterable, *,
+                          mode: Optional[str] = None) -> List[str]:
+        """
+        Match text against a list using a completion mode. The substring and fuzzy modes rank their matches,
+        so this sets matches_sorted to keep that order and matches_fuzzy since they may not begin with text.
+
+        :param mode: one of the modes in constants.COMPLETION_MODES. Defaults to self.completion_mode.
+        See utils.basic_complete() for the other parameters.
+        """
+        if mode is None:
+            mode = self.completion_mode
+        matches = utils.basic_complete(text, line, begidx, endidx, match_against, mode=mode)
+        if mode != constants.COMPLETION_MODE_PREFIX and text:
+            self.matches_sorted = True
+            self.matches_fuzzy = True
+        return matches
+
     def delimiter_complete(self, text: str, line: str, begidx: int, endidx: int,
                            match_against: Iterable, delimiter: str) -> List[str]:
         """
@@ -717,7 +1011,23 @@ class Cmd(cmd.Cmd):
         :param delimiter: what delimits each portion of the matches (ex: paths are delimited by a slash)
         :return: a list of possible tab completions
         """
-        matches = utils.basic_complete(text, line, begidx, endidx, match_against)
+        portion_prefix, _, portion_text = text.rpartition(delimiter)
+        if self.completion_mode == constants.COMPLETION_MODE_PREFIX or not portion_text:
+            matches = utils.basic_complete(text, line, begidx, endidx, match_against)
+        else:
+            # In the substring and fuzzy modes, the portion of text after its last delimiter is matched against
+            # the same portion of the strings. The portions before it must be the same.
+            if portion_prefix:
+                portion_prefix += delimiter
+            strings_by_portion = OrderedDict()
+            for cur_match in match_against:
+                if cur_match.startswith(portion_prefix):
+                    portion = cur_match[len(portion_prefix):].split(delimiter, 1)[0]
+                    strings_by_portion.setdefault(portion, []).append(cur_match)
+
+            matches = [cur_match
+                       for portion in self._complete_in_mode(portion_text, line, begidx, endidx, strings_by_portion)
+                       for cur_match in strings_by_portion[portion]]
 
         # Display only the portion of the match that's being completed based on delimiter
         if matches:
@@ -778,7 +1088,7 @@ class Cmd(cmd.Cmd):
 
         # Perform tab completion using an Iterable
         if isinstance(match_against, Iterable):
-            completions_matches = utils.basic_complete(text, line, begidx, endidx, match_against)
+            completions_matches = self._complete_in_mode(text, line, begidx, endidx, match_against)
 
         # Perform tab completion using a function
         elif callable(match_against):
@@ -822,7 +1132,7 @@ class Cmd(cmd.Cmd):
 
         # Perform tab completion using a Iterable
         if isinstance(match_against, Iterable):
-            matches = utils.basic_complete(text, line, begidx, endidx, match_against)
+            matches = self._complete_in_mode(text, line, begidx, endidx, match_against)
 
         # Perform tab completion using a function
         elif callable(match_against):
@@ -866,20 +1176,15 @@ class Cmd(cmd.Cmd):
                         user += os.path.sep
                     users.append(user)
             else:
-                import pwd
-
-                # Iterate through a list of users from the password database
-                for cur_pw in pwd.getpwall():
-
-                    # Check if the user has an existing home dir
-                    if os.path.isdir(cur_pw.pw_dir):
+                # Get the users with existing home dirs from a cache of the password database
+                for user_name in utils.get_users_with_home_dirs(text[1:], cache_ttl=self.user_complete_cache_ttl,
+                                                                max_users=self.user_complete_max_users):
 
-                        # Add a ~ to the user to match against text
-                        cur_user = '~' + cur_pw.pw_name
-                        if cur_user.startswith(text):
-                            if add_trailing_sep_if_dir:
-                                cur_user += os.path.sep
-                            users.append(cur_user)
+                    # Add a ~ to the user to match against text
+                    cur_user = '~' + user_name
+                    if add_trailing_sep_if_dir:
+                        cur_user += os.path.sep
+                    users.append(cur_user)
 
             return users
 
@@ -888,90 +1193,60 @@ class Cmd(cmd.Cmd):
         if endidx == len(line) or (endidx < len(line) and line[endidx] != os.path.sep):
             add_trailing_sep_if_dir = True
 
-        # Used to replace cwd in the final results
-        cwd = os.getcwd()
-        cwd_added = False
-
-        # Used to replace expanded user path in final result
-        orig_tilde_path = ''
-        expanded_tilde_path = ''
-
-        # If the search text is blank, then search in the CWD for *
-        if not text:
-            search_str = os.path.join(os.getcwd(), '*')
-            cwd_added = True
-        else:
-            # Purposely don't match any path containing wildcards
-            wildcards = ['*', '?']
-            for wildcard in wildcards:
-                if wildcard in text:
-                    return []
-
-            # Start the search string
-            search_str = text + '*'
-
-            # Handle tilde expansion and completion
-            if text.startswith('~'):
-                sep_index = text.find(os.path.sep, 1)
-
-                # If there is no slash, then the user is still completing the user after the tilde
-                if sep_index == -1:
-                    return complete_users()
-
-                # Otherwise expand the user dir
-                else:
-                    search_str = os.path.expanduser(search_str)
+        # Purposely don't match any path containing wildcards
+        wildcards = ['*', '?']
+        for wildcard in wildcards:
+            if wildcard in text:
+                return []
 
-                    # Get what we need to restore the original tilde path later
-                    orig_tilde_path = text[:sep_index]
-                    expanded_tilde_path = os.path.expanduser(orig_tilde_path)
+        # If there is no slash after a tilde, then the user is still completing the user after the tilde
+        if text.startswith('~') and text.find(os.path.sep, 1) == -1:
+            return complete_users()
 
-            # If the search text does not have a directory, then use the cwd
-            elif not os.path.dirname(text):
-                search_str = os.path.join(os.getcwd(), search_str)
-                cwd_added = True
+        # Split the text into the directory being searched, as it was typed, and the start of the names in it.
+        # Matches begin with the typed directory, so a tilde in it is kept.
+        name_prefix = os.path.basename(text)
+        typed_dir = text[:len(text) - len(name_prefix)]
+        search_dir = os.path.expanduser(typed_dir) if typed_dir else os.getcwd()
 
         # Set this to True for proper quoting of paths with spaces
         self.matches_delimited = True
 
-        # Find all matching path completions
-        matches = glob.glob(search_str)
+        try:
+            entries = utils.scan_directory(search_dir, cache_ttl=self.path_complete_cache_ttl)
+        except OSError:
+            return []
+
+        # Like glob, names are matched case-insensitively on Windows and hidden files only match a leading dot
+        if sys.platform.startswith('win'):
+            name_prefix = os.path.normcase(name_prefix)
+            entries = [(name, is_dir) for name, is_dir in entries if os.path.normcase(name).startswith(name_prefix)]
+        else:
+            entries = [(name, is_dir) for name, is_dir in entries if name.startswith(name_prefix)]
+        if not name_prefix.startswith('.'):
+            entries = [(name, is_dir) for name, is_dir in entries if not name.startswith('.')]
 
         # Filter out results that don't belong
         if path_filter is not None:
-            matches = [c for c in matches if path_filter(c)]
+            entries = [(name, is_dir) for name, is_dir in entries if path_filter(os.path.join(search_dir, name))]
 
         # Don't append a space or closing quote to directory
-        if len(matches) == 1 and os.path.isdir(matches[0]):
+        if len(entries) == 1 and entries[0][1]:
             self.allow_appended_space = False
             self.allow_closing_quote = False
 
         # Sort the matches before any trailing slashes are added
-        matches.sort(key=self.default_sort_key)
+        entries.sort(key=lambda entry: self.default_sort_key(entry[0]))
         self.matches_sorted = True
 
-        # Build display_matches and add a slash to directories
-        for index, cur_match in enumerate(matches):
-
-            # Display only the basename of this path in the tab completion suggestions
-            self.display_matches.append(os.path.basename(cur_match))
-
-            # Add a separator after directories if the next character isn't already a separator
-            if os.path.isdir(cur_match) and add_trailing_sep_if_dir:
-                matches[index] += os.path.sep
-                self.display_matches[index] += os.path.sep
-
-        # Remove cwd if it was added to match the text readline expects
-        if cwd_added:
-            if cwd == os.path.sep:
-                to_replace = cwd
-            else:
-                to_replace = cwd + os.path.sep
-            matches = [cur_path.replace(to_replace, '', 1) for cur_path in matches]
-
-        # Restore the tilde string if we expanded one to match the text readline expects
-        if expanded_tilde_path:
-            matches = [cur_path.replace(expanded_tilde_path, orig_tilde_path, 1) for cur_path in matches]
+        # Build the matches and display_matches in one pass, adding a separator after directories if the
+        # next character isn't already a separator. Only the names are displayed.
+        matches = []
+        for name, is_dir in entries:
+            if is_dir and add_trailing_sep_if_dir:
+                name += os.path.sep
+            matches.append(typed_dir + name)
+            self.display_matches.append(name)
 
         return matches
 
@@ -1360,8 +1635,6 @@ class Cmd(cmd.Cmd):
         # noinspection PyBroadException
         try:
             if state == 0:
-                self._reset_completion_defaults()
-
                 # Check if we are completing a multiline command
                 if self._at_continuation_prompt:
                     # lstrip and prepend the previously typed portion of this multiline command
@@ -1397,24 +1670,11 @@ class Cmd(cmd.Cmd):
                             begidx += len(shortcut_to_restore)
                             break
 
-                # If begidx is greater than 0, then we are no longer completing the first token (command name)
-                if begidx > 0:
-                    self._completion_for_command(text, line, begidx, endidx, shortcut_to_restore)
-
-                # Otherwise complete token against anything a user can run
+                if self.completion_timeout > 0:
+                    self._complete_with_timeout(text, line, begidx, endidx, shortcut_to_restore)
                 else:
-                    match_against = self._get_commands_aliases_and_macros_for_completion()
-                    self.completion_matches = utils.basic_complete(text, line, begidx, endidx, match_against)
-
-                # If we have one result and we are at the end of the line, then add a space if allowed
-                if len(self.completion_matches) == 1 and endidx == len(line) and self.allow_appended_space:
-                    self.completion_matches[0] += ' '
-
-                # Sort matches if they haven't already been sorted
-                if not self.matches_sorted:
-                    self.completion_matches.sort(key=self.default_sort_key)
-                    self.display_matches.sort(key=self.default_sort_key)
-                    self.matches_sorted = True
+                    self._reset_completion_defaults()
+                    self._find_completion_matches(text, line, begidx, endidx, shortcut_to_restore)
 
             try:
                 return self.completion_matches[state]
@@ -1437,6 +1697,95 @@ class Cmd(cmd.Cmd):
             rl_force_redisplay()
             return None
 
+    def _find_completion_matches(self, text: str, line: str, begidx: int, endidx: int,
+                                 shortcut_to_restore: str) -> None:
+        """
+        Find the matches for the text being completed and store them in self.completion_matches
+
+        :param text: the string prefix we are attempting to match (all matches must begin with it)
+        :param line: the current input line with leading whitespace removed
+        :param begidx: the beginning index of the prefix text
+        :param endidx: the ending index of the prefix text
+        :param shortcut_to_restore: if not blank, then this shortcut was removed from text and needs to be
+                                    prepended to all the matches
+        :raises: CompletionError if a completer raises one
+        """
+        # If begidx is greater than 0, then we are no longer completing the first token (command name)
+        if begidx > 0:
+            self._completion_for_command(text, line, begidx, endidx, shortcut_to_restore)
+
+        # Otherwise complete token against anything a user can run
+        else:
+            match_against = self._get_commands_aliases_and_macros_for_completion()
+            self.completion_matches = self._complete_in_mode(text, line, begidx, endidx, match_against)
+
+        # If we have one result and we are at the end of the line, then add a space if allowed
+        if len(self.completion_matches) == 1 and endidx == len(line) and self.allow_appended_space:
+            self.completion_matches[0] += ' '
+
+        # Sort matches if they haven't already been sorted
+        if not self.matches_sorted:
+            self.completion_matches.sort(key=self.default_sort_key)
+            self.display_matches.sort(key=self.default_sort_key)
+            self.matches_sorted = True
+
+        # Readline replaces the text being completed with the common prefix of the matches. When the matches
+        # don't begin with the text, only allow this if the prefix still matches it. Otherwise, give readline
+        # two matches whose common prefix is the text so it is kept, and display the real matches.
+        if self.matches_fuzzy and len(self.completion_matches) > 1:
+            orig_text = shortcut_to_restore + text
+            common_prefix = os.path.commonprefix(self.completion_matches)
+            if not utils.basic_complete(orig_text, line, begidx, endidx, [common_prefix],
+                                        mode=constants.COMPLETION_MODE_FUZZY):
+                if not self.display_matches:
+                    self.display_matches = self.completion_matches
+                self.completion_matches = [orig_text, orig_text + ' ']
+
+    def _complete_with_timeout(self, text: str, line: str, begidx: int, endidx: int,
+                               shortcut_to_restore: str) -> None:
+        """
+        Find completion matches in a background thread so a slow completer doesn't freeze the terminal.
+        This waits up to completion_timeout seconds for them. If they take longer, they are kept when they
+        are ready and used the next time tab is pressed on the same text.
+
+        See _find_completion_matches() for the parameters.
+        :raises: CompletionError with completion_loading_hint as its message if the matches are not ready
+                 or any CompletionError a completer raises
+        """
+        key = (text, line, begidx, endidx)
+        if self._pending_completion is None or self._pending_completion[0] != key:
+            if self._pending_completion is not None:
+                # Nobody will use these results, so don't find them if that hasn't started and don't wait for them
+                self._completion_worker.abandon(self._pending_completion[1])
+
+            def find_matches() -> Dict[str, Any]:
+                # This runs in a worker thread, so the settings completers change are stored in a
+                # _CompletionState instead of the attributes of the completion readline is displaying.
+                # The readline hooks are only set by the main thread.
+                _background_completion.state = _CompletionState(self)
+                try:
+                    self._reset_completion_settings()
+                    self._find_completion_matches(text, line, begidx, endidx, shortcut_to_restore)
+                    return _background_completion.state.settings
+                finally:
+                    _background_completion.state = None
+
+            self._pending_completion = (key, self._completion_worker.submit(find_matches))
+
+        future = self._pending_completion[1]
+        try:
+            completion_state = future.result(timeout=self.completion_timeout)
+        except concurrent.futures.TimeoutError:
+            raise CompletionError(self.completion_loading_hint, apply_style=False)
+        finally:
+            if future.done():
+                self._pending_completion = None
+
+        # Use the settings the completers chose for these matches
+        self._reset_completion_defaults()
+        for attr, value in completion_state.items():
+            setattr(self, attr, value)
+
     def _complete_argparse_command(self, text: str, line: str, begidx: int, endidx: int, *,
                                    argparser: argparse.ArgumentParser, preserve_quotes: bool) -> List[str]:
         """Completion function for argparse commands"""
@@ -1600,12 +1949,25 @@ class Cmd(cmd.Cmd):
         import datetime
 
         stop = False
+        error = False
+        record_metrics = False
+
+        # Tracing is skipped entirely when there is no tracer
+        trace = None
+        parent_trace = self._current_trace
+        if self.tracer is not None:
+            trace = self._current_trace = self.tracer.start_trace(tracing.SPAN_COMMAND, parent=parent_trace)
+
+        timer = metrics.CommandTimer(None if trace is None else trace.record_phase)
         try:
             statement = self._input_line_to_statement(line)
         except (EmptyStatement, Cmd2ShlexError) as ex:
+            self._current_trace = parent_trace
             if isinstance(ex, Cmd2ShlexError):
                 self.perror("Invalid syntax: {}".format(ex))
             return self._run_cmdfinalization_hooks(stop, None)
+        finally:
+            timer.lap(metrics.PHASE_PARSE, tracing.SPAN_PARSE)
 
         # now that we have a statement, run it with all the hooks
         try:
@@ -1618,11 +1980,14 @@ class Cmd(cmd.Cmd):
             # unpack the data object
             statement = data.statement
             stop = data.stop
+            timer.lap(metrics.PHASE_HOOKS, tracing.SPAN_POSTPARSING_HOOKS)
             if stop:
                 # we should not run the command, but
                 # we need to run the finalization hooks
                 raise EmptyStatement
 
+            record_metrics = True
+
             # Keep track of whether or not we were already _redirecting before this command
             already_redirecting = self._redirecting
 
@@ -1638,6 +2003,7 @@ class Cmd(cmd.Cmd):
 
                     redir_error, saved_state = self._redirect_output(statement)
                     self._cur_pipe_proc_reader = saved_state.pipe_proc_reader
+                timer.lap(metrics.PHASE_REDIRECTION, tracing.SPAN_REDIRECTION_SETUP)
 
                 # Do not continue if an error occurred while trying to redirect
                 if not redir_error:
@@ -1655,9 +2021,13 @@ class Cmd(cmd.Cmd):
 
                     # call precmd() for compatibility with cmd.Cmd
                     statement = self.precmd(statement)
+                    timer.lap(metrics.PHASE_HOOKS, tracing.SPAN_PRECMD_HOOKS)
 
                     # go run the command function
-                    stop = self.onecmd(statement, add_to_history=add_to_history)
+                    try:
+                        stop = self._onecmd_instrumented(statement, add_to_history=add_to_history)
+                    finally:
+                        timer.lap(metrics.PHASE_COMMAND, tracing.SPAN_COMMAND_BODY)
 
                     # postcommand hooks
                     data = plugin.PostcommandData(stop, statement)
@@ -1669,9 +2039,12 @@ class Cmd(cmd.Cmd):
 
                     # call postcmd() for compatibility with cmd.Cmd
                     stop = self.postcmd(stop, statement)
+                    timer.lap(metrics.PHASE_HOOKS, tracing.SPAN_POSTCMD_HOOKS)
 
                     if self.timing:
                         self.pfeedback('Elapsed: {}'.format(datetime.datetime.now() - timestart))
+                else:
+                    error = True
             finally:
                 # Get sigint protection while we restore stuff
                 with self.sigint_protection:
@@ -1684,16 +2057,33 @@ class Cmd(cmd.Cmd):
                     if py_bridge_call:
                         # Stop saving command's stdout before command finalization hooks run
                         self.stdout.pause_storage = True
+                timer.lap(metrics.PHASE_REDIRECTION, tracing.SPAN_REDIRECTION_RESTORE)
         except KeyboardInterrupt as ex:
+            error = True
             if raise_keyboard_interrupt:
                 raise ex
-        except (Cmd2ArgparseError, EmptyStatement):
+        except Cmd2ArgparseError:
+            # Don't do anything, but do allow command finalization hooks to run
+            error = True
+        except EmptyStatement:
             # Don't do anything, but do allow command finalization hooks to run
             pass
         except Exception as ex:
+            error = True
             self.pexcept(ex)
         finally:
             stop = self._run_cmdfinalization_hooks(stop, statement)
+            timer.lap(metrics.PHASE_HOOKS, tracing.SPAN_FINALIZATION)
+
+            # Only commands which made it past the postparsing hooks are recorded
+            if record_metrics:
+                self.metrics.record(statement.command, timer, error=error)
+
+            if trace is not None:
+                self._current_trace = parent_trace
+                if record_metrics:
+                    trace.finish(command=statement.command, statement_size=len(statement.raw),
+                                 status='error' if error else 'ok', stop=stop)
 
         return stop
 
@@ -1835,7 +2225,13 @@ class Cmd(cmd.Cmd):
             # Check if this command matches a macro and wasn't already processed to avoid an infinite loop
             if statement.command in self.macros.keys() and statement.command not in used_macros:
                 used_macros.append(statement.command)
-                line = self._resolve_macro(statement)
+                if self._current_trace is None:
+                    line = self._resolve_macro(statement)
+                else:
+                    start_ns = metrics.perf_counter_ns()
+                    line = self._resolve_macro(statement)
+                    self._current_trace.record_step(tracing.SPAN_MACRO_RESOLUTION, start_ns, metrics.perf_counter_ns(),
+                                                    macro=statement.command)
                 if line is None:
                     raise EmptyStatement
             else:
@@ -1936,6 +2332,8 @@ class Cmd(cmd.Cmd):
             else:
                 kwargs['start_new_session'] = True
 
+            start_ns = metrics.perf_counter_ns()
+
             # For any stream that is a StdSim, we will use a pipe so we can capture its output
             proc = subprocess.Popen(statement.pipe_to,
                                     stdin=subproc_stdin,
@@ -1953,6 +2351,10 @@ class Cmd(cmd.Cmd):
             except subprocess.TimeoutExpired:
                 pass
 
+            if self._current_trace is not None:
+                self._current_trace.record_step(tracing.SPAN_PIPE_START, start_ns, metrics.perf_counter_ns(),
+                                                pipe_to=statement.pipe_to)
+
             # Check if the pipe process already exited
             if proc.returncode is not None:
                 self.perror('Pipe process exited with code {} before command could run'.format(proc.returncode))
@@ -2024,7 +2426,10 @@ class Cmd(cmd.Cmd):
 
             # Check if we need to wait for the process being piped to
             if self._cur_pipe_proc_reader is not None:
+                start_ns = metrics.perf_counter_ns()
                 self._cur_pipe_proc_reader.wait()
+                if self._current_trace is not None:
+                    self._current_trace.record_step(tracing.SPAN_PIPE_WAIT, start_ns, metrics.perf_counter_ns())
 
         # Restore _cur_pipe_proc_reader. This always is done, regardless of whether this command redirected.
         self._cur_pipe_proc_reader = saved_state.saved_pipe_proc_reader
@@ -2075,9 +2480,9 @@ class Cmd(cmd.Cmd):
             if statement.command not in self.exclude_from_history and \
                     statement.command not in self.disabled_commands and add_to_history:
 
-                self.history.append(statement)
-
-            stop = func(statement)
+                stop = self._run_with_history(statement, func)
+            else:
+                stop = func(statement)
 
         else:
             stop = self.default(statement)
@@ -2094,7 +2499,7 @@ class Cmd(cmd.Cmd):
         """
         if self.default_to_shell:
             if 'shell' not in self.exclude_from_history:
-                self.history.append(statement)
+                return self._run_with_history(statement, lambda stmt: self.do_shell(stmt.command_and_args))
 
             # noinspection PyTypeChecker
             return self.do_shell(statement.command_and_args)
@@ -2272,6 +2677,10 @@ class Cmd(cmd.Cmd):
             self._startup_commands.clear()
 
             while not stop:
+                if self.share_history:
+                    self._merge_shared_history()
+                self._evict_readline_history()
+
                 # Get commands from user
                 try:
                     line = self._read_command_line(self.prompt)
@@ -3379,6 +3788,9 @@ class Cmd(cmd.Cmd):
                                       help='output commands and results to a transcript file,\nimplies -s',
                                       completer_method=path_complete)
     history_action_group.add_argument('-c', '--clear', action='store_true', help='clear all history')
+    history_action_group.add_argument('--stats', action='store_true',
+                                      help='show how often the selected commands ran, how long\n'
+                                           'they took, and which were slowest')
 
     history_format_group = history_parser.add_argument_group(title='formatting')
     history_format_group.add_argument('-s', '--script', action='store_true',
@@ -3394,11 +3806,21 @@ class Cmd(cmd.Cmd):
                                       help='display all commands, including ones persisted from\n'
                                            'previous sessions')
 
+    history_time_group = history_parser.add_argument_group(title='time range')
+    history_time_group.add_argument('--since', metavar='TIME',
+                                    help='only select commands which started at or after TIME,\n'
+                                         'e.g. 30m, 12h, 7d, 2w, or YYYY-MM-DD [HH:MM[:SS]]')
+    history_time_group.add_argument('--until', metavar='TIME',
+                                    help='only select commands which started at or before TIME')
+
     history_arg_help = ("empty               all history items\n"
                         "a                   one history item by number\n"
                         "a..b, a:b, a:, ..b  items by indices (inclusive)\n"
                         "string              items containing string\n"
                         "/regex/             items matching regular expression")
+    history_parser.add_argument('--fuzzy', action='store_true',
+                                help='treat arg as a string and select items which contain the\n'
+                                     'characters of each of its words in order')
     history_parser.add_argument('arg', nargs=argparse.OPTIONAL, help=history_arg_help)
 
     @with_argparser(history_parser)
@@ -3424,43 +3846,18 @@ class Cmd(cmd.Cmd):
             return
 
         if args.clear:
-            # Clear command and readline history
+            # Clear command and readline history. This also deletes the persistent history file.
             self.history.clear()
 
-            if self.persistent_history_file:
-                os.remove(self.persistent_history_file)
-
             if rl_type != RlType.NONE:
                 readline.clear_history()
             return
 
-        # If an argument was supplied, then retrieve partial contents of the history
-        cowardly_refuse_to_run = False
-        if args.arg:
-            # If a character indicating a slice is present, retrieve
-            # a slice of the history
-            arg = args.arg
-            arg_is_int = False
-            try:
-                int(arg)
-                arg_is_int = True
-            except ValueError:
-                pass
+        history, cowardly_refuse_to_run = self._select_history(args)
 
-            if '..' in arg or ':' in arg:
-                # Get a slice of history
-                history = self.history.span(arg, args.all)
-            elif arg_is_int:
-                history = [self.history.get(arg)]
-            elif arg.startswith(r'/') and arg.endswith(r'/'):
-                history = self.history.regex_search(arg, args.all)
-            else:
-                history = self.history.str_search(arg, args.all)
-        else:
-            # If no arg given, then retrieve the entire history
-            cowardly_refuse_to_run = True
-            # Get a copy of the history so it doesn't get mutated while we are using it
-            history = self.history.span(':', args.all)
+        if args.stats:
+            self._show_history_stats(history)
+            return
 
         if args.run:
             if cowardly_refuse_to_run:
@@ -3503,19 +3900,112 @@ class Cmd(cmd.Cmd):
             for hi in history:
                 self.poutput(hi.pr(script=args.script, expanded=args.expanded, verbose=args.verbose))
 
+    def _select_history(self, args: argparse.Namespace) -> Tuple[List[HistoryItem], bool]:
+        """
+        Return the history items selected by the arguments of the history command
+
+        :param args: the parsed arguments of the history command
+        :return: tuple of the selected items and whether running them should be refused because
+                 they weren't selected explicitly
+        :raises: ValueError if the arguments are invalid
+        """
+        since = None if args.since is None else parse_history_time(args.since)
+        until = None if args.until is None else parse_history_time(args.until)
+        timed = since is not None or until is not None
+
+        # If an argument was supplied, then retrieve partial contents of the history
+        if args.arg:
+            # If a character indicating a slice is present, retrieve
+            # a slice of the history
+            arg = args.arg
+            arg_is_int = False
+            try:
+                int(arg)
+                arg_is_int = True
+            except ValueError:
+                pass
+
+            if args.fuzzy:
+                history = self.history.fuzzy_search(arg, args.all)
+            elif '..' in arg or ':' in arg:
+                # Get a slice of history
+                history = self.history.span(arg, args.all)
+            elif arg_is_int:
+                history = [self.history.get(arg)]
+            elif arg.startswith(r'/') and arg.endswith(r'/'):
+                history = self.history.regex_search(arg, args.all)
+            else:
+                history = self.history.str_search(arg, args.all)
+
+            if timed:
+                in_range = set(id(item) for item in self.history.time_span(since, until, True))
+                history = [item for item in history if id(item) in in_range]
+            return history, False
+
+        if timed:
+            return self.history.time_span(since, until, args.all), False
+
+        # If no arg given, then retrieve the entire history
+        # Get a copy of the history so it doesn't get mutated while we are using it
+        return self.history.span(':', args.all), True
+
+    def _show_history_stats(self, history: List[HistoryItem]) -> None:
+        """Print how often the commands in a list of history items ran and how long they took"""
+        all_stats = history_stats(history)
+        if not all_stats:
+            self.poutput("No commands were selected")
+            return
+
+        def to_ms(value: float) -> str:
+            """Format seconds as milliseconds"""
+            return '{:.3f}'.format(value * 1000)
+
+        name_width = max(ansi.style_aware_wcswidth(cur_stats.command) for cur_stats in all_stats)
+        name_width = max(name_width, len('Command'))
+        row_format = '{:<{name_width}}  {:>7}  {:>7}  {:>12}  {:>10}  {:>10}'
+
+        self.poutput(row_format.format('Command', 'Count', 'Errors', 'Total (ms)', 'Mean (ms)', 'Max (ms)',
+                                       name_width=name_width))
+        for cur_stats in all_stats:
+            durations = [to_ms(cur_stats.total_duration), to_ms(cur_stats.mean_duration),
+                         to_ms(cur_stats.max_duration)] if cur_stats.timed else ['-'] * 3
+            self.poutput(row_format.format(cur_stats.command, cur_stats.count, cur_stats.errors, *durations,
+                                           name_width=name_width))
+
+        timed_items = [item for item in history if item.start_time]
+        if timed_items:
+            slowest = sorted(timed_items, key=lambda item: item.duration, reverse=True)[:self.HISTORY_STATS_SLOWEST]
+            self.poutput('\nSlowest commands:')
+            self.poutput('{:>10}  {}'.format('Time (ms)', 'Command'))
+            for item in slowest:
+                self.poutput('{:>10} {}'.format(to_ms(item.duration), item.pr()))
+
+    def _new_history(self, items: List[HistoryItem]) -> History:
+        """Create the history list used when history isn't stored in an SQLite database"""
+        max_length = self._persistent_history_length if self._bounded_history else 0
+        if self._compact_history:
+            return CompactHistory(items, parser=self.statement_parser, max_length=max_length)
+        if self._bounded_history:
+            return BoundedHistory(items, max_length=max_length)
+        return History(items)
+
     def _initialize_history(self, hist_file):
         """Initialize history using history related attributes
 
-        This function can determine whether history is saved in the prior text-based
-        format (one line of input is stored as one line in the file), or the new-as-
-        of-version 0.9.13 pickle based format.
+        The persistent history file is an append-only log written by :class:`cmd2.history.HistoryLog`,
+        or an SQLite database written by :class:`cmd2.sqlite_history.SqliteHistoryStore` if its
+        extension is one of :data:`cmd2.history.SQLITE_HISTORY_EXTENSIONS`. A history log is compressed
+        if its extension is one of :data:`cmd2.history.COMPRESSED_HISTORY_EXTENSIONS`.
+        This function can also read the pickle based format written by versions 0.9.13 through 1.0.
+        History created by versions <= 0.9.12 is in readline format, i.e. plain text files, and is ignored.
 
-        History created by versions <= 0.9.12 is in readline format, i.e. plain text files.
+        Only the most recent HISTORY_PRELOAD_LENGTH items of a history log are parsed and added to the
+        readline history before this returns. The older items are parsed in a background thread.
 
-        Initializing history does not effect history files on disk, versions >= 0.9.13 always
-        write history in the pickle format.
+        Initializing history does not effect history files on disk. Files in older formats are
+        converted when the first command is added to the history.
         """
-        self.history = History()
+        self.history = self._new_history([])
         # with no persistent history, nothing else in this method is relevant
         if not hist_file:
             self.persistent_history_file = hist_file
@@ -3539,29 +4029,40 @@ class Cmd(cmd.Cmd):
             self.pexcept(msg)
             return
 
-        # first we try and unpickle the history file
-        history = History()
-
+        if os.path.splitext(hist_file)[1].lower() in SQLITE_HISTORY_EXTENSIONS:
+            # Only import sqlite3 when it is needed
+            from .sqlite_history import SqliteHistory, SqliteHistoryStore
+            persistent_log = SqliteHistoryStore(hist_file, max_length=self._persistent_history_length,
+                                                fsync=self._persistent_history_fsync)
+        else:
+            persistent_log = HistoryLog(hist_file, max_length=self._persistent_history_length,
+                                        fsync=self._persistent_history_fsync)
+        older_lines = []
         try:
-            with open(hist_file, 'rb') as fobj:
-                history = pickle.load(fobj)
-        except (AttributeError, EOFError, FileNotFoundError, ImportError, IndexError, KeyError, ValueError,
-                pickle.UnpicklingError):
-            # If any of these errors occur when attempting to unpickle, just use an empty history
-            pass
+            if isinstance(persistent_log, HistoryLog):
+                # The indexes of the recent items account for the older ones which are loaded later
+                older_lines, items = persistent_log.load_recent(self.HISTORY_PRELOAD_LENGTH)
+            else:
+                items = persistent_log.load()
         except OSError as ex:
             msg = "Can not read persistent history file '{}': {}"
             self.pexcept(msg.format(hist_file, ex))
             return
 
+        if isinstance(persistent_log, HistoryLog):
+            history = self._new_history(items)
+            history.persistent_log = persistent_log
+            history.load_older(older_lines)
+        else:
+            history = SqliteHistory(items, store=persistent_log)
         self.history = history
         self.history.start_session()
         self.persistent_history_file = hist_file
 
-        # populate readline history
-        if rl_type != RlType.NONE:
+        # populate readline history with the most recent items
+        if rl_type != RlType.NONE and self.HISTORY_PRELOAD_LENGTH > 0:
             last = None
-            for item in history:
+            for item in history[-self.HISTORY_PRELOAD_LENGTH:]:
                 # Break the command into its individual lines
                 for line in item.raw.splitlines():
                     # readline only adds a single entry for multiple sequential identical lines
@@ -3570,24 +4071,89 @@ class Cmd(cmd.Cmd):
                         readline.add_history(line)
                         last = line
 
-        # register a function to write history at save
-        # if the history file is in plain text format from 0.9.12 or lower
-        # this will fail, and the history in the plain text file will be lost
+        # register a function to compact and close the history file at exit
         import atexit
         atexit.register(self._persist_history)
 
+    def _run_with_history(self, statement: Statement, func: Callable[[Statement], Optional[bool]]) -> Optional[bool]:
+        """Add a statement to history, run its command, and record the outcome of the command in its history item.
+        The item is written to the persistent history file if there is one once the command finishes.
+
+        :param statement: the statement to add to history
+        :param func: the function which runs the command
+        :return: the return value of func
+        """
+        import time
+
+        try:
+            history_item = self.history.append_running(statement)
+        except OSError as ex:
+            history_item = None
+            self._report_history_write_error(ex)
+
+        stop = None
+        error = True
+        start = time.perf_counter()
+        try:
+            stop = func(statement)
+            error = False
+        finally:
+            if history_item is not None:
+                try:
+                    self.history.record_outcome(history_item, duration=time.perf_counter() - start,
+                                                stop=bool(stop), error=error)
+                except OSError as ex:
+                    self._report_history_write_error(ex)
+        return stop
+
+    def _report_history_write_error(self, ex: OSError) -> None:
+        """Report an error writing to the persistent history file"""
+        msg = "Can not write persistent history file '{}': {}"
+        self.pexcept(msg.format(self.persistent_history_file, ex))
+
+    def _merge_shared_history(self) -> None:
+        """Add the commands other sessions have written to the persistent history file to history and readline"""
+        try:
+            new_items = self.history.merge_shared()
+        except OSError as ex:
+            msg = "Can not read persistent history file '{}': {}"
+            self.pexcept(msg.format(self.persistent_history_file, ex))
+            return
+
+        if rl_type != RlType.NONE:
+            for item in new_items:
+                for line in item.raw.splitlines():
+                    readline.add_history(line)
+
+    def _evict_readline_history(self) -> None:
+        """Remove the oldest readline history entries once there are more than history's max_length"""
+        if rl_type == RlType.NONE or self.history.max_length <= 0:
+            return
+
+        for _ in range(readline.get_current_history_length() - self.history.max_length):
+            readline.remove_history_item(0)
+
     def _persist_history(self):
-        """write history out to the history file"""
-        if not self.persistent_history_file:
+        """Compact the history file if it holds more than persistent_history_length commands and close it.
+
+        Commands are written to the file as they are run, so this only rewrites the file when it
+        has grown too long or is still in an older format.
+        """
+        persistent_log = self.history.persistent_log
+        if not self.persistent_history_file or persistent_log is None:
             return
 
         self.history.truncate(self._persistent_history_length)
         try:
-            with open(self.persistent_history_file, 'wb') as fobj:
-                pickle.dump(self.history, fobj)
+            # Other sessions may have added commands to the file
+            persistent_log.update_record_count()
+            if persistent_log.needs_rewrite or persistent_log.record_count > self._persistent_history_length:
+                persistent_log.compact(self.history)
         except OSError as ex:
             msg = "Can not write persistent history file '{}': {}"
             self.pexcept(msg.format(self.persistent_history_file, ex))
+        finally:
+            persistent_log.close()
 
     def _generate_transcript(self, history: List[Union[HistoryItem, str]], transcript_file: str) -> None:
         """
@@ -3677,6 +4243,371 @@ class Cmd(cmd.Cmd):
             msg = '{} {} saved to transcript file {!r}'
             self.pfeedback(msg.format(commands_run, plural, transcript_file))
 
+    def _onecmd_instrumented(self, statement: Statement, *, add_to_history: bool = True) -> bool:
+        """
+        Run onecmd() with the diagnostics enabled by settings: the slow command watchdog,
+        memory tracking, and the profilers.
+
+        :param statement: the command to run
+        :param add_to_history: passed to onecmd()
+        :return: the value returned by onecmd()
+        """
+        import contextlib
+
+        with contextlib.ExitStack() as stack:
+            if self.slow_command_threshold > 0 or self.slow_command_timeout > 0:
+                stack.enter_context(self._watchdog.watch(statement.command,
+                                                         threshold=self.slow_command_threshold,
+                                                         timeout=self.slow_command_timeout,
+                                                         all_threads=self.slow_command_all_threads))
+            if self.track_memory:
+                stack.enter_context(self.memory_tracker.measure(statement.command))
+            return self._onecmd_profiled(statement, add_to_history=add_to_history)
+
+    def _report_slow_command(self, watched: watchdog.WatchedCommand, stacks: str) -> None:
+        """
+        Called from the watchdog thread when a command has run longer than slow_command_threshold
+
+        :param watched: the slow command
+        :param stacks: the formatted stacks of the command's thread and optionally all other threads
+        """
+        msg = "Command {!r} has been running for {:.1f} seconds\n{}".format(watched.command, watched.elapsed, stacks)
+        if not self.slow_command_log:
+            self.perror(msg, end='', apply_style=False)
+            return
+
+        import time
+        try:
+            with open(os.path.expanduser(self.slow_command_log), 'a') as log_file:
+                log_file.write('[{}] {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), msg))
+        except OSError as ex:
+            self.pwarning('Failed to write slow command report: {}'.format(ex))
+
+    def _cancel_slow_command(self, watched: watchdog.WatchedCommand) -> None:
+        """
+        Called from the watchdog thread when a command has run longer than slow_command_timeout.
+        It is called repeatedly until the command finishes.
+
+        :param watched: the slow command
+        """
+        # Only commands on the main thread can be cancelled since that is where SIGINT is handled
+        if watched.thread_id != threading.main_thread().ident:
+            if watched.cancel_attempts == 1:
+                self.pwarning("Command {!r} timed out but can't be cancelled since it isn't running on the "
+                              "main thread".format(watched.command))
+            return
+
+        # Wait for the next attempt if the command is in a section which must not be interrupted
+        if self.sigint_protection:
+            return
+
+        self.pwarning("Cancelling command {!r} after {:.1f} seconds".format(watched.command, watched.elapsed))
+
+        # Deliver SIGINT to the command's thread so it is handled like Ctrl-C. Signaling the thread
+        # directly also interrupts blocking system calls, which _thread.interrupt_main() does not do.
+        import signal
+        if hasattr(signal, 'pthread_kill'):
+            signal.pthread_kill(watched.thread_id, signal.SIGINT)
+        else:  # pragma: no cover
+            import _thread
+            _thread.interrupt_main()
+
+    def _onecmd_profiled(self, statement: Statement, *, add_to_history: bool = True) -> bool:
+        """
+        Run onecmd() under the profilers enabled by the profile and sample settings and save the results
+        to profile_dir if the command took at least profile_threshold seconds.
+
+        :param statement: the command to run
+        :param add_to_history: passed to onecmd()
+        :return: the value returned by onecmd()
+        """
+        # Profilers can't be nested and the profile and sample commands run their own
+        if not (self.profile or self.sample) or self._profiling or statement.command in ('profile', 'sample'):
+            return self.onecmd(statement, add_to_history=add_to_history)
+
+        import time
+
+        profiler = None
+        sampler = None
+        if self.sample:
+            try:
+                sampler = profiling.SamplingProfiler(self.sample_interval)
+            except ValueError as ex:
+                self.pwarning('Invalid sample_interval: {}'.format(ex))
+
+        self._profiling = True
+        start = time.perf_counter()
+        try:
+            if sampler is not None:
+                sampler.start()
+            if self.profile:
+                stop, profiler, _ = profiling.run_profiled(self.onecmd, statement, add_to_history=add_to_history)
+            else:
+                stop = self.onecmd(statement, add_to_history=add_to_history)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+            self._profiling = False
+
+        if time.perf_counter() - start >= self.profile_threshold:
+            profile_dir = os.path.expanduser(self.profile_dir)
+            try:
+                if profiler is not None:
+                    file_path = profiling.save_profile(profiler, profile_dir, statement.command,
+                                                       max_files=self.profile_max_files)
+                    self.pfeedback('Profile results saved to {}'.format(file_path))
+                if sampler is not None and sampler.sample_count:
+                    file_path = profiling.save_samples(sampler, profile_dir, statement.command,
+                                                       max_files=self.profile_max_files)
+                    self.pfeedback('Sampled stacks saved to {}'.format(file_path))
+            except OSError as ex:
+                self.pwarning('Failed to save profile results: {}'.format(ex))
+        return stop
+
+    def _profiled_command_line(self, args: argparse.Namespace) -> str:
+        """Build the command line run by the profile and sample commands from their parsed arguments"""
+        # Unquote redirection and terminator tokens
+        tokens_to_unquote = list(constants.REDIRECTION_TOKENS)
+        tokens_to_unquote.extend(self.statement_parser.terminators)
+        utils.unquote_specific_tokens(args.command_args, tokens_to_unquote)
+
+        line = args.command
+        if args.command_args:
+            line += ' ' + ' '.join(args.command_args)
+        return line
+
+    profile_description = ("Run a command under the profiler and display or save the results\n"
+                           "\n"
+                           "To profile every command automatically, see the profile setting.")
+
+    profile_epilog = ("Notes:\n"
+                      "  To redirect the output of the profiled command instead of the profile results,\n"
+                      "  quote the redirection characters.\n"
+                      "\n"
+                      "  Saved results can be loaded with the pstats module or tools like snakeviz.")
+
+    profile_parser = DEFAULT_ARGUMENT_PARSER(description=profile_description, epilog=profile_epilog)
+    profile_parser.add_argument('-o', '--output_file', metavar='FILE',
+                                help='save the results to a file instead of displaying them',
+                                completer_method=path_complete)
+    profile_parser.add_argument('-s', '--sort', choices=profiling.PSTATS_SORT_KEYS, default='cumulative',
+                                help='how to sort the displayed results (default: cumulative)')
+    profile_parser.add_argument('-l', '--limit', type=int, default=30,
+                                help='maximum number of functions to display (default: 30)')
+    profile_parser.add_argument('command', help='command to profile',
+                                choices_method=_get_commands_aliases_and_macros_for_completion)
+    profile_parser.add_argument('command_args', nargs=argparse.REMAINDER, help='arguments to pass to command',
+                                completer_method=path_complete)
+
+    @with_argparser(profile_parser, preserve_quotes=True)
+    def do_profile(self, args: argparse.Namespace) -> Optional[bool]:
+        """Run a command under the profiler and display or save the results"""
+        if self._profiling:
+            self.perror("Cannot run profile while another command is being profiled or sampled")
+            return
+
+        line = self._profiled_command_line(args)
+
+        self._profiling = True
+        try:
+            stop, profiler, _ = profiling.run_profiled(self.onecmd_plus_hooks, line, add_to_history=False)
+        finally:
+            self._profiling = False
+
+        if args.output_file:
+            try:
+                profiler.dump_stats(os.path.expanduser(args.output_file))
+            except OSError as ex:
+                self.pexcept('Error saving {!r} - {}'.format(args.output_file, ex))
+            else:
+                self.pfeedback('Profile results saved to {}'.format(args.output_file))
+        else:
+            self.poutput(profiling.format_stats(profiler, sort_key=args.sort, limit=args.limit))
+
+        return stop
+
+    sample_description = ("Run a command under the sampling profiler and display or save the results\n"
+                          "\n"
+                          "The sampling profiler records the call stack at a regular interval from a\n"
+                          "background thread. It slows the command down much less than the profile\n"
+                          "command, which makes it better suited to commands which spend their time\n"
+                          "waiting on I/O. To sample every command automatically, see the sample setting.")
+
+    sample_epilog = ("Notes:\n"
+                     "  To redirect the output of the sampled command instead of the results,\n"
+                     "  quote the redirection characters.\n"
+                     "\n"
+                     "  Saved results are in the collapsed stack format used by flame graph tools\n"
+                     "  like flamegraph.pl and speedscope.")
+
+    sample_parser = DEFAULT_ARGUMENT_PARSER(description=sample_description, epilog=sample_epilog)
+    sample_parser.add_argument('-o', '--output_file', metavar='FILE',
+                               help='save the collapsed stacks to a file instead of displaying a summary',
+                               completer_method=path_complete)
+    sample_parser.add_argument('-i', '--interval', type=float,
+                               help='seconds between samples (default: the sample_interval setting)')
+    sample_parser.add_argument('-l', '--limit', type=int, default=30,
+                               help='maximum number of functions to display (default: 30)')
+    sample_parser.add_argument('command', help='command to sample',
+                               choices_method=_get_commands_aliases_and_macros_for_completion)
+    sample_parser.add_argument('command_args', nargs=argparse.REMAINDER, help='arguments to pass to command',
+                               completer_method=path_complete)
+
+    @with_argparser(sample_parser, preserve_quotes=True)
+    def do_sample(self, args: argparse.Namespace) -> Optional[bool]:
+        """Run a command under the sampling profiler and display or save the results"""
+        if self._profiling:
+            self.perror("Cannot run sample while another command is being profiled or sampled")
+            return
+
+        try:
+            sampler = profiling.SamplingProfiler(args.interval if args.interval is not None else self.sample_interval)
+        except ValueError as ex:
+            self.perror("Invalid interval: {}".format(ex))
+            return
+
+        line = self._profiled_command_line(args)
+
+        self._profiling = True
+        try:
+            with sampler:
+                stop = self.onecmd_plus_hooks(line, add_to_history=False)
+        finally:
+            self._profiling = False
+
+        if args.output_file:
+            try:
+                sampler.write_collapsed(os.path.expanduser(args.output_file))
+            except OSError as ex:
+                self.pexcept('Error saving {!r} - {}'.format(args.output_file, ex))
+            else:
+                self.pfeedback('Sampled stacks saved to {}'.format(args.output_file))
+            return stop
+
+        self.poutput('{} samples in {:.3f} seconds'.format(sampler.sample_count, sampler.elapsed))
+        if sampler.sample_count:
+            self.poutput('{:>8}  {:>8}  {}'.format('Self %', 'Total %', 'Function'))
+            for label, self_count, total_count in sampler.top_functions(args.limit):
+                self_pct = 100 * self_count / sampler.sample_count
+                total_pct = 100 * total_count / sampler.sample_count
+                self.poutput('{:>8.1f}  {:>8.1f}  {}'.format(self_pct, total_pct, label))
+        return stop
+
+    def _get_stats_command_names(self) -> List[str]:
+        """Return the names of the commands which have recorded metrics"""
+        return self.metrics.commands()
+
+    stats_description = "Show latency and throughput metrics for commands run during this session"
+
+    stats_parser = DEFAULT_ARGUMENT_PARSER(description=stats_description)
+    stats_action_group = stats_parser.add_mutually_exclusive_group()
+    stats_action_group.add_argument('-o', '--output_file', metavar='FILE',
+                                    help='write metrics to a JSON file instead of displaying them',
+                                    completer_method=path_complete)
+    stats_action_group.add_argument('-r', '--reset', action='store_true', help='discard all recorded metrics')
+    stats_parser.add_argument('-v', '--verbose', action='store_true',
+                              help='include the time spent in each phase of running a command')
+    stats_parser.add_argument('command', nargs=argparse.ZERO_OR_MORE, help='commands to show (defaults to all)',
+                              choices_method=_get_stats_command_names)
+
+    @with_argparser(stats_parser)
+    def do_stats(self, args: argparse.Namespace) -> None:
+        """Show latency and throughput metrics for commands run during this session"""
+        if args.reset:
+            self.metrics.reset()
+            return
+
+        if args.output_file:
+            try:
+                self.metrics.dump(os.path.expanduser(args.output_file))
+            except OSError as ex:
+                self.pexcept('Error saving {!r} - {}'.format(args.output_file, ex))
+            else:
+                self.pfeedback('Metrics saved to {}'.format(args.output_file))
+            return
+
+        names = args.command if args.command else self.metrics.commands()
+        all_metrics = [self.metrics.get(name) for name in sorted(names, key=self.default_sort_key)]
+        all_metrics = [cur_metrics for cur_metrics in all_metrics if cur_metrics is not None]
+        if not all_metrics:
+            self.poutput("No metrics have been recorded")
+            return
+
+        def to_ms(value_ns: float) -> str:
+            """Format nanoseconds as milliseconds"""
+            return '{:.3f}'.format(value_ns / 1000000)
+
+        name_width = max(ansi.style_aware_wcswidth(cur_metrics.name) for cur_metrics in all_metrics)
+        name_width = max(name_width, len('Command'))
+        row_format = '{:<{name_width}}  {:>7}  {:>7}  {:>10}  {:>10}  {:>10}  {:>10}'
+
+        self.poutput(row_format.format('Command', 'Calls', 'Errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Max (ms)',
+                                       name_width=name_width))
+        for cur_metrics in all_metrics:
+            latency = cur_metrics.latency
+            self.poutput(row_format.format(cur_metrics.name, cur_metrics.calls, cur_metrics.errors,
+                                           *[to_ms(latency.percentile(pct)) for pct in metrics.PERCENTILES],
+                                           to_ms(latency.max_ns), name_width=name_width))
+            if args.verbose:
+                phases = ['{}: {}'.format(phase, to_ms(cur_metrics.phase_ns[phase] / cur_metrics.calls))
+                          for phase in metrics.PHASES]
+                self.poutput('  mean (ms) - ' + ', '.join(phases))
+
+    def _get_memstats_command_names(self) -> List[str]:
+        """Return the names of the commands which have recorded memory usage"""
+        return self.memory_tracker.commands()
+
+    memstats_description = ("Show which commands retained the most memory during this session\n"
+                            "\n"
+                            "Memory usage is only recorded while memory tracking is enabled. To enable it:\n"
+                            "\n"
+                            "  set track_memory True")
+
+    memstats_parser = DEFAULT_ARGUMENT_PARSER(description=memstats_description)
+    memstats_parser.add_argument('-r', '--reset', action='store_true', help='discard all recorded memory usage')
+    memstats_parser.add_argument('-v', '--verbose', action='store_true',
+                                 help='include the source lines which retained the most memory')
+    memstats_parser.add_argument('command', nargs=argparse.ZERO_OR_MORE, help='commands to show (defaults to all)',
+                                 choices_method=_get_memstats_command_names)
+
+    @with_argparser(memstats_parser)
+    def do_memstats(self, args: argparse.Namespace) -> None:
+        """Show which commands retained the most memory during this session"""
+        if args.reset:
+            self.memory_tracker.reset()
+            return
+
+        names = args.command if args.command else self.memory_tracker.commands()
+        all_memory = [self.memory_tracker.get(name) for name in names]
+        all_memory = [cur_memory for cur_memory in all_memory if cur_memory is not None]
+        if not all_memory:
+            if self.track_memory:
+                self.poutput("No memory usage has been recorded")
+            else:
+                self.poutput("Memory tracking is disabled. To enable it: set track_memory True")
+            return
+
+        # Show the commands which retained the most memory first
+        all_memory.sort(key=lambda cur_memory: cur_memory.retained_bytes, reverse=True)
+
+        def to_kib(value: int) -> str:
+            """Format bytes as KiB"""
+            return '{:.1f}'.format(value / 1024)
+
+        name_width = max(ansi.style_aware_wcswidth(cur_memory.name) for cur_memory in all_memory)
+        name_width = max(name_width, len('Command'))
+        row_format = '{:<{name_width}}  {:>7}  {:>14}  {:>14}  {:>10}'
+
+        self.poutput(row_format.format('Command', 'Calls', 'Retained (KiB)', 'Peak (KiB)', 'GC Objects',
+                                       name_width=name_width))
+        for cur_memory in all_memory:
+            self.poutput(row_format.format(cur_memory.name, cur_memory.calls, to_kib(cur_memory.retained_bytes),
+                                           to_kib(cur_memory.peak_bytes), cur_memory.gc_objects,
+                                           name_width=name_width))
+            if args.verbose:
+                for site, size in cur_memory.top_sites(self.memory_tracker.top_sites):
+                    self.poutput('  {:>10} KiB  {}'.format(to_kib(size), site))
+
     edit_description = ("Run a text editor and optionally open a file with it\n"
                         "\n"
                         "The editor used is determined by a settable parameter. To set it:\n"
@@ -0,0 +1,166 @@
+# coding=utf-8
+"""
+History which stores its items in compact columns
+
+:class:`CompactHistory` is a :class:`~cmd2.history.History` for sessions which run millions of commands.
+Instead of keeping a :class:`~cmd2.history.HistoryItem` and a :class:`~cmd2.Statement` for every command,
+it stores the raw and expanded text of all commands in one contiguous buffer indexed by an ``array('Q')``
+of offsets, along with arrays holding the index, timing, and outcome of each command. Items are built
+when they are accessed by parsing the expanded text again, so indexing, slicing, searching, and span()
+work as they do for :class:`~cmd2.history.History`.
+
+:class:`~cmd2.Cmd` uses it when its ``compact_history`` argument is True.
+"""
+
+import array
+from typing import Iterable, List, Optional
+
+from .exceptions import Cmd2ShlexError
+from .history import HistoryItem, _StoredHistory
+from .parsing import Statement, StatementParser
+
+# Bits of the flags column
+_STOP = 0x1
+_ERROR = 0x2
+
+# The expanded text is the same as the raw text, so only the raw text is stored
+_SAME_TEXT = 0x4
+
+
+class CompactHistory(_StoredHistory):
+    """
+    A :class:`~cmd2.history.History` which stores its items in compact columns instead of as objects
+
+    Each access to an item builds a new :class:`~cmd2.history.HistoryItem`, so items compare equal to the
+    ones which were added but are not the same objects. Statements are rebuilt by parsing their expanded
+    text with the terminators and multiline commands of the parser given to the initializer. Aliases and
+    shortcuts were expanded before the text was stored, so they are not expanded again.
+    """
+    def __init__(self, seq: Iterable[HistoryItem] = (), *, parser: Optional[StatementParser] = None,
+                 max_length: int = 0) -> None:
+        """
+        CompactHistory initializer
+
+        :param seq: items to add to the list
+        :param parser: parser whose terminators and multiline commands are used to rebuild statements.
+                       Defaults to a StatementParser with the default settings.
+        :param max_length: if greater than 0, then the oldest items are evicted as new ones are added
+                           so the list never holds more than this many
+        """
+        if parser is None:
+            parser = StatementParser()
+        self._parser = StatementParser(terminators=parser.terminators, multiline_commands=parser.multiline_commands,
+                                       shortcuts={})
+        self._init_columns()
+        super().__init__(seq, max_length=max_length)
+
+    def _init_columns(self) -> None:
+        """Create empty columns"""
+        # UTF-8 text of every item and the offsets of the start of each item's text, with one more offset
+        # for the end of the last item's text
+        self._text = bytearray()
+        self._offsets = array.array('Q', [0])
+
+        # Number of bytes at the start of _text which belong to items that were removed
+        self._garbage = 0
+
+        self._indexes = array.array('Q')
+        self._start_times = array.array('d')
+        self._durations = array.array('d')
+        self._flags = bytearray()
+
+        # Number of entries at the start of the columns which belong to items that were removed
+        self._first = 0
+
+    def _append_item(self, history_item: HistoryItem) -> None:
+        """Add an item to the end of the columns"""
+        raw = history_item.raw
+        expanded = history_item.expanded
+        flags = (_STOP if history_item.stop else 0) | (_ERROR if history_item.error else 0)
+        if raw == expanded:
+            flags |= _SAME_TEXT
+            self._text += raw.encode('utf-8')
+        else:
+            # The raw text is followed by a NUL which separates it from the expanded text
+            self._text += raw.encode('utf-8') + b'\0' + expanded.encode('utf-8')
+        self._offsets.append(self._garbage + len(self._text))
+
+        self._indexes.append(history_item.idx)
+        self._start_times.append(history_item.start_time)
+        self._durations.append(history_item.duration)
+        self._flags.append(flags)
+
+    def _get(self, pos: int) -> HistoryItem:
+        """Build the item at a non-negative position"""
+        pos += self._first
+        data = self._text[self._offsets[pos] - self._garbage:self._offsets[pos + 1] - self._garbage].decode('utf-8')
+        flags = self._flags[pos]
+        if flags & _SAME_TEXT:
+            raw = expanded = data
+        else:
+            raw, expanded = data.split('\0', 1)
+
+        try:
+            source = self._parser.parse(expanded).to_dict()
+            source['raw'] = raw
+            statement = Statement.from_dict(source)
+        except Cmd2ShlexError:
+            statement = Statement('', raw=raw)
+
+        return HistoryItem(statement, self._indexes[pos], self._start_times[pos], self._durations[pos],
+                           bool(flags & _STOP), bool(flags & _ERROR))
+
+    def _set(self, pos: int, history_item: HistoryItem) -> None:
+        current = self._get(pos)
+        if current.statement == history_item.statement and current.raw == history_item.raw:
+            # Only the index or outcome changed, like when History.record_outcome() replaces an item
+            pos += self._first
+            self._indexes[pos] = history_item.idx
+            self._start_times[pos] = history_item.start_time
+            self._durations[pos] = history_item.duration
+            self._flags[pos] = (self._flags[pos] & _SAME_TEXT) | (_STOP if history_item.stop else 0) | \
+                (_ERROR if history_item.error else 0)
+        else:
+            items = list(self)
+            items[pos] = history_item
+            self._reset(items)
+
+    def __len__(self) -> int:
+        return len(self._indexes) - self._first
+
+    def _remove_first(self, count: int) -> None:
+        """Remove items from the start of the list"""
+        self._first += count
+
+        # The columns of removed items are only released once they make up half of the columns,
+        # so evicting one item at a time doesn't move all the others each time
+        if self._first * 2 < len(self._indexes):
+            return
+
+        del self._offsets[:self._first]
+        del self._indexes[:self._first]
+        del self._start_times[:self._first]
+        del self._durations[:self._first]
+        del self._flags[:self._first]
+        del self._text[:self._offsets[0] - self._garbage]
+        self._garbage = self._offsets[0]
+        self._first = 0
+
+    def _reset(self, items: Iterable[HistoryItem]) -> None:
+        """Replace all columns with the given items"""
+        items = list(items)
+        self._init_columns()
+        for history_item in items:
+            self._append_item(history_item)
+
+    def time_span(self, since: Optional[float] = None, until: Optional[float] = None,
+                  include_persisted: bool = False) -> List[HistoryItem]:
+        """Find the history items whose commands started within a range of times. See :meth:`History.time_span`."""
+        if include_persisted:
+            self.load_all()
+        if self._time_index is None:
+            # Build the index from the start times column instead of building every item
+            offset = self._offset - self._first
+            self._time_index = sorted((self._start_times[pos], offset + pos)
+                                      for pos in range(self._first, len(self._indexes)))
+        return super().time_span(since, until, include_persisted)
@@ -48,3 +48,25 @@ CMD_ATTR_ARGPARSER = 'argparser'
 
 # Whether or not tokens are unquoted before sending to argparse
 CMD_ATTR_PRESERVE_QUOTES = 'preserve_quotes'
+
+##############################################################################
+# The following are optional attributes added to choices and completer functions
+##############################################################################
+
+# The CacheSettings used when ArgparseCompleter caches the results of the function
+CHOICES_ATTR_CACHE = 'choices_cache'
+
+##############################################################################
+# The following are the ways the completion_mode setting matches tab completions
+##############################################################################
+
+# Matches start with the text being completed
+COMPLETION_MODE_PREFIX = 'prefix'
+
+# Matches contain the text being completed, ignoring case
+COMPLETION_MODE_SUBSTRING = 'substring'
+
+# Matches contain the characters of the text being completed in order, ignoring case
+COMPLETION_MODE_FUZZY = 'fuzzy'
+
+COMPLETION_MODES = [COMPLETION_MODE_PREFIX, COMPLETION_MODE_SUBSTRING, COMPLETION_MODE_FUZZY]
@@ -1,7 +1,7 @@
 # coding=utf-8
 """Decorators for ``cmd2`` commands"""
 import argparse
-from typing import Callable, List, Optional, Union
+from typing import Callable, Dict, Hashable, List, Optional, Union
 
 from . import constants
 from .exceptions import Cmd2ArgparseError
@@ -31,6 +31,36 @@ def with_category(category: str) -> Callable:
     return cat_decorator
 
 
+def cached_choices(ttl: float, *, key: Optional[Callable[[Dict[str, List[str]]], Hashable]] = None,
+                   refresh_in_background: bool = False) -> Callable:
+    """A decorator which caches the results of a choices or completer function/method during tab completion.
+
+    The results are kept for each argument which uses the function and each ``cmd2.Cmd`` instance. Remove them
+    before they expire with :meth:`~cmd2.Cmd.invalidate_choices_cache`. The ``choices_cache_ttl`` parameter of
+    ``add_argument()`` overrides these settings for one argument.
+
+    :param ttl: number of seconds the results are used before the function is called again
+    :param key: function which receives the arg_tokens dictionary of the argument being completed and returns
+                a hashable value. Results are cached separately for each value it returns.
+    :param refresh_in_background: if ``True``, then expired results of a choices function are still returned
+                                  while the function is called in a background thread to refresh them
+
+    :Example:
+
+    >>> class MyApp(cmd2.Cmd):
+    >>>     @cmd2.cached_choices(30, key=lambda arg_tokens: arg_tokens['host'][0])
+    >>>     def disk_choices(self, arg_tokens):
+    >>>         return query_disks(arg_tokens['host'][0])
+    """
+    from .choices_cache import CacheSettings
+    settings = CacheSettings(ttl, key=key, refresh_in_background=refresh_in_background)
+
+    def cache_decorator(func):
+        setattr(func, constants.CHOICES_ATTR_CACHE, settings)
+        return func
+    return cache_decorator
+
+
 def with_argument_list(*args: List[Callable], preserve_quotes: bool = False) -> Callable[[List], Optional[bool]]:
     """
     A decorator to alter the arguments passed to a ``do_*`` method. Default
@@ -3,15 +3,38 @@
 History management classes
 """
 
+import bisect
+import collections
+import contextlib
+import itertools
+import json
+import os
+import pickle
 import re
+import sys
+import threading
+import time
+import zlib
 
-from typing import List, Union
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import attr
 
 from . import utils
 from .parsing import Statement
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Advisory file locks aren't available on Windows
+    fcntl = None
+
+# Extensions of persistent history files which are stored in an SQLite database by cmd2.sqlite_history
+SQLITE_HISTORY_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+# Extensions of persistent history files which are compressed, and the compression each one uses
+COMPRESSED_HISTORY_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+
 
 @attr.s(frozen=True)
 class HistoryItem():
@@ -22,6 +45,38 @@ class HistoryItem():
     statement = attr.ib(default=None, validator=attr.validators.instance_of(Statement))
     idx = attr.ib(default=None, validator=attr.validators.instance_of(int))
 
+    # Outcome of running the command. start_time is in seconds since the epoch and is 0 for commands
+    # which weren't timed, such as those added by History.append() or loaded from older history files.
+    start_time = attr.ib(default=0.0, validator=attr.validators.instance_of(float))
+    duration = attr.ib(default=0.0, validator=attr.validators.instance_of(float))
+    stop = attr.ib(default=False, validator=attr.validators.instance_of(bool))
+    error = attr.ib(default=False, validator=attr.validators.instance_of(bool))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the statement and outcome of this item in a form suitable for JSON encoding.
+        The index is not included since it depends on the History list the item is in."""
+        source = self.statement.to_dict()
+        if self.start_time:
+            source['outcome'] = [self.start_time, self.duration, int(self.stop), int(self.error)]
+        return source
+
+    @classmethod
+    def from_dict(cls, source: Dict[str, Any], idx: int) -> 'HistoryItem':
+        """Create a HistoryItem from the output of to_dict()
+
+        :param source: the dictionary to read
+        :param idx: index of the item
+        :raises: TypeError or ValueError if source is not valid
+        """
+        source = dict(source)
+        outcome = source.pop('outcome', None)
+        statement = Statement.from_dict(source)
+        if outcome is None:
+            return cls(statement, idx)
+
+        start_time, duration, stop, error = outcome
+        return cls(statement, idx, float(start_time), float(duration), bool(stop), bool(error))
+
     def __str__(self):
         """A convenient human readable representation of the history item"""
         return self.statement.raw
@@ -43,6 +98,23 @@ class HistoryItem():
         """
         return self.statement.expanded_command_line
 
+    @property
+    def search_key(self) -> str:
+        """The raw and expanded commands normalized and casefolded with :func:`cmd2.utils.norm_fold`,
+        separated by a NUL if they differ. String and fuzzy searches look in this text.
+
+        It is computed the first time it is needed and then kept with the item.
+        """
+        key = self.__dict__.get('_search_key')
+        if key is None:
+            raw = utils.norm_fold(self.raw)
+            expanded = utils.norm_fold(self.expanded)
+            key = raw if raw == expanded else raw + '\0' + expanded
+
+            # The item is frozen, so attrs has to be bypassed to store the key
+            object.__setattr__(self, '_search_key', key)
+        return key
+
     def pr(self, script=False, expanded=False, verbose=False) -> str:
         """Represent this item in a pretty fashion suitable for printing.
 
@@ -91,13 +163,96 @@ class History(list):
     Developers interested in accessing previously entered commands can use this
     class to gain access to the historical record.
     """
-    def __init__(self, seq=()) -> None:
+    def __init__(self, seq=(), *, max_length: int = 0) -> None:
+        """History initializer
+
+        :param seq: items to add to the list
+        :param max_length: if greater than 0, then the oldest items are evicted as new ones are added
+                           so the list never holds more than this many
+        """
         super().__init__(seq)
         self.session_start_index = 0
+        self.max_length = max_length
+
+        # Number of items which were evicted from the start of the list. The positions used by spans
+        # and searches count them, so the indexes of the remaining items don't change.
+        self._evicted = 0
+
+        # When set, statements are written to this log as they are appended
+        self.persistent_log = None
+
+        # Items which come before those in the list and are being loaded in the background
+        self._older = None
+
+        # Items waiting to be written to the persistent log in order, and the ids of those whose
+        # commands are still running
+        self._unwritten = []
+        self._running = set()
+
+        # (start_time, zero-based index) of the items sorted by start time. Built by time_span() when needed.
+        self._time_index = None
 
     def start_session(self) -> None:
         """Start a new session, thereby setting the next index as the first index in the new session."""
-        self.session_start_index = len(self)
+        self.session_start_index = self._offset + len(self)
+
+    def load_older(self, lines: List[bytes]) -> None:
+        """Parse the lines of a :class:`HistoryLog` for the items which come before those in the list
+        in a background thread.
+
+        The items are inserted at the start of the list the first time they are needed, such as when a
+        span or search reaches them, or when :meth:`load_all` is called. Until then, the list only holds
+        the newer items, but their indexes already account for the older ones. The items are never inserted
+        just because they finished loading, so ``len()``, indexing, and iteration don't depend on the timing
+        of the background thread.
+
+        :param lines: lines returned by :meth:`HistoryLog.load_recent`
+        """
+        if lines:
+            self._older = _OlderItems(lines)
+
+    @property
+    def _older_count(self) -> int:
+        """Number of older items which haven't been inserted into the list yet"""
+        return 0 if self._older is None else self._older.count
+
+    @property
+    def _offset(self) -> int:
+        """Number of items which come before those in the list because they were evicted or haven't been
+        inserted yet"""
+        return self._evicted + self._older_count
+
+    def load_all(self) -> None:
+        """Wait for older items being loaded in the background and insert them at the start of the list"""
+        if self._older is not None:
+            older = self._older
+            self._older = None
+            self[0:0] = older.wait()
+            self._time_index = None
+
+    def _real_slice(self, start: Optional[int], stop: Optional[int]) -> List[HistoryItem]:
+        """Return a slice of the history including older items which haven't been inserted into the list.
+        The older items are only waited for when the slice includes them.
+
+        :param start: zero-based index of the first item or None
+        :param stop: zero-based index after the last item or None
+        """
+        start, stop, _ = slice(start, stop).indices(self._offset + len(self))
+        if start < self._offset and start < stop:
+            self.load_all()
+
+        # Evicted items are left out
+        offset = self._offset
+        return self[max(start - offset, 0):max(stop - offset, 0)]
+
+    def _real_item(self, index: int) -> HistoryItem:
+        """Return a single item using a zero-based index which may be negative. See _real_slice()."""
+        total = self._offset + len(self)
+        if index < 0:
+            index += total
+        if not 0 <= index < total:
+            raise IndexError('list index out of range')
+        return self._real_slice(index, index + 1)[0]
 
     # noinspection PyMethodMayBeStatic
     def _zero_based_index(self, onebased: Union[int, str]) -> int:
@@ -112,15 +267,127 @@ class History(list):
 
         :param new: Statement object which will be composed into a HistoryItem
                     and added to the end of the list
+        :raises: OSError if the history has a persistent log which can't be written
+        """
+        self._add(new)
+
+    def append_running(self, new: Statement) -> HistoryItem:
+        """Append a statement for a command which is about to run. Its item records the time the command started.
+
+        The item is written to the persistent log once :meth:`record_outcome` has been called for it and
+        the items before it have been written. So a command which runs others, like ``run_script``, is still
+        written before them.
+
+        :param new: Statement object of the command
+        :return: the new item, which must be passed to record_outcome() once the command finishes
+        :raises: OSError if the history has a persistent log which can't be written
         """
-        history_item = HistoryItem(new, len(self) + 1)
+        return self._add(new, start_time=time.time())
+
+    def _add(self, new: Statement, *, start_time: float = 0.0) -> HistoryItem:
+        """Append an item for a statement. Untimed items are written to the persistent log right away
+        unless they are waiting on an item whose command is running."""
+        history_item = HistoryItem(new, self._offset + len(self) + 1, start_time)
+        self._append_item(history_item)
+        if self._time_index is not None:
+            bisect.insort(self._time_index, (start_time, history_item.idx - 1))
+
+        if start_time:
+            self._running.add(id(history_item))
+        if self.persistent_log is not None:
+            self._unwritten.append(history_item)
+            self._write_unwritten()
+
+        self._evict_excess()
+        return history_item
+
+    def _append_item(self, history_item: HistoryItem) -> None:
+        """Add an item to the end of the list. Subclasses which store their items differently override this."""
         super().append(history_item)
 
+    def _remove_first(self, count: int) -> None:
+        """Remove items from the start of the list. Subclasses which store their items differently override this."""
+        del self[:count]
+
+    def _evict_excess(self) -> None:
+        """Evict the oldest items if there are more than max_length"""
+        excess = self._older_count + len(self) - self.max_length
+        if self.max_length <= 0 or excess <= 0:
+            return
+
+        self.load_all()
+        self._remove_first(excess)
+        self._evicted += excess
+
+        # The time index keeps the entries of evicted items until it is rebuilt
+        if self._time_index is not None and len(self._time_index) > 2 * len(self):
+            self._time_index = None
+
+    def record_outcome(self, history_item: HistoryItem, *, duration: float, stop: bool = False,
+                       error: bool = False) -> None:
+        """Replace an item added by :meth:`append_running` with one which records the outcome of its command
+
+        :param history_item: the item returned by append_running()
+        :param duration: number of seconds the command ran
+        :param stop: True if the command stopped the application
+        :param error: True if the command raised an exception
+        :raises: OSError if the history has a persistent log which can't be written
+        """
+        if id(history_item) not in self._running:
+            # The list was cleared while the command ran
+            return
+        self._running.discard(id(history_item))
+
+        finished = attr.evolve(history_item, duration=float(duration), stop=bool(stop), error=bool(error))
+        pos = history_item.idx - 1 - self._offset
+        if pos >= 0:
+            # The item wasn't evicted while the command ran
+            self[pos] = finished
+
+        if self.persistent_log is not None:
+            self._unwritten[self._unwritten.index(history_item)] = finished
+            self._write_unwritten()
+
+    def _write_unwritten(self) -> None:
+        """Write the items at the start of the unwritten list whose commands aren't running"""
+        while self._unwritten and id(self._unwritten[0]) not in self._running:
+            self.persistent_log.append(self._unwritten.pop(0), self)
+
+    def merge_shared(self) -> List[HistoryItem]:
+        """Append the commands other sessions have added to the persistent log since the last call.
+
+        The commands are not written to the log again. This does nothing unless the log's ``share``
+        attribute is True.
+
+        :return: the new items, oldest first
+        :raises: OSError if the persistent log can't be read
+        """
+        # While commands are running, the items of other sessions would come before theirs in the list
+        # but after them in the log
+        if self.persistent_log is None or not self.persistent_log.share or self._unwritten:
+            return []
+
+        new_items = self.persistent_log.read_new(self._offset + len(self) + 1)
+        self.extend(new_items)
+        if self._time_index is not None:
+            for history_item in new_items:
+                bisect.insort(self._time_index, (history_item.start_time, history_item.idx - 1))
+        self._evict_excess()
+        return new_items
+
     def clear(self) -> None:
-        """Remove all items from the History list."""
+        """Remove all items from the History list and delete its persistent history file if it has one."""
+        self._older = None
+        self._evicted = 0
+        self._unwritten.clear()
+        self._running.clear()
+        self._time_index = None
         super().clear()
         self.start_session()
 
+        if self.persistent_log is not None:
+            self.persistent_log.clear()
+
     def get(self, index: Union[int, str]) -> HistoryItem:
         """Get item from the History list using 1-based indexing.
 
@@ -131,9 +398,9 @@ class History(list):
         if index == 0:
             raise IndexError('The first command in history is command 1.')
         elif index < 0:
-            return self[index]
+            return self._real_item(index)
         else:
-            return self[index - 1]
+            return self._real_item(index - 1)
 
     # This regular expression parses input for the span() method. There are five parts:
     #
@@ -216,24 +483,24 @@ class History(list):
 
         if start is not None and end is not None:
             # we have both start and end, return a slice of history
-            result = self[start:end]
+            result = self._real_slice(start, end)
         elif start is not None and sep is not None:
             # take a slice of the array
-            result = self[start:]
+            result = self._real_slice(start, None)
         elif end is not None and sep is not None:
             if include_persisted:
-                result = self[:end]
+                result = self._real_slice(None, end)
             else:
-                result = self[self.session_start_index:end]
+                result = self._real_slice(self.session_start_index, end)
         elif start is not None:
             # there was no separator so it's either a positive or negative integer
-            result = [self[start]]
+            result = [self._real_item(start)]
         else:
             # we just have a separator, return the whole list
             if include_persisted:
-                result = self[:]
+                result = self._real_slice(None, None)
             else:
-                result = self[self.session_start_index:]
+                result = self._real_slice(self.session_start_index, None)
         return result
 
     def str_search(self, search: str, include_persisted: bool = False) -> List[HistoryItem]:
@@ -243,15 +510,38 @@ class History(list):
         :param include_persisted: if True, then search full history including persisted history
         :return: a list of history items, or an empty list if the string was not found
         """
-        def isin(history_item):
-            """filter function for string search of history"""
-            sloppy = utils.norm_fold(search)
-            inraw = sloppy in utils.norm_fold(history_item.raw)
-            inexpanded = sloppy in utils.norm_fold(history_item.expanded)
-            return inraw or inexpanded
+        sloppy = utils.norm_fold(search)
+        search_list = self._real_slice(None if include_persisted else self.session_start_index, None)
+        return [item for item in search_list if sloppy in item.search_key]
+
+    def fuzzy_search(self, search: str, include_persisted: bool = False) -> List[HistoryItem]:
+        """Find history items which contain the characters of each word of a given string in order,
+        though not necessarily next to each other. For example, ``hst stat`` finds ``history --stats``.
+        Like :meth:`str_search`, the search ignores case and Unicode normalization.
 
-        search_list = self if include_persisted else self[self.session_start_index:]
-        return [item for item in search_list if isin(item)]
+        :param search: the string to search for
+        :param include_persisted: if True, then search full history including persisted history
+        :return: a list of history items, or an empty list if none matched
+        """
+        # Each word is found as a subsequence of either the raw or the expanded command, but not across both
+        words = utils.norm_fold(search).split()
+        finders = [re.compile('[^\0]*?'.join(re.escape(char) for char in word)) for word in words]
+
+        def matches(history_item):
+            """filter function for fuzzy search of history"""
+            key = history_item.search_key
+            return all(finder.search(key) for finder in finders)
+
+        search_list = self._real_slice(None if include_persisted else self.session_start_index, None)
+        return [item for item in search_list if matches(item)]
+
+    @staticmethod
+    def _regex_pattern(regex: str) -> str:
+        """Return the pattern of a regular expression search, removing the optional enclosing slashes"""
+        regex = regex.strip()
+        if regex.startswith(r'/') and regex.endswith(r'/'):
+            regex = regex[1:-1]
+        return regex
 
     def regex_search(self, regex: str, include_persisted: bool = False) -> List[HistoryItem]:
         """Find history items which match a given regular expression
@@ -260,18 +550,45 @@ class History(list):
         :param include_persisted: if True, then search full history including persisted history
         :return: a list of history items, or an empty list if the string was not found
         """
-        regex = regex.strip()
-        if regex.startswith(r'/') and regex.endswith(r'/'):
-            regex = regex[1:-1]
-        finder = re.compile(regex, re.DOTALL | re.MULTILINE)
+        finder = re.compile(self._regex_pattern(regex), re.DOTALL | re.MULTILINE)
 
         def isin(hi):
             """filter function for doing a regular expression search of history"""
             return finder.search(hi.raw) or finder.search(hi.expanded)
 
-        search_list = self if include_persisted else self[self.session_start_index:]
+        search_list = self._real_slice(None if include_persisted else self.session_start_index, None)
         return [itm for itm in search_list if isin(itm)]
 
+    def time_span(self, since: Optional[float] = None, until: Optional[float] = None,
+                  include_persisted: bool = False) -> List[HistoryItem]:
+        """Find the history items whose commands started within a range of times
+
+        An index of the items sorted by start time is built the first time this is called and kept up to
+        date as items are added. Items which weren't timed are never included.
+
+        :param since: earliest start time in seconds since the epoch or None for no limit
+        :param until: latest start time in seconds since the epoch or None for no limit
+        :param include_persisted: if True, then search full history including persisted history
+        :return: a list of history items in the order of the list
+        """
+        if include_persisted:
+            self.load_all()
+        if self._time_index is None:
+            offset = self._offset
+            self._time_index = sorted((item.start_time, offset + pos) for pos, item in enumerate(self))
+
+        # Skip the untimed items which have a start time of 0
+        low = bisect.bisect_right(self._time_index, (0.0, float('inf')))
+        if since is not None:
+            low = max(low, bisect.bisect_left(self._time_index, (since,)))
+        high = len(self._time_index)
+        if until is not None:
+            high = bisect.bisect_right(self._time_index, (until, float('inf')))
+
+        first = max(0 if include_persisted else self.session_start_index, self._evicted)
+        positions = sorted(pos for _, pos in self._time_index[low:high] if pos >= first)
+        return [self._real_item(pos) for pos in positions]
+
     def truncate(self, max_length: int) -> None:
         """Truncate the length of the history, dropping the oldest items if necessary
 
@@ -279,9 +596,864 @@ class History(list):
                            items will be deleted
         :return: nothing
         """
+        self.load_all()
+        self._time_index = None
         if max_length <= 0:
             # remove all history
             del self[:]
         elif len(self) > max_length:
             last_element = len(self) - max_length
             del self[0:last_element]
+
+
+class _StoredHistory(History):
+    """Base class for History lists which store their items somewhere other than the list itself
+
+    Subclasses implement __len__(), _get(), _set(), _append_item(), _remove_first(), and _reset(). Every
+    list method is implemented with them, since the methods inherited from list would use the list's own
+    storage, which is always empty.
+    """
+    def __init__(self, seq: Iterable[HistoryItem] = (), *, max_length: int = 0) -> None:
+        super().__init__(max_length=max_length)
+        self.extend(seq)
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _get(self, pos: int) -> HistoryItem:
+        """Return the item at a non-negative position"""
+        raise NotImplementedError
+
+    def _set(self, pos: int, history_item: HistoryItem) -> None:
+        """Replace the item at a non-negative position"""
+        raise NotImplementedError
+
+    def _reset(self, items: Iterable[HistoryItem]) -> None:
+        """Replace all items"""
+        raise NotImplementedError
+
+    def _slice(self, start: int, stop: int, step: int) -> List[HistoryItem]:
+        """Return the items at the positions of a slice whose indices have been resolved"""
+        return [self._get(pos) for pos in range(start, stop, step)]
+
+    def __iter__(self) -> Iterator[HistoryItem]:
+        for pos in range(len(self)):
+            yield self._get(pos)
+
+    def __reversed__(self) -> Iterator[HistoryItem]:
+        for pos in range(len(self) - 1, -1, -1):
+            yield self._get(pos)
+
+    def __contains__(self, history_item: object) -> bool:
+        return any(cur_item == history_item for cur_item in self)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, list):
+            return NotImplemented
+        return len(self) == len(other) and all(cur_item == other_item for cur_item, other_item in zip(self, other))
+
+    def __ne__(self, other: object) -> bool:
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self) -> str:
+        return '{}({!r})'.format(type(self).__name__, list(self))
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[HistoryItem, List[HistoryItem]]:
+        if isinstance(key, slice):
+            return self._slice(*key.indices(len(self)))
+
+        pos = key + len(self) if key < 0 else key
+        if not 0 <= pos < len(self):
+            raise IndexError('list index out of range')
+        return self._get(pos)
+
+    def __setitem__(self, key: Union[int, slice], value) -> None:
+        if isinstance(key, slice):
+            items = list(self)
+            items[key] = value
+            self._reset(items)
+            return
+
+        pos = key + len(self) if key < 0 else key
+        if not 0 <= pos < len(self):
+            raise IndexError('list assignment index out of range')
+        self._set(pos, value)
+
+    def __delitem__(self, key: Union[int, slice]) -> None:
+        start, stop, step = key.indices(len(self)) if isinstance(key, slice) else (key, key + 1, 1)
+        if start == 0 and step == 1:
+            # Remove items from the start of the list, like eviction and truncate() do
+            self._remove_first(min(max(stop, 0), len(self)))
+        else:
+            items = list(self)
+            del items[key]
+            self._reset(items)
+
+    def extend(self, items: Iterable[HistoryItem]) -> None:
+        """Add items to the end of the list"""
+        for history_item in items:
+            self._append_item(history_item)
+
+    def clear(self) -> None:
+        """Remove all items from the History list and delete its persistent history file if it has one."""
+        self._reset(())
+        super().clear()
+
+    def _modify(self, func: Callable[[List[HistoryItem]], Any]) -> Any:
+        """Call a function with a list of the items and replace the items with the list it changed"""
+        items = list(self)
+        result = func(items)
+        self._reset(items)
+        return result
+
+    def insert(self, index: int, history_item: HistoryItem) -> None:
+        self._modify(lambda items: items.insert(index, history_item))
+
+    def pop(self, index: int = -1) -> HistoryItem:
+        history_item = self[index]
+        del self[index]
+        return history_item
+
+    def remove(self, history_item: HistoryItem) -> None:
+        self._modify(lambda items: items.remove(history_item))
+
+    def index(self, history_item: HistoryItem, start: int = 0, stop: int = sys.maxsize) -> int:
+        return list(self).index(history_item, start, stop)
+
+    def count(self, history_item: HistoryItem) -> int:
+        return sum(1 for cur_item in self if cur_item == history_item)
+
+    def sort(self, *, key: Optional[Callable[[HistoryItem], Any]] = None, reverse: bool = False) -> None:
+        self._modify(lambda items: items.sort(key=key, reverse=reverse))
+
+    def reverse(self) -> None:
+        self._modify(lambda items: items.reverse())
+
+    def copy(self) -> List[HistoryItem]:
+        return list(self)
+
+    def __add__(self, other: List[HistoryItem]) -> List[HistoryItem]:
+        return list(self) + other
+
+    def __radd__(self, other: List[HistoryItem]) -> List[HistoryItem]:
+        return other + list(self)
+
+    def __iadd__(self, other: Iterable[HistoryItem]) -> '_StoredHistory':
+        self.extend(other)
+        return self
+
+    def __mul__(self, count: int) -> List[HistoryItem]:
+        return list(self) * count
+
+    __rmul__ = __mul__
+
+    def __imul__(self, count: int) -> '_StoredHistory':
+        self._reset(list(self) * count)
+        return self
+
+    def __lt__(self, other: object) -> bool:
+        return list(self) < other
+
+    def __le__(self, other: object) -> bool:
+        return list(self) <= other
+
+    def __gt__(self, other: object) -> bool:
+        return list(self) > other
+
+    def __ge__(self, other: object) -> bool:
+        return list(self) >= other
+
+
+class BoundedHistory(_StoredHistory):
+    """A :class:`History` which stores its items in a deque
+
+    Adding an item and evicting the oldest one once the list holds ``max_length`` items both take
+    constant time, so the history uses the same amount of memory no matter how long the session runs.
+    """
+    def __init__(self, seq: Iterable[HistoryItem] = (), *, max_length: int = 0) -> None:
+        """BoundedHistory initializer
+
+        :param seq: items to add to the list
+        :param max_length: if greater than 0, then the oldest items are evicted as new ones are added
+                           so the list never holds more than this many
+        """
+        self._items = collections.deque()
+        super().__init__(seq, max_length=max_length)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[HistoryItem]:
+        return iter(self._items)
+
+    def __reversed__(self) -> Iterator[HistoryItem]:
+        return reversed(self._items)
+
+    def _get(self, pos: int) -> HistoryItem:
+        return self._items[pos]
+
+    def _set(self, pos: int, history_item: HistoryItem) -> None:
+        self._items[pos] = history_item
+
+    def _slice(self, start: int, stop: int, step: int) -> List[HistoryItem]:
+        if step < 0:
+            return super()._slice(start, stop, step)
+
+        # Indexing a deque is slow away from its ends, so iterate over it instead
+        if len(self._items) - start < start:
+            # The slice is near the end
+            items = list(itertools.islice(reversed(self._items), len(self._items) - stop, len(self._items) - start))
+            items.reverse()
+            return items[::step]
+        return list(itertools.islice(self._items, start, stop, step))
+
+    def _append_item(self, history_item: HistoryItem) -> None:
+        self._items.append(history_item)
+
+    def _remove_first(self, count: int) -> None:
+        for _ in range(count):
+            self._items.popleft()
+
+    def _reset(self, items: Iterable[HistoryItem]) -> None:
+        self._items = collections.deque(items)
+
+
+# Seconds in each unit of a relative time accepted by parse_history_time()
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+# Formats of the absolute times accepted by parse_history_time()
+_TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_history_time(text: str, now: Optional[float] = None) -> float:
+    """Parse a time given to the history command's --since and --until options
+
+    :param text: either a time relative to now, like ``30m``, ``12h``, ``7d``, or ``2w``, or a local date
+                 and time in the form ``YYYY-MM-DD`` optionally followed by `` HH:MM`` and ``:SS``
+    :param now: current time in seconds since the epoch. Defaults to time.time().
+    :return: the time in seconds since the epoch
+    :raises: ValueError if text is not in one of these forms
+    """
+    import datetime
+
+    text = text.strip()
+    match = re.fullmatch(r'(\d+(?:\.\d*)?)([smhdw])', text)
+    if match:
+        if now is None:
+            now = time.time()
+        return now - float(match.group(1)) * _TIME_UNITS[match.group(2)]
+
+    for time_format in _TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        return time.mktime(parsed.timetuple())
+
+    raise ValueError("invalid time '{}': use a relative time like 30m, 12h, 7d, or 2w, "
+                     "or a date like YYYY-MM-DD [HH:MM[:SS]]".format(text))
+
+
+class CommandStats:
+    """Usage statistics of one command in a list of history items. Created by history_stats()."""
+    def __init__(self, command: str) -> None:
+        self.command = command
+        self.count = 0
+        self.errors = 0
+
+        # Number of items which were timed along with their total and longest durations in seconds
+        self.timed = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    @property
+    def mean_duration(self) -> float:
+        """Mean duration in seconds of the items which were timed"""
+        return self.total_duration / self.timed if self.timed else 0.0
+
+
+def history_stats(items: Iterable[HistoryItem]) -> List[CommandStats]:
+    """Summarize how often each command in a list of history items ran and how long it took
+
+    :param items: the history items to summarize
+    :return: the statistics of each command, most frequent first
+    """
+    all_stats = dict()
+    for item in items:
+        command = item.statement.command
+        cur_stats = all_stats.get(command)
+        if cur_stats is None:
+            cur_stats = all_stats[command] = CommandStats(command)
+
+        cur_stats.count += 1
+        if item.error:
+            cur_stats.errors += 1
+        if item.start_time:
+            cur_stats.timed += 1
+            cur_stats.total_duration += item.duration
+            cur_stats.max_duration = max(cur_stats.max_duration, item.duration)
+
+    return sorted(all_stats.values(), key=lambda cur_stats: (-cur_stats.count, cur_stats.command))
+
+
+class _OlderItems:
+    """Parses the older items of a History in a background thread. Created by History.load_older()."""
+    def __init__(self, lines: List[bytes]) -> None:
+        self.count = len(lines)
+        self._items = []
+        self._thread = threading.Thread(name='history_load_thread', target=self._run, args=(lines,), daemon=True)
+        self._thread.start()
+
+    def _run(self, lines: List[bytes]) -> None:
+        """Body of the loading thread"""
+        self._items = HistoryLog.parse_lines(lines)
+
+    def done(self) -> bool:
+        """Return whether the items have been loaded"""
+        return not self._thread.is_alive()
+
+    def wait(self) -> List[HistoryItem]:
+        """Wait for the items to be loaded and return them"""
+        self._thread.join()
+        return self._items
+
+
+class _Codec:
+    """Compresses and decompresses the members of a compressed history file
+
+    Every write to the file is a complete member. Files made of several members are still valid
+    gzip, bzip2, and xz files, so the usual tools can read them.
+    """
+    def __init__(self, compression: str) -> None:
+        """_Codec initializer
+
+        :param compression: 'gzip', 'bz2', or 'lzma'
+        :raises: ImportError if Python was built without the module for the compression
+        """
+        if compression == 'gzip':
+            # The gzip format is zlib's deflate with a gzip header and trailer
+            wbits = 16 + zlib.MAX_WBITS
+            self.compressor = lambda: zlib.compressobj(wbits=wbits)
+            self.decompressor = lambda: zlib.decompressobj(wbits=wbits)
+            self.errors = (zlib.error,)
+        elif compression == 'bz2':
+            import bz2
+            self.compressor = bz2.BZ2Compressor
+            self.decompressor = bz2.BZ2Decompressor
+            self.errors = (OSError,)
+        elif compression == 'lzma':
+            import lzma
+            self.compressor = lzma.LZMACompressor
+            self.decompressor = lzma.LZMADecompressor
+            self.errors = (lzma.LZMAError,)
+        else:
+            raise ValueError("unknown compression '{}'".format(compression))
+
+    def compress(self, data: bytes) -> bytes:
+        """Return data compressed as one member"""
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+
+class _LineReader:
+    """Iterates over the lines of a history file without their newlines
+
+    The file is read in chunks, and decompressed as it is read if it is compressed, so a large file
+    is never held in memory at once.
+    """
+    # Number of bytes read from the file at a time
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, fobj: BinaryIO, codec: Optional[_Codec]) -> None:
+        self._fobj = fobj
+        self._codec = codec
+
+        # Number of lines read so far
+        self.count = 0
+
+        # Data after the last newline once all lines have been read
+        self.partial = b''
+
+        # True if the file ends with an incomplete or invalid compressed member
+        self.truncated = False
+
+    def _chunks(self) -> Iterator[bytes]:
+        """Yield the contents of the file in chunks, decompressing them if needed"""
+        decompressor = None
+        while True:
+            data = self._fobj.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            if self._codec is None:
+                yield data
+                continue
+
+            while data:
+                if decompressor is None:
+                    decompressor = self._codec.decompressor()
+                try:
+                    chunk = decompressor.decompress(data)
+                except self._codec.errors:
+                    self.truncated = True
+                    return
+                yield chunk
+
+                # The data may continue with the next member
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = None
+                else:
+                    data = b''
+
+        if decompressor is not None:
+            self.truncated = True
+
+    def __iter__(self) -> Iterator[bytes]:
+        partial = b''
+        for chunk in self._chunks():
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            self.count += len(lines)
+            yield from lines
+        self.partial = partial
+
+
+class HistoryLog:
+    """Append-only file which persists a :class:`History` list
+
+    Each command is written as one JSON object per line as soon as its History
+    writes it, so commands are not lost if the application crashes. The file
+    grows until it holds ``COMPACTION_FACTOR`` times ``max_length`` commands, at
+    which point it is rewritten with only the most recent ``max_length`` commands.
+
+    History files written in the pickle format used by earlier versions of cmd2
+    are loaded and converted to this format the first time they are written.
+
+    Several sessions can use the same file. Each one appends its own commands,
+    and compaction keeps the most recent commands of all of them. Writes are
+    serialized with an advisory lock on a file next to the history file where
+    ``fcntl`` is available. When :attr:`share` is True, :meth:`read_new` returns
+    the commands other sessions have appended by reading only the end of the file.
+
+    If the path ends with one of :data:`COMPRESSED_HISTORY_EXTENSIONS`, then the file
+    is compressed. Each command is appended as its own compressed member, and compaction
+    rewrites the file as a single member. The file is read and written a chunk at a time,
+    so it is never held in memory at once.
+    """
+    # First line of the file, which identifies its format
+    HEADER = '{"cmd2_history": 1}'
+
+    # Appended to the path of the history file to get the path of its lock file
+    LOCK_EXT = '.lock'
+
+    # The file is compacted once it holds this many times max_length commands
+    COMPACTION_FACTOR = 2
+
+    def __init__(self, path: str, *, max_length: int = 1000, fsync: bool = False) -> None:
+        """HistoryLog initializer
+
+        :param path: path of the history file
+        :param max_length: maximum number of commands loaded from the file and kept when it is compacted.
+                           If less than 1, then no commands are kept.
+        :param fsync: if True, then each command is flushed to disk with os.fsync() after it is written
+        :raises: ImportError if the file is compressed and Python was built without the module for its compression
+        """
+        self.path = path
+        self.max_length = max_length
+        self.fsync = fsync
+
+        # Number of commands in the file
+        self.record_count = 0
+
+        # True if the file is not in this format and must be rewritten before commands are appended to it
+        self.needs_rewrite = False
+
+        # If True, then commands other sessions append to the file are collected for read_new()
+        self.share = False
+
+        self._file = None
+        self._lock_file = None
+
+        # Position in the file up to which commands have been read or written by this session,
+        # and the stat result of the file that position belongs to
+        self._read_offset = 0
+        self._read_stat = None
+
+        # Lines of other sessions' commands found while appending which haven't been returned by read_new()
+        self._unread = []
+
+        compression = COMPRESSED_HISTORY_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        self._codec = None if compression is None else _Codec(compression)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Context manager which holds an exclusive advisory lock on the history file's lock file
+
+        Only writers take the lock. Each command is written with a single write() to a file opened for
+        appending, so readers see whole lines except possibly a partial line at the end which they ignore.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        if self._lock_file is None:
+            self._lock_file = open(self.path + self.LOCK_EXT, 'a')
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def load(self) -> List[HistoryItem]:
+        """Read the items in the file. A file which doesn't exist is treated as empty.
+
+        A file in the pickle format of earlier versions is read and will be converted the next time
+        it is written. A file in any other format, such as the plain text history of versions
+        0.9.12 and earlier, is left alone and will be replaced the next time it is written.
+
+        :return: at most max_length of the most recent items numbered from 1, oldest first
+        :raises: OSError if the file can't be read
+        """
+        older_lines, items = self.load_recent(self.max_length)
+        return self.parse_lines(older_lines) + items
+
+    def load_recent(self, count: int) -> Tuple[List[bytes], List[HistoryItem]]:
+        """Like load(), but only parse the most recent items. Parsing every item in a large
+        file takes much longer than reading it.
+
+        :param count: number of the most recent items to parse
+        :return: tuple of the unparsed lines of the older items, which can be parsed later with
+                 parse_lines(), and the parsed recent items. Both are oldest first. Together they
+                 hold at most max_length items. The recent items are numbered after the older ones.
+        :raises: OSError if the file can't be read
+        """
+        self.close()
+        self.record_count = 0
+        try:
+            fobj = open(self.path, 'rb')
+        except FileNotFoundError:
+            # The header is written along with the first command
+            self.needs_rewrite = False
+            self._read_offset = 0
+            self._read_stat = None
+            return [], []
+
+        with fobj:
+            self._read_stat = os.fstat(fobj.fileno())
+            reader = _LineReader(fobj, self._codec)
+            lines = iter(reader)
+            header = next(lines, None)
+
+            if header == self.HEADER.encode():
+                # Only the lines which will be loaded are kept while the file is read
+                recent = collections.deque(lines, maxlen=max(self.max_length, 0))
+                self._read_offset = fobj.tell()
+            else:
+                first = reader.partial if header is None else header
+                if header is None and not first and not reader.truncated:
+                    # The file is empty
+                    self.needs_rewrite = False
+                    self._read_offset = fobj.tell()
+                    return [], []
+
+                fobj.seek(0)
+                data = fobj.read() if self._codec is None and first[:1] == b'\x80' else b''
+                self._read_offset = fobj.seek(0, os.SEEK_END)
+                statements = self._unpickle(data) if data else []
+                self.needs_rewrite = True
+                statements = statements[-self.max_length:] if self.max_length > 0 else []
+                return [], [HistoryItem(statement, idx) for idx, statement in enumerate(statements, start=1)]
+
+        # A crash can leave a partial line at the end of the file. The next command would be
+        # appended to that line, so the file must be rewritten.
+        self.needs_rewrite = bool(reader.partial) or reader.truncated
+        self.record_count = reader.count - 1
+
+        lines = list(recent)
+        split = max(len(lines) - count, 0)
+
+        items = []
+        for line in lines[split:]:
+            history_item = self._parse_line(line, split + len(items) + 1)
+            if history_item is None:
+                self.needs_rewrite = True
+            else:
+                items.append(history_item)
+
+        return lines[:split], items
+
+    @staticmethod
+    def _parse_line(line: bytes, idx: int) -> Optional[HistoryItem]:
+        """Return the item in a line of the file with the given index or None if the line is invalid"""
+        try:
+            return HistoryItem.from_dict(json.loads(line.decode('utf-8', errors='replace')), idx)
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def parse_lines(cls, lines: List[bytes], first_idx: int = 1) -> List[HistoryItem]:
+        """Parse the lines returned by load_recent()
+
+        :param lines: lines of the file
+        :param first_idx: index of the first item
+        :return: an item for each line. Invalid lines become empty statements so the
+                 index of each item matches the position of its line.
+        """
+        items = []
+        for idx, line in enumerate(lines, start=first_idx):
+            history_item = cls._parse_line(line, idx)
+            items.append(HistoryItem(Statement(''), idx) if history_item is None else history_item)
+        return items
+
+    @staticmethod
+    def _unpickle(data: bytes) -> List[Statement]:
+        """Return the statements in a history file written with pickle by cmd2 0.9.13 through 1.0"""
+        try:
+            history = pickle.loads(data)
+            return [item.statement for item in history]
+        except (AttributeError, EOFError, ImportError, IndexError, KeyError, TypeError, ValueError,
+                pickle.UnpicklingError):
+            # If any of these errors occur when attempting to unpickle, just use an empty history
+            return []
+
+    def append(self, history_item: HistoryItem, history: 'History') -> None:
+        """Write an item of a History list
+
+        If the file needs to be converted or compacted, then it is rewritten instead.
+
+        :param history_item: the item to write
+        :param history: the History list which holds the item
+        :raises: OSError if the file can't be written
+        """
+        line = json.dumps(history_item.to_dict()).encode() + b'\n'
+        with self._locked():
+            if self.needs_rewrite or self.record_count >= self.COMPACTION_FACTOR * max(self.max_length, 1):
+                self._rewrite(history, line)
+                return
+
+            self._open_for_append()
+            self._read_tail()
+
+            try:
+                self._file.write(self._encode(line))
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                # A partial line may have been written
+                self._close_file()
+                self.needs_rewrite = True
+                raise
+
+            self._read_offset = self._file.tell()
+            self._read_stat = os.fstat(self._file.fileno())
+
+        self.record_count += 1
+
+    def _open_for_append(self) -> None:
+        """Open the file for appending if it isn't open or if another session replaced or deleted it"""
+        if self._file is not None:
+            try:
+                replaced = not os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.path))
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                self._close_file()
+
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+            if self._file.tell() == 0:
+                self._file.write(self._encode(self.HEADER.encode() + b'\n'))
+
+    def _read_tail(self) -> None:
+        """Count the commands other sessions appended to the file since this session last read or wrote it.
+        When sharing, they are also collected for read_new()."""
+        try:
+            with open(self.path, 'rb') as fobj:
+                stat = os.fstat(fobj.fileno())
+                if self._read_stat is None:
+                    # The file didn't exist when this session last read it, so all of it is new
+                    self._read_offset = 0
+                    self._read_stat = stat
+                elif not os.path.samestat(stat, self._read_stat) or stat.st_size < self._read_offset:
+                    # Another session compacted or deleted the file. Its position in the new file is unknown,
+                    # so start reading from the end.
+                    reader = _LineReader(fobj, self._codec)
+                    collections.deque(reader, maxlen=0)
+                    self.record_count = max(reader.count - 1, 0)
+                    self._read_offset = fobj.tell()
+                    self._read_stat = stat
+                    return
+
+                fobj.seek(self._read_offset)
+                data = fobj.read()
+        except FileNotFoundError:
+            return
+
+        lines, end = self._split_tail(data)
+        if self._read_offset == 0 and lines[:1] == [self.HEADER.encode()]:
+            del lines[0]
+        self.record_count += len(lines)
+        self._read_offset += end
+        if self.share:
+            self._unread.extend(lines)
+
+    def _split_tail(self, data: bytes) -> Tuple[List[bytes], int]:
+        """Return the complete lines in data read from the end of the file by _read_tail() and the number
+        of bytes of data they take up. The data may end with part of a line or compressed member which
+        another session is writing."""
+        if self._codec is None:
+            end = data.rfind(b'\n') + 1
+            return data[:end].split(b'\n')[:-1], end
+
+        lines = []
+        end = 0
+        view = memoryview(data)
+        while end < len(data):
+            decompressor = self._codec.decompressor()
+            try:
+                text = decompressor.decompress(view[end:])
+            except self._codec.errors:
+                break
+            if not decompressor.eof:
+                break
+            end = len(data) - len(decompressor.unused_data)
+            lines.extend(text.split(b'\n')[:-1])
+        return lines, end
+
+    def _encode(self, data: bytes) -> bytes:
+        """Return data as it is written to the end of the file"""
+        return data if self._codec is None else self._codec.compress(data)
+
+    def update_record_count(self) -> None:
+        """Add the commands other sessions appended to the file since this session last read or wrote it
+        to record_count. Only the end of the file is read.
+
+        :raises: OSError if the file can't be read
+        """
+        self._read_tail()
+
+    def read_new(self, first_idx: int) -> List[HistoryItem]:
+        """Return the items other sessions appended to the file since the last call. Only the
+        end of the file is read. If another session compacts the file, then the commands it appended
+        since the last call may be missed.
+
+        :param first_idx: index of the first new item
+        :return: the new items, oldest first
+        :raises: OSError if the file can't be read
+        """
+        self._read_tail()
+        items = []
+        for line in self._unread:
+            history_item = self._parse_line(line, first_idx + len(items))
+            if history_item is not None:
+                items.append(history_item)
+        self._unread = []
+        return items
+
+    def compact(self, history: 'History') -> None:
+        """Rewrite the file with only its most recent max_length commands
+
+        The new file is written next to the old one and then renamed over it, so the old file is intact
+        if writing fails.
+
+        :param history: the History list which is stored in the file. Its items are written instead of
+                        those in the file when the file is in an older format.
+        :raises: OSError if the file can't be written
+        """
+        with self._locked():
+            self._rewrite(history)
+
+    def _rewrite(self, history: 'History', new_line: bytes = b'') -> None:
+        """Rewrite the file while holding the lock. See compact().
+
+        :param new_line: line of a statement which hasn't been written yet
+        """
+        self._close_file()
+        if self.share:
+            self._read_tail()
+
+        # Only the lines which will be kept are held in memory while the file is read
+        lines = collections.deque(maxlen=max(self.max_length, 0))
+        try:
+            with open(self.path, 'rb') as fobj:
+                reader = _LineReader(fobj, self._codec)
+                line_iter = iter(reader)
+                convert = next(line_iter, None) != self.HEADER.encode()
+                if not convert:
+                    # Keep the commands all sessions have written, skipping invalid lines such as a partial last line
+                    lines.extend(line + b'\n' for line in line_iter if self._parse_line(line, 0) is not None)
+                    if self._parse_line(reader.partial, 0) is not None:
+                        lines.append(reader.partial + b'\n')
+                    if new_line:
+                        lines.append(new_line)
+        except FileNotFoundError:
+            convert = True
+
+        if convert:
+            # Convert the file from an older format. Items still waiting to be written, such as those of
+            # commands run by a command which hasn't finished, are appended after this.
+            history.load_all()
+            unwritten = {item.idx for item in history._unwritten}
+            lines.extend(json.dumps(item.to_dict()).encode() + b'\n' for item in history if item.idx not in unwritten)
+
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as fobj:
+                self._write_all(fobj, lines)
+                fobj.flush()
+                if self.fsync:
+                    os.fsync(fobj.fileno())
+                self._read_offset = fobj.tell()
+                self._read_stat = os.fstat(fobj.fileno())
+            os.replace(temp_path, self.path)
+        except OSError:
+            self._read_stat = None
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self.record_count = len(lines)
+        self.needs_rewrite = False
+
+    def _write_all(self, fobj: BinaryIO, lines: Iterable[bytes]) -> None:
+        """Write the header and lines to a new file. If the file is compressed, then they are written as one member."""
+        chunks = itertools.chain([self.HEADER.encode() + b'\n'], lines)
+        if self._codec is None:
+            fobj.writelines(chunks)
+            return
+
+        compressor = self._codec.compressor()
+        for chunk in chunks:
+            fobj.write(compressor.compress(chunk))
+        fobj.write(compressor.flush())
+
+    def clear(self) -> None:
+        """Delete the file. It will be created again when the next statement is appended.
+
+        :raises: OSError if the file can't be deleted
+        """
+        self.close()
+        self.record_count = 0
+        self.needs_rewrite = True
+        with self._locked():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _close_file(self) -> None:
+        """Close the file if it is open for appending"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        """Close the file if it is open for appending and the lock file if it is open"""
+        self._close_file()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,203 @@
+# coding=utf-8
+"""
+Per-command memory accounting
+
+When memory tracking is enabled, :class:`~cmd2.Cmd` measures every command it runs with :mod:`tracemalloc`
+and records the results in a :class:`MemoryTracker` which is available as :attr:`cmd2.Cmd.memory_tracker`.
+For each command it keeps the memory the command retained after it finished, the peak memory it used
+while running, the change in the number of objects tracked by the garbage collector, and the source lines
+which allocated the most retained memory.
+
+Memory tracking slows down every allocation and each measurement takes a snapshot of all traced memory,
+so it is meant for diagnosing leaks and is disabled by default.
+"""
+
+import gc
+import threading
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+# tracemalloc.reset_peak() was added in Python 3.9. Without it, the peak of a command is not measured.
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class CommandMemory:
+    """Memory usage recorded for a single command"""
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+
+        # Sum of the bytes each call retained. This is negative when the command freed more than it allocated.
+        self.retained_bytes = 0
+
+        # Largest amount of memory any single call used above what was allocated when it started
+        self.peak_bytes = 0
+
+        # Sum of the change in the number of objects tracked by the garbage collector during each call
+        self.gc_objects = 0
+
+        # Maps a source line (file:line) to the bytes it allocated and didn't free across all calls
+        self.sites = dict()
+
+    def top_sites(self, limit: int) -> List[Tuple[str, int]]:
+        """Return up to limit (source line, bytes) tuples for the lines which retained the most memory"""
+        sites = sorted(self.sites.items(), key=lambda site: site[1], reverse=True)
+        return sites[:limit]
+
+    def to_dict(self) -> Dict[str, object]:
+        """Return these results in a form suitable for JSON encoding"""
+        return {'calls': self.calls,
+                'retained_bytes': self.retained_bytes,
+                'peak_bytes': self.peak_bytes,
+                'gc_objects': self.gc_objects,
+                'sites': dict(self.sites)}
+
+
+class _Measurement:
+    """Context manager which measures the memory used by one command. Created by MemoryTracker.measure()."""
+    def __init__(self, tracker: 'MemoryTracker', command: str) -> None:
+        self._tracker = tracker
+        self._command = command
+        self._snapshot = None
+        self._start_bytes = 0
+        self._start_objects = 0
+
+        # Highest peak seen before nested measurements reset the tracemalloc peak
+        self.child_peak = 0
+
+    def __enter__(self) -> '_Measurement':
+        tracker = self._tracker
+        if tracker.top_sites > 0:
+            self._snapshot = tracker.take_snapshot()
+        self._start_objects = len(gc.get_objects())
+        self._start_bytes, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is not None:
+            # Save the peak an enclosing measurement has seen so far before it is lost
+            if tracker._measurements:
+                parent = tracker._measurements[-1]
+                parent.child_peak = max(parent.child_peak, peak)
+            _reset_peak()
+        tracker._measurements.append(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        tracker = self._tracker
+        end_bytes, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is None:
+            peak = end_bytes
+        peak = max(peak, self.child_peak)
+        end_objects = len(gc.get_objects())
+
+        tracker._measurements.pop()
+        if tracker._measurements:
+            parent = tracker._measurements[-1]
+            parent.child_peak = max(parent.child_peak, peak)
+
+        sites = []
+        if self._snapshot is not None:
+            for stat in tracker.take_snapshot().compare_to(self._snapshot, 'lineno'):
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                sites.append(('{}:{}'.format(frame.filename, frame.lineno), stat.size_diff))
+                if len(sites) >= tracker.top_sites:
+                    break
+
+        tracker._record(self._command, end_bytes - self._start_bytes, peak - self._start_bytes,
+                        end_objects - self._start_objects, sites)
+
+
+class MemoryTracker:
+    """Thread-safe collection of CommandMemory keyed by command name"""
+    def __init__(self, *, top_sites: int = 10) -> None:
+        """
+        MemoryTracker initializer
+
+        :param top_sites: number of source lines kept for each call of a command. The lines which retained
+                          the most memory are kept. Set to 0 to skip the snapshots needed to find them.
+        """
+        self.top_sites = top_sites
+        self._commands = dict()  # command name -> CommandMemory
+        self._lock = threading.Lock()
+        self._measurements = []
+        self._started_tracing = False
+        # True if start() called tracemalloc.start() instead of using tracing which something else started
+        self._owns_tracing = False
+
+    @property
+    def tracking(self) -> bool:
+        """True if start() has been called and tracemalloc is tracing"""
+        return self._started_tracing and tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        """Start tracing memory allocations with tracemalloc"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        self._started_tracing = True
+
+    def stop(self) -> None:
+        """
+        Stop tracing memory allocations. Results recorded so far are kept.
+
+        Tracing which was already running when start() was called, such as by the user or another tool, is left on.
+        """
+        if self._owns_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._owns_tracing = False
+        self._started_tracing = False
+
+    def take_snapshot(self) -> tracemalloc.Snapshot:
+        """Return a snapshot of traced memory which excludes allocations made by tracemalloc itself"""
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def measure(self, command: str) -> _Measurement:
+        """
+        Return a context manager which records the memory used while it is active as a call of command.
+
+        Measurements can be nested, such as when a command runs a script of other commands.
+
+        :param command: name of the command being measured
+        """
+        if not self.tracking:
+            self.start()
+        return _Measurement(self, command)
+
+    def _record(self, command: str, retained_bytes: int, peak_bytes: int, gc_objects: int,
+                sites: List[Tuple[str, int]]) -> None:
+        """Record one call of a command"""
+        with self._lock:
+            memory = self._commands.get(command)
+            if memory is None:
+                memory = self._commands[command] = CommandMemory(command)
+
+            memory.calls += 1
+            memory.retained_bytes += retained_bytes
+            memory.peak_bytes = max(memory.peak_bytes, peak_bytes)
+            memory.gc_objects += gc_objects
+            for site, size in sites:
+                memory.sites[site] = memory.sites.get(site, 0) + size
+
+            # Keep the number of source lines bounded for commands which are run many times
+            if len(memory.sites) > 4 * self.top_sites:
+                memory.sites = dict(memory.top_sites(2 * self.top_sites))
+
+    def get(self, command: str) -> Optional[CommandMemory]:
+        """Return the memory usage of a command or None if it hasn't been measured"""
+        with self._lock:
+            return self._commands.get(command)
+
+    def commands(self) -> List[str]:
+        """Return the names of all commands which have been measured"""
+        with self._lock:
+            return list(self._commands)
+
+    def reset(self) -> None:
+        """Discard all recorded results"""
+        with self._lock:
+            self._commands.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """Return all recorded results in a form suitable for JSON encoding"""
+        with self._lock:
+            return {name: memory.to_dict() for name, memory in self._commands.items()}
@@ -0,0 +1,276 @@
+# coding=utf-8
+"""
+Per-command latency and throughput metrics
+
+:class:`~cmd2.Cmd` records every command it runs in a :class:`MetricsRegistry` which is available as
+:attr:`cmd2.Cmd.metrics`. The registry keeps a call count, an error count, and a latency histogram for each
+command along with a breakdown of where the time was spent (parsing, hooks, redirection setup, and the
+command function itself).
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# time.perf_counter_ns() was added in Python 3.7
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:  # pragma: no cover
+    def perf_counter_ns() -> int:
+        """Fallback for Python versions without time.perf_counter_ns()"""
+        return int(time.perf_counter() * 1000000000)
+
+# The phases of running a command which are timed separately
+PHASE_PARSE = 'parse'
+PHASE_HOOKS = 'hooks'
+PHASE_REDIRECTION = 'redirection'
+PHASE_COMMAND = 'command'
+PHASES = (PHASE_PARSE, PHASE_HOOKS, PHASE_REDIRECTION, PHASE_COMMAND)
+
+# Percentiles reported for each command
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies in nanoseconds
+
+    Each power of two is split into SUB_BUCKETS buckets, so a reported value is never off by more than
+    about 1/SUB_BUCKETS of itself. Memory use depends on the spread of the values and not on how many
+    have been recorded.
+    """
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+    def __init__(self) -> None:
+        self._buckets = dict()  # bucket index -> count
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    @classmethod
+    def _bucket_index(cls, value_ns: int) -> int:
+        """Return the index of the bucket which holds a value"""
+        if value_ns < cls.SUB_BUCKETS:
+            return value_ns
+        exponent = value_ns.bit_length() - 1
+        return exponent * cls.SUB_BUCKETS + ((value_ns << cls.SUB_BUCKET_BITS) >> exponent) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _bucket_upper_bound(cls, index: int) -> int:
+        """Return the largest value which falls in a bucket"""
+        if index < cls.SUB_BUCKETS:
+            return index
+        exponent, sub_bucket = divmod(index, cls.SUB_BUCKETS)
+        return (((cls.SUB_BUCKETS + sub_bucket + 1) << exponent) >> cls.SUB_BUCKET_BITS) - 1
+
+    def record(self, value_ns: int) -> None:
+        """Add a latency to the histogram
+
+        :param value_ns: latency in nanoseconds
+        """
+        value_ns = max(int(value_ns), 0)
+        index = self._bucket_index(value_ns)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+        if self.count == 0 or value_ns < self.min_ns:
+            self.min_ns = value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+        self.count += 1
+        self.total_ns += value_ns
+
+    def percentile(self, pct: float) -> int:
+        """Return an estimate of the latency at a given percentile
+
+        :param pct: percentile between 0 and 100
+        :return: latency in nanoseconds, 0 if nothing has been recorded
+        """
+        if not self.count:
+            return 0
+
+        # Rank of the value we are looking for
+        rank = max(math.ceil(self.count * pct / 100), 1)
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                # Never report more than the largest value actually seen
+                return min(self._bucket_upper_bound(index), self.max_ns)
+        return self.max_ns  # pragma: no cover
+
+    @property
+    def mean_ns(self) -> float:
+        """Mean of the recorded latencies in nanoseconds"""
+        return self.total_ns / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return a summary of the histogram suitable for JSON encoding"""
+        summary = {'count': self.count,
+                   'min_ns': self.min_ns,
+                   'max_ns': self.max_ns,
+                   'mean_ns': self.mean_ns}
+        for pct in PERCENTILES:
+            summary['p{}_ns'.format(pct)] = self.percentile(pct)
+        return summary
+
+
+class CommandMetrics:
+    """Metrics for a single command"""
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+        # Total nanoseconds spent in each phase across all calls
+        self.phase_ns = dict.fromkeys(PHASES, 0)
+
+    def to_dict(self) -> Dict[str, object]:
+        """Return these metrics in a form suitable for JSON encoding"""
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'latency': self.latency.to_dict(),
+                'phases_ns': dict(self.phase_ns)}
+
+
+class CommandTimer:
+    """
+    Measures the time spent in each phase while running a single command.
+
+    Call lap() at the end of each piece of work to charge the time since the previous lap to a phase.
+    """
+    def __init__(self, on_lap: Optional[Callable[[str, int, int], None]] = None) -> None:
+        """
+        CommandTimer initializer
+
+        :param on_lap: optional function called at each lap with the name of the piece of work and the
+                       perf_counter_ns() times it started and ended. This is used for tracing.
+        """
+        self.start_ns = perf_counter_ns()
+        self._last_ns = self.start_ns
+        self._on_lap = on_lap
+        self.phase_ns = dict.fromkeys(PHASES, 0)
+
+    def lap(self, phase: str, name: Optional[str] = None) -> None:
+        """Charge the time elapsed since the last lap to a phase
+
+        :param phase: one of PHASES
+        :param name: name of the piece of work which just ended, passed to on_lap. Defaults to phase.
+        """
+        now = perf_counter_ns()
+        self.phase_ns[phase] += now - self._last_ns
+        if self._on_lap is not None:
+            self._on_lap(name or phase, self._last_ns, now)
+        self._last_ns = now
+
+    @property
+    def elapsed_ns(self) -> int:
+        """Nanoseconds between the creation of this timer and its most recent lap"""
+        return self._last_ns - self.start_ns
+
+
+class MetricsRegistry:
+    """Thread-safe collection of CommandMetrics keyed by command name"""
+    def __init__(self) -> None:
+        self._commands = dict()  # command name -> CommandMetrics
+        self._lock = threading.Lock()
+        self._dump_thread = None
+        self._dump_path = None
+        self._dump_stop = threading.Event()
+
+    def record(self, command: str, timer: CommandTimer, *, error: bool = False) -> None:
+        """Record one run of a command
+
+        :param command: name of the command that ran
+        :param timer: the CommandTimer used while running the command
+        :param error: True if the command ended in an error
+        """
+        with self._lock:
+            metrics = self._commands.get(command)
+            if metrics is None:
+                metrics = self._commands[command] = CommandMetrics(command)
+
+            metrics.calls += 1
+            if error:
+                metrics.errors += 1
+            metrics.latency.record(timer.elapsed_ns)
+            for phase, value in timer.phase_ns.items():
+                metrics.phase_ns[phase] += value
+
+    def get(self, command: str) -> Optional[CommandMetrics]:
+        """Return the metrics for a command or None if it hasn't been run"""
+        with self._lock:
+            return self._commands.get(command)
+
+    def commands(self) -> List[str]:
+        """Return the names of all commands which have metrics"""
+        with self._lock:
+            return list(self._commands)
+
+    def reset(self) -> None:
+        """Discard all recorded metrics"""
+        with self._lock:
+            self._commands.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """Return all metrics in a form suitable for JSON encoding"""
+        with self._lock:
+            return {name: metrics.to_dict() for name, metrics in self._commands.items()}
+
+    def dump(self, path: str) -> None:
+        """Write a JSON snapshot of all metrics to a file
+
+        The snapshot is written to a temporary file which then replaces path, so readers never see a partial file.
+
+        :param path: file to write
+        :raises: OSError if the file can't be written
+        """
+        data = {'timestamp': time.time(), 'commands': self.snapshot()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump(data, fobj, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @property
+    def dump_path(self) -> Optional[str]:
+        """File written by the periodic dump or None if one isn't running"""
+        return self._dump_path
+
+    def start_periodic_dump(self, path: str, interval: float) -> None:
+        """Dump metrics to a file every interval seconds from a background thread
+
+        Any periodic dump which is already running is stopped first.
+
+        :param path: file to write
+        :param interval: number of seconds between dumps
+        :raises: ValueError if interval is not positive
+        """
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+
+        self.stop_periodic_dump()
+        self._dump_stop.clear()
+
+        def dump_loop() -> None:
+            while not self._dump_stop.wait(interval):
+                try:
+                    self.dump(path)
+                except OSError:
+                    pass
+
+        self._dump_thread = threading.Thread(name='metrics_dump_thread', target=dump_loop, daemon=True)
+        self._dump_thread.start()
+        self._dump_path = path
+
+    def stop_periodic_dump(self) -> None:
+        """Stop a periodic dump started by start_periodic_dump()"""
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+            self._dump_path = None
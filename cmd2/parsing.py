@@ -4,7 +4,7 @@
 
 import re
 import shlex
-from typing import Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import attr
 
@@ -146,6 +146,22 @@ class Statement(str):
         stmt = super().__new__(cls, value)
         return stmt
 
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the attributes of this Statement in a form suitable for JSON encoding"""
+        return attr.asdict(self)
+
+    @classmethod
+    def from_dict(cls, source: Dict[str, Any]) -> 'Statement':
+        """Create a Statement from a dictionary returned by :meth:`to_dict`
+
+        :param source: dictionary of Statement attributes
+        :return: the Statement
+        :raises: TypeError if source has unknown keys or values of the wrong type
+        """
+        kwargs = dict(source)
+        args = kwargs.pop('args', '')
+        return cls(args, **kwargs)
+
     @property
     def command_and_args(self) -> str:
         """Combine command and args with a space separating them.
@@ -0,0 +1,283 @@
+# coding=utf-8
+"""
+Profiling support for commands
+
+These are used by the profile and sample commands and by the profile and sample settings, which
+automatically profile every command and save the results of the slow ones.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+from types import CodeType
+from typing import Any, Callable, List, Optional, Tuple
+
+# Sort keys accepted by pstats.Stats.sort_stats()
+PSTATS_SORT_KEYS = ['calls', 'cumulative', 'filename', 'line', 'name', 'ncalls', 'nfl',
+                    'pcalls', 'stdname', 'time', 'tottime']
+
+# Extensions of the files written by save_profile() and save_samples()
+PROFILE_FILE_EXT = '.prof'
+COLLAPSED_FILE_EXT = '.collapsed'
+
+# Directory where automatic profile results are saved by default
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'cmd2_profiles')
+
+
+def run_profiled(func: Callable, *args, **kwargs) -> Tuple[Any, cProfile.Profile, float]:
+    """
+    Call a function under cProfile
+
+    :param func: function to call
+    :param args: positional arguments passed to func
+    :param kwargs: keyword arguments passed to func
+    :return: a tuple containing the return value of func, the Profile object, and the number of seconds func ran
+    """
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, profiler, time.perf_counter() - start
+
+
+def format_stats(profiler: cProfile.Profile, *, sort_key: str = 'cumulative', limit: int = 30) -> str:
+    """
+    Format the results of a profiler as a table
+
+    :param profiler: Profile object holding the results
+    :param sort_key: pstats sort key (see PSTATS_SORT_KEYS)
+    :param limit: maximum number of functions to include
+    :return: the formatted table
+    """
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(sort_key).print_stats(limit)
+    return stream.getvalue()
+
+
+def list_profile_files(directory: str, ext: str = PROFILE_FILE_EXT) -> List[str]:
+    """
+    Return the files written by save_profile() or save_samples() in a directory, oldest first
+
+    :param directory: the directory to search
+    :param ext: extension of the files to return (PROFILE_FILE_EXT or COLLAPSED_FILE_EXT)
+    :return: list of file paths
+    """
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(ext)]
+    except FileNotFoundError:
+        return []
+
+    # The file names start with a sortable timestamp
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def _save_result(write_func: Callable[[str], None], directory: str, name: str, ext: str, max_files: int) -> str:
+    """
+    Write profiling results to a new file in a directory, deleting the oldest files with the same
+    extension so no more than max_files remain.
+
+    :param write_func: function which writes the results to the path it is passed
+    :param directory: directory to save the file in. It is created if it does not exist.
+    :param name: included in the file name to identify what was profiled (e.g. the command name)
+    :param ext: file extension
+    :param max_files: maximum number of files to keep in directory. 0 means there is no limit.
+    :return: path of the file which was written
+    :raises: OSError if the file could not be written
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    # Start the name with a timestamp so sorting the names sorts the files by age.
+    # Only keep characters which are safe in file names on all platforms.
+    now = time.time()
+    safe_name = re.sub(r'[^\w.-]', '_', name)
+    file_name = '{}.{:06d}_{}{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+                                        int(now * 1000000) % 1000000, safe_name, ext)
+    file_path = os.path.join(directory, file_name)
+    write_func(file_path)
+
+    if max_files > 0:
+        existing_files = list_profile_files(directory, ext)
+        for old_file in existing_files[:-max_files]:
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+
+    return file_path
+
+
+def save_profile(profiler: cProfile.Profile, directory: str, name: str, *, max_files: int = 0) -> str:
+    """
+    Save the results of a profiler to a new file in a directory, deleting the oldest files
+    so no more than max_files remain.
+
+    :param profiler: Profile object holding the results
+    :param directory: directory to save the file in. It is created if it does not exist.
+    :param name: included in the file name to identify what was profiled (e.g. the command name)
+    :param max_files: maximum number of profile files to keep in directory. 0 means there is no limit.
+    :return: path of the file which was written
+    :raises: OSError if the file could not be written
+    """
+    return _save_result(profiler.dump_stats, directory, name, PROFILE_FILE_EXT, max_files)
+
+
+def save_samples(sampler: 'SamplingProfiler', directory: str, name: str, *, max_files: int = 0) -> str:
+    """
+    Save the collapsed stacks of a sampling profiler to a new file in a directory, deleting the oldest files
+    so no more than max_files remain.
+
+    :param sampler: SamplingProfiler holding the results
+    :param directory: directory to save the file in. It is created if it does not exist.
+    :param name: included in the file name to identify what was profiled (e.g. the command name)
+    :param max_files: maximum number of collapsed stack files to keep in directory. 0 means there is no limit.
+    :return: path of the file which was written
+    :raises: OSError if the file could not be written
+    """
+    return _save_result(sampler.write_collapsed, directory, name, COLLAPSED_FILE_EXT, max_files)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler which records the call stack of a thread at a regular interval from a background thread.
+
+    Unlike cProfile, the profiled thread is not slowed down by every function call, so the results of I/O-heavy
+    code are not distorted. The cost is roughly one walk of the stack per interval.
+
+    Results are available in the collapsed stack format used by flame graph tools like flamegraph.pl and
+    speedscope. Each line is a semicolon-separated stack, outermost frame first, followed by a space and the
+    number of samples in which that stack was seen.
+
+    Usage::
+
+        with SamplingProfiler(interval=0.01) as sampler:
+            slow_function()
+        sampler.write_collapsed('slow_function.collapsed')
+    """
+    def __init__(self, interval: float = 0.01, *, thread_id: Optional[int] = None) -> None:
+        """
+        SamplingProfiler initializer
+
+        :param interval: number of seconds between samples
+        :param thread_id: identifier of the thread to sample. Defaults to the thread which calls start().
+        :raises: ValueError if interval is not positive
+        """
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+
+        self.interval = interval
+        self.thread_id = thread_id
+        self.sample_count = 0
+        self.elapsed = 0.0
+
+        # Maps a stack (tuple of frame labels, outermost first) to the number of times it was sampled
+        self._stacks = dict()
+
+        # Caches the label of each code object so it is only built once
+        self._labels = dict()
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._start_time = 0.0
+
+    def __enter__(self) -> 'SamplingProfiler':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _label(self, code: CodeType) -> str:
+        """Return the label of a code object in a collapsed stack"""
+        label = self._labels.get(code)
+        if label is None:
+            # Semicolons separate frames in the collapsed format
+            label = '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def _take_sample(self) -> None:
+        """Record the current stack of the sampled thread"""
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+
+        stack = tuple(stack)
+        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+        self.sample_count += 1
+
+    def _run(self) -> None:
+        """Body of the sampling thread"""
+        while not self._stop_event.wait(self.interval):
+            self._take_sample()
+
+    def start(self) -> None:
+        """Start sampling in a background thread. Any previous results are kept."""
+        if self._thread is not None:
+            return
+
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+
+        self._stop_event.clear()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(name='sampling_profiler_thread', target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the background thread to finish"""
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed += time.perf_counter() - self._start_time
+
+    def collapsed(self) -> List[str]:
+        """Return the results in the collapsed stack format, one line per unique stack"""
+        return ['{} {}'.format(';'.join(stack), count) for stack, count in sorted(self._stacks.items())]
+
+    def write_collapsed(self, path: str) -> None:
+        """
+        Write the results in the collapsed stack format to a file
+
+        :param path: file to write
+        :raises: OSError if the file could not be written
+        """
+        with open(path, 'w') as fobj:
+            for line in self.collapsed():
+                fobj.write(line + '\n')
+
+    def top_functions(self, limit: int = 20) -> List[Tuple[str, int, int]]:
+        """
+        Return the functions which appeared in the most samples
+
+        :param limit: maximum number of functions to return
+        :return: list of tuples containing a function's label, the number of samples in which it was running
+                 (self), and the number of samples in which it was on the stack (total). The list is sorted by
+                 self samples and then total samples, highest first.
+        """
+        self_counts = dict()
+        total_counts = dict()
+        for stack, count in self._stacks.items():
+            self_counts[stack[-1]] = self_counts.get(stack[-1], 0) + count
+
+            # Count recursive functions once per sample
+            for label in set(stack):
+                total_counts[label] = total_counts.get(label, 0) + count
+
+        results = [(label, self_counts.get(label, 0), total) for label, total in total_counts.items()]
+        results.sort(key=lambda result: (result[1], result[2]), reverse=True)
+        return results[:limit]
@@ -0,0 +1,465 @@
+# coding=utf-8
+"""
+History stored in an SQLite database with a full-text index
+
+:class:`SqliteHistory` is a :class:`~cmd2.history.History` whose items are also stored in an SQLite
+database with an FTS5 trigram index over the raw and expanded text of each command. Its str_search()
+and regex_search() methods use the index instead of scanning every item, which makes searching very
+large histories fast. It is still a list of :class:`~cmd2.history.HistoryItem` objects, so everything
+else works as it does for :class:`~cmd2.history.History`.
+
+:class:`~cmd2.Cmd` uses it when ``persistent_history_file`` ends with one of
+:data:`cmd2.history.SQLITE_HISTORY_EXTENSIONS`, in which case the database is also the persistent
+history file. An SQLite build without FTS5 falls back to scanning the database with ``instr()``.
+"""
+
+import json
+import re
+import sqlite3
+from typing import List, Optional
+
+import attr
+
+from . import utils
+from .history import History, HistoryItem
+from .parsing import Statement
+
+# FTS5 with the trigram tokenizer supports substring searches of at least this many characters
+_MIN_INDEXED_LENGTH = 3
+
+# Characters which have a special meaning in a regular expression
+_REGEX_SPECIAL_CHARS = '.^$*+?{}[]()|\\'
+
+
+def _skip_char_set(pattern: str, pos: int) -> int:
+    """Return the position after the end of a character set whose contents start at pos"""
+    # A ] which comes first is part of the set
+    if pattern[pos:pos + 1] == '^':
+        pos += 1
+    if pattern[pos:pos + 1] == ']':
+        pos += 1
+
+    while pos < len(pattern):
+        if pattern[pos] == '\\':
+            pos += 2
+        elif pattern[pos] == ']':
+            return pos + 1
+        else:
+            pos += 1
+    return len(pattern)
+
+
+def _required_literal(pattern: str) -> str:
+    """
+    Return the longest run of plain characters which every match of a regular expression must contain.
+    Only the top level of the pattern is examined, so anything within a group or a character set is
+    ignored. An empty string is returned if nothing is certain to be in a match.
+    """
+    # Alternation and inline flags could make any run optional or change how it matches
+    if '|' in pattern or '(?' in pattern:
+        return ''
+
+    runs = []
+    run = ''
+    depth = 0
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        pos += 1
+
+        if char == '\\':
+            escaped = pattern[pos:pos + 1]
+            pos += 1
+            if depth == 0 and escaped and not escaped.isalnum():
+                run += escaped
+                continue
+            # Escapes like \d or \b match classes of characters or positions
+            runs.append(run)
+            run = ''
+        elif char in '([':
+            runs.append(run)
+            run = ''
+            if char == '[':
+                pos = _skip_char_set(pattern, pos)
+            else:
+                depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif depth > 0:
+            continue
+        elif char in '*?{':
+            # The previous character is optional or repeated an unknown number of times
+            runs.append(run[:-1])
+            run = ''
+            if char == '{':
+                close = pattern.find('}', pos)
+                pos = len(pattern) if close < 0 else close + 1
+        elif char in _REGEX_SPECIAL_CHARS:
+            runs.append(run)
+            run = ''
+        else:
+            run += char
+
+    runs.append(run)
+    return max(runs, key=len)
+
+
+class SqliteHistoryStore:
+    """
+    SQLite database which persists and indexes a :class:`SqliteHistory`
+
+    Each command is a row whose sequence number is assigned by SQLite, so several sessions can append
+    to the same database. The store remembers which rows belong to which items of its History list.
+    It has the same methods as :class:`~cmd2.history.HistoryLog`, so it is used as the persistent log
+    of its History.
+    """
+    def __init__(self, path: str = ':memory:', *, max_length: int = 1000, fsync: bool = False) -> None:
+        """
+        SqliteHistoryStore initializer
+
+        :param path: path of the database file or ':memory:' for a database which isn't saved
+        :param max_length: maximum number of commands loaded from the database and kept when it is compacted.
+                           If less than 1, then no commands are kept.
+        :param fsync: if True, then SQLite waits for each command to reach the disk before continuing
+        """
+        self.path = path
+        self.max_length = max_length
+        self.fsync = fsync
+
+        # Number of commands in the database
+        self.record_count = 0
+
+        # Never True, but needed to be used in place of a HistoryLog
+        self.needs_rewrite = False
+
+        # If True, then commands other sessions append to the database are returned by read_new()
+        self.share = False
+
+        # True if the FTS5 index is available
+        self.indexed = False
+
+        self._conn = None
+
+        # Sequence numbers of the rows of every item added to the History list, including those which
+        # were truncated from it, and the position of each one in that list
+        self._seqs = []
+        self._positions = dict()
+
+        # Number of items truncated from the start of the History list
+        self._dropped = 0
+
+        # Highest sequence number read or written by this session
+        self._read_seq = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create its tables if needed"""
+        if self._conn is not None:
+            return self._conn
+
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous={}'.format('FULL' if self.fsync else 'NORMAL'))
+            conn.execute('CREATE TABLE IF NOT EXISTS history (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'statement TEXT NOT NULL, raw TEXT NOT NULL, expanded TEXT NOT NULL, '
+                         'raw_fold TEXT NOT NULL, expanded_fold TEXT NOT NULL, start_time REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS history_start_time ON history(start_time)')
+            try:
+                # The index refers to the text in the history table instead of storing another copy
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(raw, expanded, raw_fold, "
+                             "expanded_fold, content='history', content_rowid='seq', "
+                             "tokenize='trigram case_sensitive 1')")
+                conn.execute('CREATE TRIGGER IF NOT EXISTS history_insert AFTER INSERT ON history BEGIN '
+                             'INSERT INTO history_fts(rowid, raw, expanded, raw_fold, expanded_fold) '
+                             'VALUES (new.seq, new.raw, new.expanded, new.raw_fold, new.expanded_fold); END')
+                conn.execute('CREATE TRIGGER IF NOT EXISTS history_delete AFTER DELETE ON history BEGIN '
+                             "INSERT INTO history_fts(history_fts, rowid, raw, expanded, raw_fold, expanded_fold) "
+                             "VALUES ('delete', old.seq, old.raw, old.expanded, old.raw_fold, old.expanded_fold); END")
+                self.indexed = True
+            except sqlite3.OperationalError:
+                # This SQLite was built without FTS5 or is older than 3.34 which added the trigram tokenizer
+                self.indexed = False
+            conn.commit()
+        except sqlite3.Error:
+            conn.close()
+            raise
+
+        self._conn = conn
+        return conn
+
+    def load(self) -> List[HistoryItem]:
+        """
+        Read the items in the database. A database which doesn't exist is created.
+
+        :return: at most max_length of the most recent items numbered from 1, oldest first
+        :raises: OSError if the database can't be read
+        """
+        try:
+            conn = self._connect()
+            self.record_count = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+            limit = max(self.max_length, 0)
+            rows = conn.execute('SELECT seq, statement FROM (SELECT seq, statement FROM history '
+                                'ORDER BY seq DESC LIMIT ?) ORDER BY seq', (limit,)).fetchall()
+            last_seq = conn.execute('SELECT MAX(seq) FROM history').fetchone()[0]
+        except sqlite3.Error as ex:
+            raise OSError(str(ex)) from ex
+
+        self._seqs = []
+        self._positions = dict()
+        self._dropped = 0
+        self._read_seq = 0 if last_seq is None else last_seq
+
+        items = []
+        for idx, (seq, statement) in enumerate(rows, start=1):
+            self._add_seq(seq)
+            try:
+                items.append(HistoryItem.from_dict(json.loads(statement), idx))
+            except (AttributeError, TypeError, ValueError):
+                # Keep the positions of the other items in line with their sequence numbers
+                items.append(HistoryItem(Statement(''), idx))
+        return items
+
+    def _add_seq(self, seq: int) -> None:
+        """Record that the row with a sequence number is the next item of the History list"""
+        self._positions[seq] = len(self._seqs)
+        self._seqs.append(seq)
+
+    def _execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        """Run a statement which modifies the database and commit it"""
+        try:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, parameters)
+        except sqlite3.Error as ex:
+            raise OSError(str(ex)) from ex
+
+    def append(self, history_item: HistoryItem, history: History) -> None:
+        """
+        Write an item of a History list. Items must be written in the order of the list.
+
+        :param history_item: the item to write
+        :param history: the History list which holds the item
+        :raises: OSError if the database can't be written
+        """
+        raw = history_item.raw
+        expanded = history_item.expanded
+        cursor = self._execute('INSERT INTO history (statement, raw, expanded, raw_fold, expanded_fold, start_time) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               (json.dumps(history_item.to_dict()), raw, expanded,
+                                utils.norm_fold(raw), utils.norm_fold(expanded), history_item.start_time))
+        self._add_seq(cursor.lastrowid)
+        if not self.share:
+            self._read_seq = cursor.lastrowid
+        self.record_count += 1
+
+    def read_new(self, first_idx: int) -> List[HistoryItem]:
+        """
+        Return the items other sessions appended to the database since the last call
+
+        :param first_idx: index of the first new item
+        :return: the new items, oldest first
+        :raises: OSError if the database can't be read
+        """
+        try:
+            rows = self._connect().execute('SELECT seq, statement FROM history WHERE seq > ? ORDER BY seq',
+                                           (self._read_seq,)).fetchall()
+        except sqlite3.Error as ex:
+            raise OSError(str(ex)) from ex
+
+        items = []
+        for seq, statement in rows:
+            self._read_seq = seq
+            if seq in self._positions:
+                # This session wrote it
+                continue
+            try:
+                items.append(HistoryItem.from_dict(json.loads(statement), first_idx + len(items)))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            self._add_seq(seq)
+        return items
+
+    def update_record_count(self) -> None:
+        """
+        Set record_count to the number of commands in the database, including those of other sessions
+
+        :raises: OSError if the database can't be read
+        """
+        try:
+            self.record_count = self._connect().execute('SELECT COUNT(*) FROM history').fetchone()[0]
+        except sqlite3.Error as ex:
+            raise OSError(str(ex)) from ex
+
+    def truncated(self, count: int) -> None:
+        """Record that count items were removed from the start of the History list"""
+        self._dropped += count
+
+    def position(self, seq: int) -> Optional[int]:
+        """
+        Return the zero-based index in the History list of the item stored in a row
+
+        :param seq: sequence number of the row
+        :return: the index or None if the row isn't in the History list
+        """
+        position = self._positions.get(seq)
+        if position is None or position < self._dropped:
+            return None
+        return position - self._dropped
+
+    def compact(self, history: History) -> None:
+        """
+        Delete all but the most recent max_length commands. Commands of every session which uses the
+        database are kept.
+
+        :param history: the History list which is stored in the database
+        :raises: OSError if the database can't be written
+        """
+        self._execute('DELETE FROM history WHERE seq NOT IN (SELECT seq FROM history ORDER BY seq DESC LIMIT ?)',
+                      (max(self.max_length, 0),))
+        self.update_record_count()
+
+    def clear(self) -> None:
+        """
+        Delete all commands in the database
+
+        :raises: OSError if the database can't be written
+        """
+        self._execute('DELETE FROM history')
+        self.record_count = 0
+        self._seqs = []
+        self._positions = dict()
+        self._dropped = 0
+
+    def close(self) -> None:
+        """Close the database. It is opened again if it is used."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _query_seqs(self, sql: str, parameters) -> List[int]:
+        """Run a query which returns sequence numbers"""
+        return [row[0] for row in self._connect().execute(sql, parameters)]
+
+    def search(self, text: str, *, folded: bool) -> List[int]:
+        """
+        Find the commands whose raw or expanded text contains a string
+
+        :param text: the string to search for
+        :param folded: if True, then search the text after it was passed to utils.norm_fold()
+        :return: the sequence numbers of the commands in ascending order
+        :raises: sqlite3.Error if the database can't be read
+        """
+        columns = ('raw_fold', 'expanded_fold') if folded else ('raw', 'expanded')
+        if self.indexed and len(text) >= _MIN_INDEXED_LENGTH:
+            query = '{{{} {}}} : "{}"'.format(columns[0], columns[1], text.replace('"', '""'))
+            return self._query_seqs('SELECT rowid FROM history_fts WHERE history_fts MATCH ? ORDER BY rowid',
+                                    (query,))
+
+        return self._query_seqs('SELECT seq FROM history WHERE instr({}, ?) > 0 OR instr({}, ?) > 0 '
+                                'ORDER BY seq'.format(*columns), (text, text))
+
+    def time_search(self, since: Optional[float], until: Optional[float]) -> List[int]:
+        """
+        Find the timed commands which started within a range of times using the index on start_time
+
+        :param since: earliest start time in seconds since the epoch or None for no limit
+        :param until: latest start time in seconds since the epoch or None for no limit
+        :return: the sequence numbers of the commands
+        :raises: sqlite3.Error if the database can't be read
+        """
+        since = 0.0 if since is None else since
+        until = float('inf') if until is None else until
+        return self._query_seqs('SELECT seq FROM history WHERE start_time > 0 AND start_time >= ? '
+                                'AND start_time <= ?', (since, until))
+
+
+class SqliteHistory(History):
+    """
+    A :class:`~cmd2.history.History` which is stored in an SQLite database with a full-text index
+
+    Adding, clearing, and truncating items keeps the database up to date. Changing the list by any
+    other means, like assigning to or deleting a slice, will cause the index to return wrong results.
+    """
+    def __init__(self, seq=(), *, store: Optional[SqliteHistoryStore] = None) -> None:
+        """
+        SqliteHistory initializer
+
+        :param seq: HistoryItems already in the store, or when store is not provided, the items to add
+                    to a new in-memory database
+        :param store: the database which holds the items in seq
+        """
+        super().__init__()
+        if store is None:
+            self.persistent_log = SqliteHistoryStore()
+            self.extend(attr.evolve(item, idx=idx) for idx, item in enumerate(seq, start=1))
+            for item in self:
+                self.persistent_log.append(item, self)
+        else:
+            self.persistent_log = store
+            self.extend(seq)
+
+    @property
+    def store(self) -> SqliteHistoryStore:
+        """The database which holds the items"""
+        return self.persistent_log
+
+    def _items(self, seqs: List[int], include_persisted: bool) -> List[HistoryItem]:
+        """Return the items stored in rows with the given sequence numbers in the order of the list"""
+        first = 0 if include_persisted else self.session_start_index
+        positions = (self.store.position(seq) for seq in seqs)
+        return [self[pos] for pos in sorted(pos for pos in positions if pos is not None and first <= pos < len(self))]
+
+    def str_search(self, search: str, include_persisted: bool = False) -> List[HistoryItem]:
+        """Find history items which contain a given string using the full-text index
+
+        :param search: the string to search for
+        :param include_persisted: if True, then search full history including persisted history
+        :return: a list of history items, or an empty list if the string was not found
+        """
+        seqs = self.store.search(utils.norm_fold(search), folded=True)
+        return self._items(seqs, include_persisted)
+
+    def regex_search(self, regex: str, include_persisted: bool = False) -> List[HistoryItem]:
+        """Find history items which match a given regular expression
+
+        The full-text index is used to find the items which contain the longest run of plain characters
+        every match must contain. The regular expression is then used to filter those items.
+
+        :param regex: the regular expression to search for.
+        :param include_persisted: if True, then search full history including persisted history
+        :return: a list of history items, or an empty list if the string was not found
+        """
+        pattern = self._regex_pattern(regex)
+        finder = re.compile(pattern, re.DOTALL | re.MULTILINE)
+
+        literal = _required_literal(pattern)
+        if literal:
+            candidates = self._items(self.store.search(literal, folded=False), include_persisted)
+        else:
+            candidates = self._real_slice(None if include_persisted else self.session_start_index, None)
+
+        return [item for item in candidates if finder.search(item.raw) or finder.search(item.expanded)]
+
+    def time_span(self, since: Optional[float] = None, until: Optional[float] = None,
+                  include_persisted: bool = False) -> List[HistoryItem]:
+        """Find the history items whose commands started within a range of times using the database's index
+
+        :param since: earliest start time in seconds since the epoch or None for no limit
+        :param until: latest start time in seconds since the epoch or None for no limit
+        :param include_persisted: if True, then search full history including persisted history
+        :return: a list of history items in the order of the list
+        """
+        return self._items(self.store.time_search(since, until), include_persisted)
+
+    def truncate(self, max_length: int) -> None:
+        """Truncate the length of the history, dropping the oldest items if necessary
+
+        The dropped items stay in the database until it is compacted.
+
+        :param max_length: the maximum length of the history, if negative, all history
+                           items will be deleted
+        :return: nothing
+        """
+        old_length = len(self)
+        super().truncate(max_length)
+        self.store.truncated(old_length - len(self))
@@ -0,0 +1,263 @@
+# coding=utf-8
+"""
+Structured tracing of commands
+
+When :attr:`cmd2.Cmd.tracer` is set, every command run by :meth:`~cmd2.Cmd.onecmd_plus_hooks` produces a
+:class:`Trace` made of spans. The root span covers the whole command and has a child span for each phase
+of running it (parsing, hooks, redirection, the command function, and finalization). Steps within a phase,
+such as macro resolution or waiting on a pipe process, are children of that phase's span.
+
+Finished spans are handed to a :class:`SpanExporter`. :class:`JsonLinesExporter` writes them to a file
+from a background thread. When no tracer is set, tracing costs nothing beyond a few ``is None`` checks.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .metrics import perf_counter_ns
+
+# Names of the spans for the phases of running a command
+SPAN_COMMAND = 'command'
+SPAN_PARSE = 'parse'
+SPAN_MACRO_RESOLUTION = 'macro_resolution'
+SPAN_POSTPARSING_HOOKS = 'postparsing_hooks'
+SPAN_REDIRECTION_SETUP = 'redirection_setup'
+SPAN_PIPE_START = 'pipe_start'
+SPAN_PRECMD_HOOKS = 'precmd_hooks'
+SPAN_COMMAND_BODY = 'command_body'
+SPAN_POSTCMD_HOOKS = 'postcmd_hooks'
+SPAN_REDIRECTION_RESTORE = 'redirection_restore'
+SPAN_PIPE_WAIT = 'pipe_wait'
+SPAN_FINALIZATION = 'finalization_hooks'
+
+
+def _new_id(num_bytes: int) -> str:
+    """Return a random hex identifier"""
+    return os.urandom(num_bytes).hex()
+
+
+class Span:
+    """A named, timed piece of work within a trace"""
+    __slots__ = ['name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes']
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], start_ns: int, end_ns: int = 0,
+                 attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+
+        # Wall clock times in nanoseconds since the epoch
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+        self.attributes = attributes if attributes is not None else dict()
+
+    @property
+    def duration_ns(self) -> int:
+        """Length of the span in nanoseconds"""
+        return self.end_ns - self.start_ns
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return this span in a form suitable for JSON encoding"""
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start_ns': self.start_ns,
+                'end_ns': self.end_ns,
+                'duration_ns': self.duration_ns,
+                'attributes': self.attributes}
+
+
+class Trace:
+    """
+    Collects the spans of one command. Created by Tracer.start_trace().
+
+    Times passed to the record methods come from metrics.perf_counter_ns() and are converted to wall clock
+    times when the spans are created.
+    """
+    def __init__(self, tracer: 'Tracer', name: str, parent: Optional['Trace'] = None) -> None:
+        self._tracer = tracer
+        self._perf_start_ns = perf_counter_ns()
+        self._wall_start_ns = int(time.time() * 1000000000)
+
+        # Nested commands, like those run by run_script, belong to the trace of the command which ran them
+        if parent is None:
+            trace_id, parent_id = _new_id(16), None
+        else:
+            trace_id, parent_id = parent.root.trace_id, parent.root.span_id
+
+        self.root = Span(name, trace_id, parent_id, self._wall_start_ns)
+        self.spans = [self.root]
+
+        # Steps which will become children of the next phase
+        self._pending_steps = []
+
+    def _to_wall_ns(self, perf_ns: int) -> int:
+        """Convert a perf_counter_ns() time to nanoseconds since the epoch"""
+        return self._wall_start_ns + perf_ns - self._perf_start_ns
+
+    def record_phase(self, name: str, start_ns: int, end_ns: int) -> None:
+        """
+        Record a phase of running the command as a child of the root span.
+        Steps recorded since the previous phase become its children.
+
+        :param name: name of the span
+        :param start_ns: perf_counter_ns() time the phase started
+        :param end_ns: perf_counter_ns() time the phase ended
+        """
+        span = Span(name, self.root.trace_id, self.root.span_id, self._to_wall_ns(start_ns), self._to_wall_ns(end_ns))
+        for step in self._pending_steps:
+            step.parent_id = span.span_id
+        self._pending_steps.clear()
+        self.spans.append(span)
+
+    def record_step(self, name: str, start_ns: int, end_ns: int, **attributes) -> None:
+        """
+        Record a step within the current phase. It becomes a child of the next phase recorded.
+
+        :param name: name of the span
+        :param start_ns: perf_counter_ns() time the step started
+        :param end_ns: perf_counter_ns() time the step ended
+        :param attributes: attributes of the span
+        """
+        span = Span(name, self.root.trace_id, self.root.span_id, self._to_wall_ns(start_ns), self._to_wall_ns(end_ns),
+                    attributes)
+        self._pending_steps.append(span)
+        self.spans.append(span)
+
+    def finish(self, **attributes) -> None:
+        """
+        End the root span and export all spans of this trace
+
+        :param attributes: attributes added to the root span
+        """
+        self.root.end_ns = self._to_wall_ns(perf_counter_ns())
+        self.root.attributes.update(attributes)
+        self._pending_steps.clear()
+        self._tracer.exporter.export(self.spans)
+
+
+class SpanExporter:
+    """Base class for the destinations of finished spans"""
+    def export(self, spans: List[Span]) -> None:
+        """
+        Export the spans of a finished trace. This is called on the thread which ran the command,
+        so it should return quickly.
+
+        :param spans: the spans to export
+        """
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        """Export anything which is buffered and release resources"""
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Writes spans to a file as one JSON object per line.
+
+    Spans are queued and written in batches by a background thread so commands never wait on the file.
+    If the queue is full, new spans are dropped and counted in dropped_spans.
+    """
+    def __init__(self, path: str, *, batch_size: int = 256, flush_interval: float = 1.0,
+                 max_queue_size: int = 10000) -> None:
+        """
+        JsonLinesExporter initializer
+
+        :param path: file which spans are appended to
+        :param batch_size: maximum number of spans written at once
+        :param flush_interval: maximum number of seconds a span waits before it is written
+        :param max_queue_size: maximum number of spans waiting to be written
+        :raises: OSError if the file can't be opened
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped_spans = 0
+
+        self._file = open(path, 'a')
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = object()
+        self._thread = threading.Thread(name='trace_export_thread', target=self._run, daemon=True)
+        self._thread.start()
+
+        # Write whatever is still queued when the application exits
+        atexit.register(self.shutdown)
+
+    def export(self, spans: List[Span]) -> None:
+        """Queue spans to be written"""
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self.dropped_spans += 1
+
+    def _write(self, batch: List[Span]) -> None:
+        """Write a batch of spans to the file"""
+        try:
+            self._file.write(''.join(json.dumps(span.to_dict()) + '\n' for span in batch))
+            self._file.flush()
+        except (OSError, ValueError):
+            self.dropped_spans += len(batch)
+
+    def _run(self) -> None:
+        """Body of the export thread"""
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not self._stop:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (item is None or item is self._stop or len(batch) >= self.batch_size):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+            if item is self._stop:
+                return
+
+    def shutdown(self) -> None:
+        """Write all queued spans and close the file. The exporter can't be used afterward."""
+        if self._thread is None:
+            return
+
+        atexit.unregister(self.shutdown)
+        self._queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+
+class Tracer:
+    """Creates traces and sends their spans to an exporter"""
+    def __init__(self, exporter: SpanExporter) -> None:
+        self.exporter = exporter
+
+    def start_trace(self, name: str, *, parent: Optional[Trace] = None) -> Trace:
+        """
+        Start a new trace
+
+        :param name: name of the root span
+        :param parent: the trace of the command which is running this one, if any
+        """
+        return Trace(self, name, parent)
+
+    def shutdown(self) -> None:
+        """Shut down the exporter"""
+        self.exporter.shutdown()
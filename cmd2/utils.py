@@ -1,17 +1,23 @@
 # coding=utf-8
 """Shared utility functions"""
 
+import bisect
 import collections
 import collections.abc as collections_abc
+import concurrent.futures
 import glob
+import itertools
 import os
+import queue
 import re
+import stat
 import subprocess
 import sys
 import threading
+import time
 import unicodedata
 from enum import Enum
-from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Pattern, TextIO, Tuple, Union
 
 from . import constants
 
@@ -403,8 +409,12 @@ def files_from_glob_patterns(patterns: List[str], access=os.F_OK) -> List[str]:
 def get_exes_in_path(starts_with: str) -> List[str]:
     """Returns names of executables in a user's path
 
+    The executables in each directory are cached until the directory's modification time or the PATH environment
+    variable changes. Changing the permissions of a file doesn't update the directory, so a file made executable
+    after its directory was read is not found until something else in the directory changes.
+
     :param starts_with: what the exes should start with. leave blank for all exes in path.
-    :return: a list of matching exe names
+    :return: a sorted list of matching exe names
     """
     # Purposely don't match any executable containing wildcards
     wildcards = ['*', '?']
@@ -412,21 +422,197 @@ def get_exes_in_path(starts_with: str) -> List[str]:
         if wildcard in starts_with:
             return []
 
-    # Get a list of every directory in the PATH environment variable and ignore symbolic links
-    paths = [p for p in os.getenv('PATH').split(os.path.pathsep) if not os.path.islink(p)]
+    matches = _path_exes.get_index().complete(starts_with)
+
+    # Match the glob behavior of not listing hidden files unless they were asked for
+    if not starts_with.startswith('.'):
+        matches = [match for match in matches if not match.startswith('.')]
+    return matches
+
+
+class _PathExes:
+    """Cache of the executables in the directories of the PATH environment variable"""
+    def __init__(self) -> None:
+        # Maps a directory to its modification time when it was read and the names of the executables in it
+        self._dirs = {}  # type: Dict[str, Tuple[int, List[str]]]
+
+        # The PATH value and the modification times of its directories when the index was built
+        self._index_key = None
+        self._index = None  # type: Optional[CompletionIndex]
+        self._lock = threading.Lock()
+
+    def get_index(self) -> 'CompletionIndex':
+        """Return an index of the executables in PATH, reading only the directories which changed"""
+        with self._lock:
+            # Get the modification time of every directory in PATH and ignore symbolic links
+            dir_times = []
+            for path in os.getenv('PATH', '').split(os.path.pathsep):
+                try:
+                    path_stat = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(path_stat.st_mode):
+                    dir_times.append((path, path_stat.st_mtime_ns))
+
+            index_key = tuple(dir_times)
+            if index_key != self._index_key:
+                exes = set()
+                for path, mtime in dir_times:
+                    cached = self._dirs.get(path)
+                    if cached is None or cached[0] != mtime:
+                        cached = self._dirs[path] = (mtime, self._read_dir(path))
+                    exes.update(cached[1])
+
+                # Forget directories which are no longer in PATH
+                for path in self._dirs.keys() - dict(dir_times).keys():
+                    del self._dirs[path]
+
+                self._index = CompletionIndex(exes)
+                self._index_key = index_key
+            return self._index
+
+    @staticmethod
+    def _read_dir(path: str) -> List[str]:
+        """Return the names of the executable files in a directory"""
+        try:
+            return [entry.name for entry in os.scandir(path) if entry.is_file() and os.access(entry.path, os.X_OK)]
+        except OSError:
+            return []
+
+
+_path_exes = _PathExes()
+
+
+def get_users_with_home_dirs(starts_with: str, *, cache_ttl: float = 60.0, max_users: int = 10000) -> List[str]:
+    """Returns names of users in the password database whose home directories exist. Not available on Windows.
+
+    The names are cached since reading every user can take seconds when users come from a directory service
+    like LDAP. The database is read in a background thread, which is only waited for briefly the first time
+    and when cache_ttl is 0. Until the names have been read, or while the last read found more than max_users
+    users, a name is only returned once it has been typed in full, which is looked up with pwd.getpwnam().
+    Reads after cache_ttl always happen in the background, so the number of users is checked again without
+    waiting for it.
+
+    :param starts_with: what the user names should start with. leave blank for all users.
+    :param cache_ttl: number of seconds to reuse the names before reading the database again
+    :param max_users: maximum number of users to cache
+    :return: a sorted list of matching user names
+    """
+    return _users.complete(starts_with, cache_ttl, max_users)
+
+
+class _Users:
+    """Cache of the names and home directories in the password database"""
+    # Seconds a completion waits for the database to be read before only looking up the name typed in full
+    READ_WAIT = 0.5
+
+    def __init__(self) -> None:
+        self._index = None  # type: Optional[CompletionIndex]
+        self._homes = {}  # type: Dict[str, str]
+        self._read_time = None  # type: Optional[float]
+        self._too_many = False
+        self._reader = None  # type: Optional[threading.Thread]
+        self._lock = threading.Lock()
+
+    def complete(self, starts_with: str, cache_ttl: float, max_users: int) -> List[str]:
+        """See get_users_with_home_dirs()"""
+        import pwd
+
+        with self._lock:
+            reader = self._reader
+            if reader is None and (self._read_time is None or time.monotonic() - self._read_time >= cache_ttl):
+                reader = self._reader = threading.Thread(target=self._read, args=(max_users,), daemon=True)
+                reader.start()
+
+            # Stale names are used while they are refreshed, and a database with too many users isn't waited for
+            wait = reader is not None and not self._too_many and (self._index is None or cache_ttl <= 0)
+
+        if wait:
+            reader.join(self.READ_WAIT)
+
+        with self._lock:
+            index = self._index
+            homes = self._homes
+
+        if index is None:
+            try:
+                homes = {starts_with: pwd.getpwnam(starts_with).pw_dir}
+            except KeyError:
+                return []
+            names = [starts_with]
+        else:
+            names = index.complete(starts_with)
+
+        # Home directories are only checked for the matches, since checking every one is slow too
+        return [name for name in names if os.path.isdir(homes[name])]
+
+    def _read(self, max_users: int) -> None:
+        """Read the database. Runs in a background thread."""
+        import pwd
+
+        try:
+            entries = pwd.getpwall()
+        except Exception:
+            entries = None
+
+        with self._lock:
+            self._reader = None
+            self._read_time = time.monotonic()
+            if entries is None:
+                return
+            self._too_many = len(entries) > max_users
+            if self._too_many:
+                self._index = None
+                self._homes = {}
+            else:
+                self._homes = {entry.pw_name: entry.pw_dir for entry in entries}
+                self._index = CompletionIndex(self._homes)
 
-    # Use a set to store exe names since there can be duplicates
-    exes_set = set()
 
-    # Find every executable file in the user's path that matches the pattern
-    for path in paths:
-        full_path = os.path.join(path, starts_with)
-        matches = files_from_glob_pattern(full_path + '*', access=os.X_OK)
+_users = _Users()
+
+
+def scan_directory(path: str, *, cache_ttl: float = 0.0) -> List[Tuple[str, bool]]:
+    """
+    List a directory with os.scandir(), which usually knows whether each entry is a directory without another
+    system call. Symbolic links to directories count as directories.
+
+    :param path: the directory to list
+    :param cache_ttl: if greater than 0, the listing is cached and reused for this many seconds as long as the
+                      directory's modification time stays the same. This helps with very large directories and
+                      slow network file systems.
+    :return: a list of (name, is_dir) tuples in the order os.scandir() returned them
+    :raises: OSError if the directory can't be read
+    """
+    if cache_ttl <= 0:
+        return _read_directory(path)
+
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    now = time.monotonic()
+    with _dir_listings_lock:
+        cached = _dir_listings.get(key)
+        if cached is not None and cached[0] == mtime and now - cached[1] < cache_ttl:
+            return cached[2]
 
-        for match in matches:
-            exes_set.add(os.path.basename(match))
+    listing = _read_directory(key)
+    with _dir_listings_lock:
+        # Drop expired listings so only recently listed directories are kept
+        for expired in [cached_path for cached_path, cached in _dir_listings.items() if now - cached[1] >= cache_ttl]:
+            del _dir_listings[expired]
+        _dir_listings[key] = (mtime, now, listing)
+    return listing
 
-    return list(exes_set)
+
+def _read_directory(path: str) -> List[Tuple[str, bool]]:
+    """List a directory without the cache used by scan_directory()"""
+    return [(entry.name, entry.is_dir()) for entry in os.scandir(path)]
+
+
+# Listings cached by scan_directory(). Maps an absolute path to the directory's modification time,
+# the time.monotonic() value when it was listed, and the listing.
+_dir_listings = {}  # type: Dict[str, Tuple[int, float, List[Tuple[str, bool]]]]
+_dir_listings_lock = threading.Lock()
 
 
 class StdSim:
@@ -664,6 +850,86 @@ class ContextFlag:
             raise ValueError("count has gone below 0")
 
 
+class BackgroundWorker:
+    """Runs functions one at a time in a daemon thread and returns their results through futures.
+
+    Unlike concurrent.futures.ThreadPoolExecutor, its thread does not keep the interpreter from exiting
+    while a function which never returns is still running. A running function can also be abandoned
+    so the functions submitted after it don't wait for it.
+    """
+    def __init__(self, name: str) -> None:
+        """
+        BackgroundWorker initializer
+
+        :param name: name of the thread, which is started the first time a function is submitted
+        """
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        # The thread which runs the queued functions and the future of the function it is running
+        self._thread = None
+        self._current = None
+
+    def submit(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Queue a function to run after those submitted before it
+
+        :param func: the function to run
+        :param args: positional arguments for func
+        :param kwargs: keyword arguments for func
+        :return: a future which holds the return value or exception of func. Cancelling the future
+                 before func starts keeps it from running.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._queue.put((future, func, args, kwargs))
+            if self._thread is None:
+                self._start_thread()
+        return future
+
+    def abandon(self, future: concurrent.futures.Future) -> None:
+        """
+        Give up on a function whose result is no longer needed. If it hasn't started, then it won't run.
+        If it is running, then it finishes in its thread while a new thread runs the queued functions.
+
+        :param future: a future returned by submit()
+        """
+        if future.cancel():
+            return
+        with self._lock:
+            if future is self._current:
+                self._current = None
+                self._start_thread()
+
+    def _start_thread(self) -> None:
+        """Start a new thread to run the queued functions. The lock must be held."""
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Run the queued functions until a function this thread is running is abandoned"""
+        thread = threading.current_thread()
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            with self._lock:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._current = future
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as ex:
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+            with self._lock:
+                if self._thread is not thread:
+                    # The function was abandoned and another thread runs the queued functions
+                    return
+                self._current = None
+
+
 class RedirectionSavedState:
     """Created by each command to store information about their redirection."""
 
@@ -682,7 +948,8 @@ class RedirectionSavedState:
 
 
 # noinspection PyUnusedLocal
-def basic_complete(text: str, line: str, begidx: int, endidx: int, match_against: Iterable) -> List[str]:
+def basic_complete(text: str, line: str, begidx: int, endidx: int, match_against: Iterable, *,
+                   mode: str = constants.COMPLETION_MODE_PREFIX) -> List[str]:
     """
     Basic tab completion function that matches against a list of strings without considering line contents
     or cursor position. The args required by this function are defined in the header of Python's cmd.py.
@@ -691,10 +958,177 @@ def basic_complete(text: str, line: str, begidx: int, endidx: int, match_against
     :param line: the current input line with leading whitespace removed
     :param begidx: the beginning index of the prefix text
     :param endidx: the ending index of the prefix text
-    :param match_against: the strings being matched against
+    :param match_against: the strings being matched against. A CompletionIndex is searched without scanning
+                          all of its strings.
+    :param mode: one of the modes in constants.COMPLETION_MODES. Defaults to COMPLETION_MODE_PREFIX, which
+                 matches strings that begin with text. The substring and fuzzy modes ignore case and return
+                 the matches ranked by how closely they match text.
     :return: a list of possible tab completions
+    :raises: ValueError if mode is not a valid completion mode
     """
-    return [cur_match for cur_match in match_against if cur_match.startswith(text)]
+    if isinstance(match_against, CompletionIndex):
+        return match_against.complete(text, mode=mode)
+    _check_completion_mode(mode)
+
+    # Every string contains empty text, so it is matched as a prefix in all modes
+    if mode == constants.COMPLETION_MODE_PREFIX or not text:
+        return [cur_match for cur_match in match_against if cur_match.startswith(text)]
+
+    pattern = _completion_pattern(text, mode)
+    text_len = len(text.casefold())
+    ranked = []
+    for cur_match in match_against:
+        found = pattern.search(cur_match.casefold())
+        if found:
+            ranked.append((_match_rank(found, text_len, cur_match), cur_match))
+    ranked.sort(key=lambda rank_and_match: rank_and_match[0])
+    return [cur_match for _, cur_match in ranked]
+
+
+def _check_completion_mode(mode: str) -> None:
+    """:raises: ValueError if mode is not one of constants.COMPLETION_MODES"""
+    if mode not in constants.COMPLETION_MODES:
+        raise ValueError("Invalid completion mode {!r}: must be one of {}".format(mode, constants.COMPLETION_MODES))
+
+
+def _completion_pattern(text: str, mode: str) -> Pattern:
+    """
+    Build the regular expression which finds text in casefolded strings for the substring and fuzzy
+    completion modes. Group 1 is the part of the string which matched. The rest of the string is also
+    consumed, up to the NUL CompletionIndex puts between its strings, so a search of all of them finds
+    each string at most once.
+    """
+    chars = [re.escape(char) for char in text.casefold()]
+    if mode == constants.COMPLETION_MODE_SUBSTRING:
+        return re.compile('({})[^\0]*'.format(''.join(chars)))
+
+    # In the fuzzy mode, each character is matched at its first occurrence after the previous one.
+    # This finds the shortest match for each start position without backtracking.
+    gaps = ''.join('[^\0{0}]*{0}'.format(char) for char in chars[1:])
+    return re.compile('({}{})[^\0]*'.format(chars[0], gaps))
+
+
+def _match_rank(found, text_len: int, cur_match: str) -> Tuple:
+    """
+    Rank a substring or fuzzy match. Lower ranks are better. Matches at the start of the string come first,
+    followed by those with fewer characters between the matched ones, an earlier start, and a shorter string.
+
+    :param found: the regular expression match in the casefolded string
+    :param text_len: length of the casefolded text being completed
+    :param cur_match: the matched string
+    """
+    start, end = found.span(1)
+    return start != 0, end - start - text_len, start, len(cur_match), cur_match
+
+
+class CompletionIndex:
+    """
+    A sorted collection of completion choices which finds those that start with some text without checking
+    every choice. Finding the k matches among n choices takes O(log n + k) time instead of the O(n) time of
+    matching against a list, which matters once there are hundreds of thousands of choices.
+
+    Return one from a choices function/method or pass it as the choices of an argparse argument and
+    ArgparseCompleter searches it directly. Build it once and reuse it, since sorting the choices takes
+    O(n log n) time. CompletionItems keep their descriptions, and other objects are converted to strings.
+
+    The substring and fuzzy completion modes search one casefolded string holding every choice with a single
+    regular expression, which is built the first time those modes are used. Nearly every choice contains a
+    single character, so ranking them all would be slow. For one character, these modes list the choices
+    which start with it followed by the others which contain it, both in sorted order.
+    """
+    def __init__(self, choices: Iterable[Any] = ()) -> None:
+        """
+        CompletionIndex initializer
+
+        :param choices: the choices to search
+        """
+        self._choices = sorted(choice if isinstance(choice, str) else str(choice) for choice in choices)
+
+        # The casefolded choices, those choices separated by NULs, and where each one starts in that string.
+        # Used by the substring and fuzzy modes.
+        self._folded_choices = None
+        self._folded = None
+        self._folded_starts = None
+
+    def __len__(self) -> int:
+        return len(self._choices)
+
+    def __iter__(self):
+        return iter(self._choices)
+
+    def __contains__(self, choice: Any) -> bool:
+        if not isinstance(choice, str):
+            choice = str(choice)
+        pos = bisect.bisect_left(self._choices, choice)
+        return pos < len(self._choices) and self._choices[pos] == choice
+
+    def __repr__(self) -> str:
+        return '{}({} choices)'.format(type(self).__name__, len(self._choices))
+
+    def add(self, choice: Any) -> None:
+        """Add a choice, which takes O(n) time"""
+        bisect.insort(self._choices, choice if isinstance(choice, str) else str(choice))
+        self._folded_choices = self._folded = self._folded_starts = None
+
+    def complete(self, text: str, exclude: Optional[collections_abc.Container] = None, *,
+                 mode: str = constants.COMPLETION_MODE_PREFIX) -> List[str]:
+        """
+        Find the choices which match text
+
+        :param text: the text being completed
+        :param exclude: choices to leave out of the results, such as values already on the command line.
+                        Use a set so checking each match takes constant time.
+        :param mode: one of the modes in constants.COMPLETION_MODES. See basic_complete().
+        :return: the matching choices in sorted order for the prefix mode and ranked for the others
+        :raises: ValueError if mode is not a valid completion mode
+        """
+        _check_completion_mode(mode)
+        if mode != constants.COMPLETION_MODE_PREFIX and text:
+            return self._search(text, exclude, mode)
+
+        matches = []
+        for pos in range(bisect.bisect_left(self._choices, text), len(self._choices)):
+            choice = self._choices[pos]
+            if not choice.startswith(text):
+                break
+            if exclude is None or choice not in exclude:
+                matches.append(choice)
+        return matches
+
+    def _search(self, text: str, exclude: Optional[collections_abc.Container], mode: str) -> List[str]:
+        """Find and rank the choices which match text in the substring or fuzzy mode"""
+        pattern = _completion_pattern(text, mode)
+        if self._folded is None:
+            folded = [choice.casefold() for choice in self._choices]
+            self._folded_starts = list(itertools.accumulate([0] + [len(choice) + 1 for choice in folded[:-1]]))
+            self._folded = '\0'.join(folded)
+            self._folded_choices = folded
+
+        folded_text = text.casefold()
+        if len(folded_text) == 1:
+            folded = self._folded_choices
+            containing = [pos for pos, choice in enumerate(folded) if folded_text in choice]
+            ordered = [pos for pos in containing if folded[pos][0] == folded_text]
+            if len(ordered) < len(containing):
+                ordered.extend(pos for pos in containing if folded[pos][0] != folded_text)
+            matches = [self._choices[pos] for pos in ordered]
+            return matches if exclude is None else [choice for choice in matches if choice not in exclude]
+
+        # This loop runs once per match, so the rank from _match_rank() is built inline and ties are broken by
+        # the position of the choice in the sorted list, since comparing ints is faster than comparing strings
+        text_len = len(folded_text)
+        starts = self._folded_starts
+        ranked = []
+        for found in pattern.finditer(self._folded):
+            index = bisect.bisect_right(starts, found.start()) - 1
+            match_start, match_end = found.span(1)
+            start = match_start - starts[index]
+            ranked.append((start != 0, match_end - match_start - text_len, start, len(self._choices[index]), index))
+        ranked.sort()
+
+        if exclude is None:
+            return [self._choices[rank[-1]] for rank in ranked]
+        return [choice for choice in (self._choices[rank[-1]] for rank in ranked) if choice not in exclude]
 
 
 class TextAlignment(Enum):
@@ -0,0 +1,206 @@
+# coding=utf-8
+"""
+Watchdog which reports commands that run too long
+
+:class:`~cmd2.Cmd` uses a :class:`Watchdog` when the slow_command_threshold or slow_command_timeout settings
+are greater than 0. A background thread captures the stack of a command which runs longer than the threshold
+without interrupting it, and can cancel a command which runs longer than the timeout.
+"""
+
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+
+def format_stacks(thread_id: int, *, all_threads: bool = False) -> str:
+    """
+    Format the current stack of a thread and optionally every other thread
+
+    :param thread_id: identifier of the thread whose stack is formatted first
+    :param all_threads: if True, then also include the stacks of all other threads
+    :return: the formatted stacks
+    """
+    frames = sys._current_frames()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+    thread_ids = [thread_id]
+    if all_threads:
+        thread_ids.extend(sorted(ident for ident in frames if ident not in (thread_id, threading.get_ident())))
+
+    stacks = []
+    for ident in thread_ids:
+        frame = frames.get(ident)
+        if frame is None:
+            continue
+        stacks.append('Stack of thread {!r} (most recent call last):\n'.format(names.get(ident, ident)))
+        stacks.append(''.join(traceback.format_stack(frame)))
+
+    # Release the frames since they reference the locals of every running function
+    del frames
+    return ''.join(stacks)
+
+
+class WatchedCommand:
+    """A command being watched by a Watchdog. Created by Watchdog.watch()."""
+    def __init__(self, watchdog: 'Watchdog', command: str, threshold: float, timeout: float,
+                 all_threads: bool) -> None:
+        self.command = command
+        self.threshold = threshold
+        self.timeout = timeout
+        self.all_threads = all_threads
+        self.thread_id = threading.get_ident()
+        self.start = 0.0
+
+        # Set when the command finishes. The lock is held while checking it and cancelling the command.
+        self.finished = False
+        self._cancel_lock = threading.Lock()
+
+        # Set by the watchdog thread
+        self.reported = False
+        self.cancel_attempts = 0
+
+        self._watchdog = watchdog
+        self._next_cancel = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        """Number of seconds the command has been running"""
+        return time.perf_counter() - self.start
+
+    def _next_deadline(self) -> Optional[float]:
+        """Return the perf_counter() time of the next action for this command or None if there are none left"""
+        deadlines = []
+        if self.threshold > 0 and not self.reported:
+            deadlines.append(self.start + self.threshold)
+        if self.timeout > 0:
+            deadlines.append(max(self.start + self.timeout, self._next_cancel))
+        return min(deadlines) if deadlines else None
+
+    def __enter__(self) -> 'WatchedCommand':
+        self.start = time.perf_counter()
+        self._watchdog._add(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        # Wait for a cancellation being sent so it can't arrive after the command finishes
+        try:
+            with self._cancel_lock:
+                self.finished = True
+        finally:
+            # The cancellation may interrupt the wait. The command is marked finished before waiting for the
+            # watchdog's lock, so the watchdog thread drops it even if that wait is interrupted too.
+            self.finished = True
+            self._watchdog._remove(self)
+
+
+class Watchdog:
+    """
+    Background thread which reports commands that run too long and optionally cancels them
+
+    The thread is only started once the first command is watched.
+    """
+    # Seconds between attempts to cancel a command that is still running after it was cancelled.
+    # The first attempt can be ignored if it arrives while the command is in a section protected from SIGINT.
+    CANCEL_RETRY_INTERVAL = 1.0
+
+    def __init__(self, *, report: Callable[[WatchedCommand, str], None],
+                 cancel: Callable[[WatchedCommand], None]) -> None:
+        """
+        Watchdog initializer
+
+        :param report: called from the watchdog thread with a command and its formatted stacks when the command
+                       has run longer than its threshold
+        :param cancel: called from the watchdog thread with a command when it has run longer than its timeout.
+                       It is called again every CANCEL_RETRY_INTERVAL seconds while the command is still running.
+                       The command can't finish while it runs, so it should return quickly.
+        """
+        self._report = report
+        self._cancel = cancel
+        self._watched = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def watch(self, command: str, *, threshold: float = 0, timeout: float = 0,
+              all_threads: bool = False) -> WatchedCommand:
+        """
+        Return a context manager which watches a command while it is active.
+
+        Watches can be nested, such as when a command runs a script of other commands.
+
+        :param command: name of the command being watched
+        :param threshold: seconds after which the command's stack is reported. 0 disables the report.
+        :param timeout: seconds after which the command is cancelled. 0 disables cancellation.
+        :param all_threads: if True, then the report includes the stacks of all threads
+        """
+        return WatchedCommand(self, command, threshold, timeout, all_threads)
+
+    def _add(self, watched: WatchedCommand) -> None:
+        """Start watching a command"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(name='watchdog_thread', target=self._run, daemon=True)
+                self._thread.start()
+            self._watched.append(watched)
+            self._cond.notify()
+
+    def _remove(self, watched: WatchedCommand) -> None:
+        """Stop watching a command"""
+        with self._cond:
+            if watched in self._watched:
+                self._watched.remove(watched)
+            self._cond.notify()
+
+    def _wait(self) -> Tuple[Optional[Tuple[WatchedCommand, str]], List[WatchedCommand]]:
+        """
+        Wait until a command has run longer than its threshold or timeout. The lock must be held.
+
+        :return: a tuple of the command to report along with its formatted stacks, or None if there isn't one,
+                 and the list of commands to cancel
+        """
+        while True:
+            now = time.perf_counter()
+            next_deadline = None
+            cancels = []
+
+            # Drop commands whose removal was interrupted
+            self._watched = [watched for watched in self._watched if not watched.finished]
+
+            for watched in self._watched:
+                deadline = watched._next_deadline()
+                if deadline is None:
+                    continue
+
+                if deadline > now:
+                    next_deadline = deadline if next_deadline is None else min(next_deadline, deadline)
+                elif watched.threshold > 0 and not watched.reported and now >= watched.start + watched.threshold:
+                    watched.reported = True
+                    return (watched, format_stacks(watched.thread_id, all_threads=watched.all_threads)), cancels
+                else:
+                    watched.cancel_attempts += 1
+                    watched._next_cancel = now + self.CANCEL_RETRY_INTERVAL
+                    cancels.append(watched)
+
+            if cancels:
+                return None, cancels
+
+            if next_deadline is None:
+                self._cond.wait()
+            else:
+                self._cond.wait(next_deadline - now)
+
+    def _run(self) -> None:
+        """Body of the watchdog thread"""
+        while True:
+            with self._cond:
+                report, cancels = self._wait()
+
+            # Report and cancel without holding the lock so commands aren't blocked from starting or finishing.
+            # Cancelling interrupts the command's thread, which may be waiting for the lock to finish.
+            for watched in cancels:
+                with watched._cancel_lock:
+                    if not watched.finished:
+                        self._cancel(watched)
+            if report is not None:
+                self._report(*report)
@@ -44,8 +44,8 @@ def verify_help_text(cmd2_app: cmd2.Cmd, help_output: Union[str, List[str]]) ->
 
 
 # Help text for the history command
-HELP_HISTORY = """Usage: history [-h] [-r | -e | -o FILE | -t TRANSCRIPT_FILE | -c] [-s] [-x]
-               [-v] [-a]
+HELP_HISTORY = """Usage: history [-h] [-r | -e | -o FILE | -t TRANSCRIPT_FILE | -c | --stats]
+               [-s] [-x] [-v] [-a] [--since TIME] [--until TIME] [--fuzzy]
                [arg]
 
 View, run, edit, save, or clear previously entered commands
@@ -67,6 +67,10 @@ optional arguments:
                         output commands and results to a transcript file,
                         implies -s
   -c, --clear           clear all history
+  --stats               show how often the selected commands ran, how long
+                        they took, and which were slowest
+  --fuzzy               treat arg as a string and select items which contain the
+                        characters of each of its words in order
 
 formatting:
   -s, --script          output commands in script format, i.e. without command
@@ -77,6 +81,11 @@ formatting:
                         differ from the typed command
   -a, --all             display all commands, including ones persisted from
                         previous sessions
+
+time range:
+  --since TIME          only select commands which started at or after TIME,
+                        e.g. 30m, 12h, 7d, 2w, or YYYY-MM-DD [HH:MM[:SS]]
+  --until TIME          only select commands which started at or before TIME
 """
 
 # Output from the shortcuts command with default built-in shortcuts
@@ -89,24 +98,52 @@ SHORTCUTS_TXT = """Shortcuts for other commands:
 
 # Output from the show command with default settings
 SHOW_TXT = """allow_style: 'Terminal'
+completion_mode: 'prefix'
+completion_timeout: 0.0
 debug: False
 echo: False
 editor: 'vim'
 feedback_to_output: False
 max_completion_items: 50
+metrics_file: ''
+metrics_interval: 60.0
+profile: False
+profile_dir: 'profiles'
+profile_threshold: 1.0
 quiet: False
+sample: False
+sample_interval: 0.01
+share_history: False
+slow_command_threshold: 0.0
+slow_command_timeout: 0.0
 timing: False
+trace_file: ''
+track_memory: False
 """
 
 SHOW_LONG = """
-allow_style: 'Terminal'   # Allow ANSI text style sequences in output (valid values: Terminal, Always, Never)
-debug: False              # Show full traceback on exception
-echo: False               # Echo command issued into output
-editor: 'vim'             # Program used by 'edit'
-feedback_to_output: False # Include nonessentials in '|', '>' results
-max_completion_items: 50  # Maximum number of CompletionItems to display during tab completion
-quiet: False              # Don't print nonessential feedback
-timing: False             # Report execution times
+allow_style: 'Terminal'     # Allow ANSI text style sequences in output (valid values: Terminal, Always, Never)
+completion_mode: 'prefix'   # How tab completion matches text (valid values: prefix, substring, fuzzy)
+completion_timeout: 0.0     # Seconds to wait for tab completion before finishing it in the background (0 to always wait)
+debug: False                # Show full traceback on exception
+echo: False                 # Echo command issued into output
+editor: 'vim'               # Program used by 'edit'
+feedback_to_output: False   # Include nonessentials in '|', '>' results
+max_completion_items: 50    # Maximum number of CompletionItems to display during tab completion
+metrics_file: ''            # File where command metrics are periodically written as JSON (empty to disable)
+metrics_interval: 60.0      # Seconds between writes of metrics_file
+profile: False              # Profile commands and save the results of slow ones
+profile_dir: 'profiles'     # Directory where 'profile' and 'sample' save results
+profile_threshold: 1.0      # Seconds a command must run for 'profile' and 'sample' to save its results
+quiet: False                # Don't print nonessential feedback
+sample: False               # Sample the stacks of commands and save the results of slow ones
+sample_interval: 0.01       # Seconds between stack samples
+share_history: False        # Add commands other sessions write to the persistent history file
+slow_command_threshold: 0.0 # Seconds after which the stack of a running command is reported (0 to disable)
+slow_command_timeout: 0.0   # Seconds after which a running command is cancelled (0 to disable)
+timing: False               # Report execution times
+trace_file: ''              # File where command traces are written as JSON lines (empty to disable)
+track_memory: False         # Record the memory used by each command
 """
 
 
@@ -888,3 +888,90 @@ def test_complete_command_help_no_tokens(ac_app):
 
     completions = ac.complete_subcommand_help(tokens=[], text='', line='', begidx=0, endidx=0)
     assert not completions
+
+
+def test_parser_info_reused(ac_app):
+    from cmd2.argparse_completer import ArgparseCompleter, _ParserInfo
+
+    parser = Cmd2ArgumentParser()
+    parser.add_argument('--flag')
+    first = ArgparseCompleter(parser, ac_app)
+    second = ArgparseCompleter(parser, ac_app)
+    assert first._flag_to_action is second._flag_to_action
+    assert _ParserInfo.get(parser).flags == ['-h', '--help', '--flag']
+
+
+def test_parser_info_rebuilt_after_change(ac_app):
+    from cmd2.argparse_completer import ArgparseCompleter
+
+    parser = Cmd2ArgumentParser()
+    parser.add_argument('--flag')
+    ArgparseCompleter(parser, ac_app)
+
+    # Completers created after the parser changes see the new arguments
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--one', action='store_true')
+    group.add_argument('--two', action='store_true')
+    parser.add_argument('pos')
+    ac = ArgparseCompleter(parser, ac_app)
+    assert '--one' in ac._flags
+    assert len(ac._positional_actions) == 1
+
+    completions = ac.complete_command(tokens=['cmd', '--one', '--'], text='--', line='cmd --one --',
+                                      begidx=10, endidx=12)
+    assert '--two' not in completions
+    assert '--flag' in completions
+
+
+def test_completion_index_choices(ac_app):
+    from cmd2.argparse_completer import ArgparseCompleter
+
+    index = cmd2.CompletionIndex(['host{}'.format(i) for i in range(1000)])
+    parser = Cmd2ArgumentParser()
+    parser.add_argument('hosts', nargs='+', choices_function=lambda: index)
+    parser.add_argument('--fixed', choices=cmd2.CompletionIndex(['one', 'two']))
+    ac = ArgparseCompleter(parser, ac_app)
+
+    # Values already on the command line are not completed again
+    completions = ac.complete_command(tokens=['cmd', 'host10', 'host10'], text='host10', line='cmd host10 host10',
+                                      begidx=11, endidx=17)
+    assert len(completions) == 10 and 'host10' not in completions and 'host101' in completions
+
+    completions = ac.complete_command(tokens=['cmd', '--fixed', 't'], text='t', line='cmd --fixed t',
+                                      begidx=12, endidx=13)
+    assert completions == ['two']
+
+
+def test_completion_mode_per_argument(ac_app):
+    from cmd2.argparse_completer import ArgparseCompleter
+
+    parser = Cmd2ArgumentParser()
+    parser.add_argument('--host', choices=['web-prod', 'db-prod', 'web-dev'], completion_mode='substring')
+    parser.add_argument('--index', choices=cmd2.CompletionIndex(['web-prod', 'db-prod', 'web-dev']),
+                        completion_mode='fuzzy')
+    parser.add_argument('--color', choices=['red', 'green', 'blue'])
+    ac = ArgparseCompleter(parser, ac_app)
+
+    completions = ac.complete_command(tokens=['cmd', '--host', 'PROD'], text='PROD', line='cmd --host PROD',
+                                      begidx=11, endidx=15)
+    assert completions == ['db-prod', 'web-prod']
+    assert ac_app.matches_fuzzy
+
+    completions = ac.complete_command(tokens=['cmd', '--index', 'wd'], text='wd', line='cmd --index wd',
+                                      begidx=12, endidx=14)
+    assert completions == ['web-dev', 'web-prod']
+
+    # Other arguments use the completion_mode setting
+    ac_app.matches_fuzzy = False
+    completions = ac.complete_command(tokens=['cmd', '--color', 'b'], text='b', line='cmd --color b',
+                                      begidx=12, endidx=13)
+    assert completions == ['blue']
+    assert not ac_app.matches_fuzzy
+
+    ac_app.completion_mode = 'substring'
+    completions = ac.complete_command(tokens=['cmd', '--color', 'e'], text='e', line='cmd --color e',
+                                      begidx=12, endidx=13)
+    assert completions == ['red', 'green', 'blue']
+
+    with pytest.raises(ValueError):
+        parser.add_argument('--bad', choices=['a'], completion_mode='exact')
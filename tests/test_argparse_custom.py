@@ -244,6 +244,22 @@ def test_apcustom_required_options():
     assert 'required arguments' in parser.format_help()
 
 
+def test_choices_callable_takes_arg_tokens():
+    from cmd2.argparse_custom import ChoicesCallable
+
+    def choices_func(arg_tokens):
+        return []
+
+    def completer_method(self, text, line, begidx, endidx):
+        return []
+
+    assert ChoicesCallable(is_method=False, is_completer=False, to_call=choices_func).takes_arg_tokens
+    assert not ChoicesCallable(is_method=True, is_completer=True, to_call=completer_method).takes_arg_tokens
+
+    # Callables without a signature don't get arg_tokens
+    assert not ChoicesCallable(is_method=False, is_completer=False, to_call=max).takes_arg_tokens
+
+
 def test_override_parser():
     import importlib
     from cmd2 import DEFAULT_ARGUMENT_PARSER
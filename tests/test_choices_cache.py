@@ -0,0 +1,215 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/choices_cache.py module
+"""
+import argparse
+import threading
+
+import pytest
+
+import cmd2
+from cmd2 import with_argparser, Cmd2ArgumentParser
+from cmd2.choices_cache import CacheSettings, ChoicesCache
+from .conftest import complete_tester
+
+# Functions which count how many times they were called
+calls = {'host': 0, 'disk': 0, 'file': 0, 'color': 0}
+
+def reset_calls():
+    for name in calls:
+        calls[name] = 0
+
+@cmd2.cached_choices(60)
+def color_choices():
+    calls['color'] += 1
+    return (color for color in ['red', 'green', 'blue'])
+
+
+class CachedApp(cmd2.Cmd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def host_choices(self):
+        calls['host'] += 1
+        return ['alpha', 'beta']
+
+    @cmd2.cached_choices(60, key=lambda arg_tokens: arg_tokens['host'][0])
+    def disk_choices(self, arg_tokens):
+        calls['disk'] += 1
+        return ['{}-disk{}'.format(arg_tokens['host'][0], i) for i in range(2)]
+
+    def file_completer(self, text, line, begidx, endidx):
+        calls['file'] += 1
+        self.matches_delimited = True
+        self.display_matches = ['file1', 'file2']
+        return [match for match in ['dir/file1', 'dir/file2'] if match.startswith(text)]
+
+    inventory_parser = Cmd2ArgumentParser()
+    inventory_parser.add_argument('host', choices_method=host_choices, choices_cache_ttl=60)
+    inventory_parser.add_argument('disk', choices_method=disk_choices)
+    inventory_parser.add_argument('--file', completer_method=file_completer, choices_cache_ttl=60)
+    inventory_parser.add_argument('--color', choices_function=color_choices)
+
+    @with_argparser(inventory_parser)
+    def do_inventory(self, args):
+        pass
+
+
+@pytest.fixture
+def cached_app():
+    reset_calls()
+    return CachedApp()
+
+def complete(app, line):
+    text = line.split(' ')[-1]
+    return complete_tester(text, line, len(line) - len(text), len(line), app)
+
+def test_choices_method_cached(cached_app):
+    for _ in range(3):
+        complete(cached_app, 'inventory ')
+        assert cached_app.completion_matches == ['alpha', 'beta']
+    assert calls['host'] == 1
+
+    # Another app has its own cache
+    other_app = CachedApp()
+    complete(other_app, 'inventory ')
+    assert calls['host'] == 2
+
+    assert cached_app.invalidate_choices_cache(cached_app.host_choices) == 1
+    complete(cached_app, 'inventory a')
+    assert cached_app.completion_matches == ['alpha ']
+    assert calls['host'] == 3
+
+def test_cache_key(cached_app):
+    complete(cached_app, 'inventory alpha ')
+    complete(cached_app, 'inventory alpha a')
+    assert cached_app.completion_matches == ['alpha-disk0', 'alpha-disk1']
+    assert calls['disk'] == 1
+
+    complete(cached_app, 'inventory beta ')
+    assert cached_app.completion_matches == ['beta-disk0', 'beta-disk1']
+    assert calls['disk'] == 2
+
+    # Remove the results of one argument
+    disk_action = CachedApp.inventory_parser._actions[2]
+    assert cached_app.invalidate_choices_cache(disk_action) == 2
+    complete(cached_app, 'inventory beta ')
+    assert calls['disk'] == 3
+
+def test_decorated_function(cached_app):
+    # The generator the function returns is cached as a list
+    complete(cached_app, 'inventory --color ')
+    complete(cached_app, 'inventory --color ')
+    assert cached_app.completion_matches == ['blue', 'green', 'red']
+    assert calls['color'] == 1
+
+    assert cached_app.invalidate_choices_cache() == 1
+    complete(cached_app, 'inventory --color g')
+    assert cached_app.completion_matches == ['green ']
+    assert calls['color'] == 2
+
+def test_completer_settings_restored(cached_app):
+    complete(cached_app, 'inventory --file dir/f')
+    assert calls['file'] == 1
+
+    complete(cached_app, 'inventory --file dir/f')
+    assert calls['file'] == 1
+    assert cached_app.matches_delimited
+    assert cached_app.display_matches == ['file1', 'file2']
+
+    # Completers are called again for different text
+    complete(cached_app, 'inventory --file dir/file2')
+    assert calls['file'] == 2
+
+def test_expired():
+    cache = ChoicesCache()
+    action = argparse.Action(['--flag'], 'flag')
+    values = iter(range(10))
+    settings = CacheSettings(0)
+    assert cache.get(action, reset_calls, settings, None, lambda: next(values)) == 0
+    assert cache.get(action, reset_calls, settings, None, lambda: next(values)) == 1
+    assert len(cache) == 1
+
+def test_expired_entries_removed():
+    cache = ChoicesCache()
+    action = argparse.Action(['--flag'], 'flag')
+
+    # Expired entries of other keys are removed when results are stored
+    for text in ['a', 'ab', 'abc']:
+        cache.get(action, reset_calls, CacheSettings(0), text, lambda: [text])
+    assert list(cache._entries) == [(action, reset_calls, 'abc')]
+
+    # Entries which are refreshed in the background are kept until they are used again
+    cache.get(action, reset_calls, CacheSettings(0, refresh_in_background=True), 'kept', lambda: [])
+    cache.get(action, reset_calls, CacheSettings(60), 'new', lambda: [])
+    assert len(cache) == 2
+
+def test_max_entries(monkeypatch):
+    monkeypatch.setattr(ChoicesCache, 'MAX_ENTRIES', 3)
+    cache = ChoicesCache()
+    action = argparse.Action(['--flag'], 'flag')
+    settings = CacheSettings(60)
+    for key in range(3):
+        cache.get(action, reset_calls, settings, key, lambda: key)
+
+    # The least recently used entry is removed
+    assert cache.get(action, reset_calls, settings, 0, lambda: 'refetched') == 0
+    cache.get(action, reset_calls, settings, 3, lambda: 3)
+    assert [key for _, _, key in cache._entries] == [2, 0, 3]
+
+def test_refresh_in_background():
+    cache = ChoicesCache()
+    action = argparse.Action(['--flag'], 'flag')
+    settings = CacheSettings(0, refresh_in_background=True)
+    refreshed = threading.Event()
+    values = iter(['first', 'second'])
+
+    def fetch():
+        value = next(values)
+        if value == 'second':
+            refreshed.set()
+        return value
+
+    assert cache.get(action, fetch, settings, None, fetch) == 'first'
+
+    # The expired results are returned while the new ones are fetched
+    assert cache.get(action, fetch, settings, None, fetch) == 'first'
+    assert refreshed.wait(5)
+    for _ in range(500):
+        if not cache._refreshing:
+            break
+        threading.Event().wait(0.01)
+    assert cache._entries[(action, fetch, None)].value == 'second'
+
+def test_failed_refresh_drops_results():
+    cache = ChoicesCache()
+    action = argparse.Action(['--flag'], 'flag')
+    settings = CacheSettings(0, refresh_in_background=True)
+
+    def fetch():
+        raise cmd2.CompletionError('server is down')
+
+    cache._entries[(action, fetch, None)] = _entry(action, fetch)
+    cache._refresh((action, fetch, None), fetch, settings, cache._generation)
+    assert len(cache) == 0
+
+    with pytest.raises(cmd2.CompletionError):
+        cache.get(action, fetch, settings, None, fetch)
+
+def _entry(action, provider):
+    from cmd2.choices_cache import _CacheEntry
+    return _CacheEntry(action, provider, ['stale'], CacheSettings(0, refresh_in_background=True))
+
+def test_invalid_settings():
+    parser = Cmd2ArgumentParser()
+    with pytest.raises(ValueError) as excinfo:
+        parser.add_argument('name', choices_cache_ttl=5)
+    assert 'choices_cache_ttl can only be used' in str(excinfo.value)
+
+    with pytest.raises(ValueError) as excinfo:
+        parser.add_argument('name', choices_function=color_choices, choices_cache_key=lambda arg_tokens: None)
+    assert 'choices_cache_key can only be used' in str(excinfo.value)
+
+    with pytest.raises(ValueError):
+        cmd2.cached_choices(-1)
@@ -93,16 +93,18 @@ def test_command_starts_with_shortcut():
     assert "Invalid command name 'help'" in str(excinfo.value)
 
 def test_base_show(base_app):
-    # force editor to be 'vim' so test is repeatable across platforms
+    # force editor to be 'vim' and profile_dir to be 'profiles' so test is repeatable across platforms
     base_app.editor = 'vim'
+    base_app.profile_dir = 'profiles'
     out, err = run_cmd(base_app, 'set')
     expected = normalize(SHOW_TXT)
     assert out == expected
 
 
 def test_base_show_long(base_app):
-    # force editor to be 'vim' so test is repeatable across platforms
+    # force editor to be 'vim' and profile_dir to be 'profiles' so test is repeatable across platforms
     base_app.editor = 'vim'
+    base_app.profile_dir = 'profiles'
     out, err = run_cmd(base_app, 'set -v')
     expected = normalize(SHOW_LONG)
     assert out == expected
@@ -1969,7 +1971,8 @@ def test_get_all_commands(base_app):
     # Verify that the base app has the expected commands
     commands = base_app.get_all_commands()
     expected_commands = ['_relative_run_script', 'alias', 'edit', 'eof', 'help', 'history', 'macro',
-                         'py', 'quit', 'run_pyscript', 'run_script', 'set', 'shell', 'shortcuts']
+                         'memstats', 'profile', 'py', 'quit', 'run_pyscript', 'run_script', 'sample', 'set',
+                         'shell', 'shortcuts', 'stats']
     assert commands == expected_commands
 
 def test_get_help_topics(base_app):
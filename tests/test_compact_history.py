@@ -0,0 +1,186 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/compact_history.py module
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+import cmd2
+from cmd2.compact_history import CompactHistory
+from cmd2.history import History, HistoryItem
+from cmd2.parsing import StatementParser
+from .conftest import run_cmd
+
+COMMANDS = ['help', 'alias create one !echo one', 'shortcuts', 'orate this is\na multiline\ncommand;',
+            'say "quoted  text" > out.txt', 'help alias | grep create', 'Straße', '!ls -l', 'help -v']
+
+
+def build_histories():
+    parser = StatementParser(multiline_commands=['orate'])
+    history = History()
+    compact_history = CompactHistory(parser=parser)
+    for i, command in enumerate(COMMANDS):
+        if i == 4:
+            history.start_session()
+            compact_history.start_session()
+        history.append(parser.parse(command))
+        compact_history.append(parser.parse(command))
+    return history, compact_history
+
+def test_items_match_history():
+    history, compact_history = build_histories()
+    assert len(compact_history) == len(history)
+    assert compact_history == history
+    assert list(reversed(compact_history)) == list(reversed(history))
+    assert compact_history[-1] == history[-1]
+    assert compact_history[2:7:2] == history[2:7:2]
+    assert history[3] in compact_history
+
+    # The statements are rebuilt from the stored text
+    assert compact_history[7].statement.command == 'shell'
+    assert compact_history[7].raw == '!ls -l'
+    assert compact_history[3].statement.multiline_command == 'orate'
+    assert compact_history[4].statement.output_to == 'out.txt'
+
+    with pytest.raises(IndexError):
+        compact_history[len(COMMANDS)]
+
+def test_list_methods_match_history():
+    history, compact_history = build_histories()
+    item = history[2]
+    assert compact_history.count(item) == history.count(item) == 1
+    assert compact_history.index(item) == history.index(item) == 2
+    assert compact_history.copy() == history.copy()
+    assert len(compact_history + []) == len(history)
+    assert [item] + compact_history == [item] + history
+
+    assert compact_history.pop() == history.pop()
+    assert compact_history.pop(0) == history.pop(0)
+    compact_history.insert(1, item)
+    history.insert(1, item)
+    compact_history.remove(item)
+    history.remove(item)
+    compact_history.reverse()
+    history.reverse()
+    assert compact_history == history
+    compact_history += [item]
+    history += [item]
+    assert compact_history == history
+    assert isinstance(compact_history, CompactHistory)
+
+@pytest.mark.parametrize('span', ['1', '-2', '2..4', '3:', ':3', '-3:', '*', ''])
+@pytest.mark.parametrize('include_persisted', [True, False])
+def test_span_matches_history(span, include_persisted):
+    history, compact_history = build_histories()
+    assert compact_history.span(span, include_persisted) == history.span(span, include_persisted)
+
+def test_search_matches_history():
+    history, compact_history = build_histories()
+    assert compact_history.get(4) == history.get(4)
+    assert compact_history.str_search('help', True) == history.str_search('help', True)
+    assert compact_history.regex_search('/^help/') == history.regex_search('/^help/')
+
+def test_record_outcome():
+    parser = StatementParser()
+    history = CompactHistory()
+    history.append(parser.parse('help'))
+    running = history.append_running(parser.parse('shortcuts'))
+    assert history[-1].start_time == running.start_time
+    history.record_outcome(running, duration=1.5, error=True)
+
+    finished = history[-1]
+    assert finished.raw == 'shortcuts'
+    assert finished.duration == 1.5
+    assert finished.error and not finished.stop
+    assert history.time_span() == [finished]
+    assert history.time_span(since=finished.start_time + 1) == []
+
+def test_truncate_and_clear():
+    history, compact_history = build_histories()
+    for max_length in (7, 3):
+        history.truncate(max_length)
+        compact_history.truncate(max_length)
+        assert compact_history == history
+
+    # Items added after the text of removed items is released are stored correctly
+    parser = StatementParser()
+    history.append(parser.parse('help history'))
+    compact_history.append(parser.parse('help history'))
+    assert compact_history[-1].raw == 'help history'
+    assert compact_history == history
+
+    compact_history.clear()
+    assert len(compact_history) == 0
+    compact_history.append(parser.parse('help'))
+    assert compact_history.get(1).raw == 'help'
+
+def test_assignment():
+    history, compact_history = build_histories()
+    item = HistoryItem(StatementParser().parse('shortcuts'), 3)
+    history[2] = item
+    compact_history[2] = item
+    del history[4]
+    del compact_history[4]
+    history[0:0] = [item]
+    compact_history[0:0] = [item]
+    assert compact_history == history
+
+def test_smaller_than_items():
+    parser = StatementParser()
+    history = History()
+    compact_history = CompactHistory()
+    for i in range(1000):
+        statement = parser.parse('alias create a{} help {}'.format(i, i))
+        history.append(statement)
+        compact_history.append(statement)
+
+    # Compare the memory used by the objects of one item against the columns
+    item = history[0]
+    item_size = sum(sys.getsizeof(obj) for obj in (item, item.statement, item.statement.args, item.statement.raw))
+    compact_size = sum(sys.getsizeof(column) for column in (compact_history._text, compact_history._offsets,
+                                                            compact_history._indexes, compact_history._start_times,
+                                                            compact_history._durations, compact_history._flags))
+    assert compact_size < item_size * len(history) / 4
+
+def test_cmd_compact_history(mocker):
+    # Mock out atexit.register so the history isn't persisted after its directory is deleted
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file, compact_history=True)
+        assert isinstance(app.history, CompactHistory)
+        run_cmd(app, 'help')
+        run_cmd(app, 'alias create s shortcuts')
+        run_cmd(app, 's')
+        out, err = run_cmd(app, 'history -x')
+        assert out == ['    1  help', '    2  alias create s shortcuts', '    3  shortcuts']
+
+        app = cmd2.Cmd(persistent_history_file=hist_file, compact_history=True)
+        assert isinstance(app.history, CompactHistory)
+        assert [item.raw for item in app.history] == ['help', 'alias create s shortcuts', 's']
+        assert app.history.get(3).statement.command == 'shortcuts'
+
+        # Don't leave the loaded items in readline history for other tests
+        from cmd2.rl_utils import readline
+        readline.clear_history()
+
+def test_max_length():
+    parser = StatementParser()
+    history = History(max_length=5)
+    compact_history = CompactHistory(max_length=5)
+    for i in range(1, 101):
+        history.append(parser.parse('help {}'.format(i)))
+        compact_history.append(parser.parse('help {}'.format(i)))
+
+        # Evicted columns are released in batches
+        assert len(compact_history._indexes) <= 10
+
+    assert compact_history == history
+    assert compact_history.get(96).raw == 'help 96'
+    assert compact_history.span('-2:') == history.span('-2:')
+    assert compact_history.time_span() == history.time_span() == []
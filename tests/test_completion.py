@@ -16,11 +16,13 @@ import argparse
 import enum
 import os
 import sys
+import threading
 
 import pytest
 
 import cmd2
 from cmd2 import utils
+from cmd2.utils import CompletionError
 from examples.subcommands import SubcommandsExample
 from .conftest import complete_tester, normalize, run_cmd
 
@@ -63,6 +65,7 @@ class CompletionsExample(cmd2.Cmd):
     def __init__(self):
         cmd2.Cmd.__init__(self, multiline_commands=['test_multiline'])
         self.foo = 'bar'
+        self.slow_event = threading.Event()
         self.add_settable(utils.Settable('foo', str, description="a settable param",
                                          completer_method=CompletionsExample.complete_foo_val))
 
@@ -91,6 +94,17 @@ class CompletionsExample(cmd2.Cmd):
     def complete_test_raise_exception(self, text, line, begidx, endidx):
         raise IndexError("You are out of bounds!!")
 
+    def do_test_slow(self, args):
+        pass
+
+    def complete_test_slow(self, text, line, begidx, endidx):
+        # Wait until the test lets the completer finish. Text starting with 'H' is completed right away.
+        if not text.startswith('H'):
+            self.slow_event.wait(5)
+        if text == 'error':
+            raise CompletionError('slow completer broke')
+        return utils.basic_complete(text, line, begidx, endidx, food_item_strs)
+
     def do_test_multiline(self, args):
         pass
 
@@ -171,6 +185,87 @@ def test_complete_exception(cmd2_app, capsys):
     assert first_match is None
     assert "IndexError" in err
 
+def test_complete_timeout(cmd2_app, capsys):
+    cmd2_app.completion_timeout = 0.05
+    text = 'Pi'
+    line = 'test_slow {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+
+    # The completer is still running when the timeout passes
+    first_match = complete_tester(text, line, begidx, endidx, cmd2_app)
+    out, err = capsys.readouterr()
+    assert first_match is None
+    assert cmd2_app.completion_loading_hint in out
+
+    # Once it finishes, its results are used the next time tab is pressed
+    cmd2_app.slow_event.set()
+    cmd2_app._pending_completion[1].result(5)
+    first_match = complete_tester(text, line, begidx, endidx, cmd2_app)
+    assert first_match is not None and cmd2_app.completion_matches == ['Pizza ']
+    assert cmd2_app._pending_completion is None
+
+    # Completions which finish in time are used right away
+    first_match = complete_tester('Po', 'test_slow Po', 10, 12, cmd2_app)
+    assert first_match is not None and cmd2_app.completion_matches == ['Potato ']
+
+def test_complete_timeout_error(cmd2_app, capsys):
+    cmd2_app.completion_timeout = 0.05
+    text = 'error'
+    line = 'test_slow {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+
+    assert complete_tester(text, line, begidx, endidx, cmd2_app) is None
+    cmd2_app.slow_event.set()
+    cmd2_app._pending_completion[1].exception(5)
+
+    # The error is reported when tab is pressed again
+    assert complete_tester(text, line, begidx, endidx, cmd2_app) is None
+    out, err = capsys.readouterr()
+    assert 'slow completer broke' in out
+
+def test_complete_timeout_new_text(cmd2_app, capsys):
+    cmd2_app.completion_timeout = 0.01
+    assert complete_tester('P', 'test_slow P', 10, 11, cmd2_app) is None
+    assert complete_tester('Pi', 'test_slow Pi', 10, 12, cmd2_app) is None
+    assert complete_tester('Po', 'test_slow Po', 10, 12, cmd2_app) is None
+
+    cmd2_app.slow_event.set()
+    cmd2_app._pending_completion[1].result(5)
+    assert complete_tester('Po', 'test_slow Po', 10, 12, cmd2_app) == 'Potato '
+
+def test_complete_timeout_stale_completions(cmd2_app, capsys):
+    cmd2_app.completion_timeout = 0.05
+    stale = []
+    for text in ['P', 'Pi', 'Piz', 'Pizz']:
+        assert complete_tester(text, 'test_slow ' + text, 10, 10 + len(text), cmd2_app) is None
+        stale.append(cmd2_app._pending_completion[1])
+
+    # Slow completions of text nobody is waiting for any more don't hold up new ones
+    first_match = complete_tester('Ha', 'test_slow Ha', 10, 12, cmd2_app)
+    assert first_match is not None and cmd2_app.completion_matches == ['"Ham', '"Ham Sandwich']
+    assert not any(future.done() for future in stale)
+
+    # Or change their matches when they finish
+    cmd2_app.slow_event.set()
+    assert stale[0].result(5)['completion_matches'] == ['Pizza', 'Potato']
+    for future in stale[1:]:
+        future.result(5)
+    assert cmd2_app.completion_matches == ['"Ham', '"Ham Sandwich']
+
+def test_completion_settings_are_instance_attributes():
+    class EarlyApp(cmd2.Cmd):
+        def __init__(self):
+            # Subclasses can set the completion settings before calling the initializer
+            self.allow_appended_space = False
+            super().__init__()
+
+    app = EarlyApp()
+    app.completion_header = 'Header'
+    assert vars(app)['completion_header'] == 'Header'
+    assert vars(app)['allow_appended_space'] is True
+
 def test_complete_macro(base_app, request):
     # Create the macro
     out, err = run_cmd(base_app, 'macro create fake run_pyscript {1}')
@@ -573,6 +668,60 @@ def test_delimiter_completion(cmd2_app):
 
     assert display_list == ['other user', 'user']
 
+def test_delimiter_completion_fuzzy(cmd2_app):
+    cmd2_app.completion_mode = 'fuzzy'
+    text = '/home/usr/fsp'
+    line = 'test_delimited {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+
+    # Only the portion after the last delimiter is matched fuzzily, against the same portion of the strings
+    assert cmd2_app.delimiter_complete(text, line, begidx, endidx, delimited_strs, '/') == []
+
+    text = '/home/ousr'
+    line = 'test_delimited {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+    first_match = complete_tester(text, line, begidx, endidx, cmd2_app)
+
+    # The common prefix of the matches still matches the text, so it is inserted
+    assert first_match is not None
+    assert os.path.commonprefix(cmd2_app.completion_matches) == '"/home/other user/'
+    assert cmd2_app.display_matches == ['maps', 'tests']
+
+def test_command_completion_fuzzy(cmd2_app):
+    cmd2_app.completion_mode = 'fuzzy'
+    text = 'tslw'
+    line = text
+    first_match = complete_tester(text, line, 0, len(line), cmd2_app)
+    assert first_match is not None and cmd2_app.completion_matches == ['test_slow ']
+
+    # Readline would replace the text with 'test_', which doesn't match it, so the text is kept
+    text = 'tstml'
+    line = text
+    first_match = complete_tester(text, line, 0, len(line), cmd2_app)
+    assert first_match == text
+    assert cmd2_app.completion_matches == [text, text + ' ']
+    assert cmd2_app.display_matches == ['test_multiline', 'test_no_completer']
+
+def test_basic_completion_substring(cmd2_app):
+    cmd2_app.completion_mode = 'substring'
+    text = 'all'
+    line = 'test_multiline {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+
+    # Completers which call basic_complete directly keep matching prefixes
+    assert complete_tester(text, line, begidx, endidx, cmd2_app) is None
+
+    text = 'ball'
+    line = 'list_sport -s {}'.format(text)
+    endidx = len(line)
+    begidx = endidx - len(text)
+    assert cmd2_app.flag_based_complete(text, line, begidx, endidx, flag_dict) == ['Football', 'Basketball',
+                                                                                 'Space Ball']
+    assert cmd2_app.matches_fuzzy and cmd2_app.matches_sorted
+
 def test_flag_based_completion_single(cmd2_app):
     text = 'Pi'
     line = 'list_food -f {}'.format(text)
@@ -3,6 +3,7 @@
 """
 Test history functions of cmd2
 """
+import json
 import tempfile
 import os
 
@@ -736,12 +737,631 @@ def test_persist_history_ensure_no_error_if_no_histfile(base_app, capsys):
     assert not out
     assert not err
 
-def test_persist_history_permission_error(hist_file, mocker, capsys):
+def test_persist_history_permission_error(hist_file, mocker):
     app = cmd2.Cmd(persistent_history_file=hist_file)
-    run_cmd(app, 'help')
     mock_open = mocker.patch('builtins.open')
     mock_open.side_effect = PermissionError
-    app._persist_history()
-    out, err = capsys.readouterr()
-    assert not out
-    assert 'Can not write' in err
+    out, err = run_cmd(app, 'help')
+    assert 'Documented commands' in out[0]
+    assert 'Can not write' in err[0]
+
+    # The command is still in history
+    assert app.history.get(-1).raw == 'help'
+
+def test_persist_history_compact_permission_error(mocker, capsys):
+    # Mock out atexit.register so the history file isn't compacted again after its directory is deleted
+    mocker.patch('atexit.register')
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=1)
+        run_cmd(app, 'help')
+        run_cmd(app, 'alias')
+        mock_open = mocker.patch('builtins.open')
+        mock_open.side_effect = PermissionError
+        app._persist_history()
+        out, err = capsys.readouterr()
+        assert not out
+        assert 'Can not write' in err
+
+#
+# test the append-only history log
+#
+def read_log(path):
+    from cmd2.history import HistoryLog
+    with open(path) as fobj:
+        lines = fobj.read().splitlines()
+    assert lines[0] == HistoryLog.HEADER
+    return lines[1:]
+
+def test_history_log_written_immediately():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'help')
+        run_cmd(app, 'alias create s shortcuts')
+
+        # Commands are in the file before the application exits
+        assert len(read_log(hist_file)) == 2
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        assert [item.raw for item in app.history] == ['help', 'alias create s shortcuts']
+        assert app.history.get(2).statement.arg_list == ['create', 's', 'shortcuts']
+        app.history.persistent_log.close()
+
+def test_history_log_compaction():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=2)
+        for i in range(4):
+            run_cmd(app, 'help {}'.format(i))
+        assert len(read_log(hist_file)) == 4
+
+        # The file is compacted to persistent_history_length once it reaches twice that length
+        run_cmd(app, 'help 4')
+        assert len(read_log(hist_file)) == 2
+
+        # At exit the file is compacted if it is longer than persistent_history_length
+        run_cmd(app, 'help 5')
+        app._persist_history()
+        assert len(read_log(hist_file)) == 2
+
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=2)
+        assert [item.raw for item in app.history] == ['help 4', 'help 5']
+        app.history.persistent_log.close()
+
+def test_history_log_partial_line():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'help')
+        app.history.persistent_log.close()
+
+        # Simulate a crash while a command was being written
+        with open(hist_file, 'a') as fobj:
+            fobj.write('{"args": "partial')
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        assert [item.raw for item in app.history] == ['help']
+
+        # The file is rewritten instead of appending to the partial line
+        run_cmd(app, 'alias')
+        assert len(read_log(hist_file)) == 2
+        app.history.persistent_log.close()
+
+def test_history_log_fsync(mocker):
+    mock_fsync = mocker.patch('os.fsync')
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_fsync=True)
+        run_cmd(app, 'help')
+        run_cmd(app, 'alias')
+        app.history.persistent_log.close()
+    assert mock_fsync.call_count == 2
+
+def test_history_pickle_migration():
+    import pickle
+    from cmd2.history import History
+
+    parser = StatementParser()
+    history = History()
+    history.append(parser.parse('help'))
+    history.append(parser.parse('alias list'))
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        with open(hist_file, 'wb') as fobj:
+            pickle.dump(history, fobj)
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        assert [item.raw for item in app.history] == ['help', 'alias list']
+
+        # The file is converted the first time a command is added to it
+        run_cmd(app, 'shortcuts')
+        assert len(read_log(hist_file)) == 3
+        app.history.persistent_log.close()
+
+def test_history_log_clear_then_nested_commands():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        script = os.path.join(test_dir, 'script.txt')
+        with open(script, 'w') as fobj:
+            fobj.write('help\nshortcuts\n')
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'alias')
+        run_cmd(app, 'history -c')
+
+        # The file is created again when the script finishes and its commands are only written once
+        run_cmd(app, 'run_script {}'.format(script))
+        commands = [json.loads(line)['command'] for line in read_log(hist_file)]
+        assert commands == ['run_script', 'help', 'shortcuts']
+        app.history.persistent_log.close()
+
+def test_history_lazy_loading():
+    class LazyApp(cmd2.Cmd):
+        HISTORY_PRELOAD_LENGTH = 3
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        for i in range(1, 11):
+            run_cmd(app, 'help {}'.format(i))
+        app.history.persistent_log.close()
+
+        from cmd2.rl_utils import readline
+        readline.clear_history()
+        app = LazyApp(persistent_history_file=hist_file)
+
+        # Only the most recent items are in the list and in readline history before the older ones are needed
+        assert [item.raw for item in app.history] == ['help 8', 'help 9', 'help 10']
+        assert app.history[0].idx == 8
+        assert readline.get_current_history_length() == 3
+
+        # Items from this session don't need the older ones
+        assert app.history.get(-1).raw == 'help 10'
+        assert app.history.span('-2:') == app.history[-2:]
+        assert app.history._older is not None
+
+        # New items are numbered after the older ones. The older items aren't inserted even once they are ready.
+        run_cmd(app, 'shortcuts')
+        out, err = run_cmd(app, 'history')
+        assert out == ['   11  shortcuts']
+        app.history._older.wait()
+        run_cmd(app, 'alias')
+        assert [item.raw for item in app.history][:2] == ['help 8', 'help 9']
+
+        # Reaching the older items loads them
+        out, err = run_cmd(app, 'history -a 2')
+        assert out == ['    2  help 2']
+        assert app.history._older is None
+        assert len(app.history) == 12
+        assert [item.idx for item in app.history] == list(range(1, 13))
+        app.history.persistent_log.close()
+
+def test_history_lazy_loading_search():
+    class LazyApp(cmd2.Cmd):
+        HISTORY_PRELOAD_LENGTH = 2
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        for command in ['alias list', 'help', 'shortcuts']:
+            run_cmd(app, command)
+        app.history.persistent_log.close()
+
+        app = LazyApp(persistent_history_file=hist_file)
+        assert app.history.str_search('alias') == []
+        assert app.history._older is not None
+        assert [item.idx for item in app.history.str_search('alias', include_persisted=True)] == [1]
+        app.history.persistent_log.close()
+
+def test_history_log_concurrent_sessions():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app1 = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        app2 = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        run_cmd(app1, 'help 1')
+        run_cmd(app2, 'help 2')
+        run_cmd(app1, 'help 3')
+        run_cmd(app2, 'help 4')
+
+        # Compaction keeps the most recent commands of both sessions
+        app1._persist_history()
+        assert [json.loads(line)['raw'] for line in read_log(hist_file)] == ['help 2', 'help 3', 'help 4']
+
+        # The other session keeps appending to the compacted file
+        run_cmd(app2, 'help 5')
+        app2._persist_history()
+        assert [json.loads(line)['raw'] for line in read_log(hist_file)] == ['help 3', 'help 4', 'help 5']
+
+def test_history_log_read_new():
+    from cmd2.history import HistoryLog
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'help')
+
+        other_log = HistoryLog(hist_file)
+        other_log.load()
+        other_log.share = True
+        assert other_log.read_new(1) == []
+
+        run_cmd(app, 'alias list')
+        run_cmd(app, 'shortcuts')
+        assert [statement.raw for statement in other_log.read_new(1)] == ['alias list', 'shortcuts']
+        assert other_log.read_new(1) == []
+
+        # A partial line isn't read until it is complete
+        with open(hist_file, 'a') as fobj:
+            fobj.write('{"args": "partial')
+        assert other_log.read_new(1) == []
+
+        app.history.persistent_log.close()
+        other_log.close()
+
+def read_compressed_log(path):
+    import bz2
+    import gzip
+    import lzma
+    from cmd2.history import HistoryLog
+    module = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}[os.path.splitext(path)[1]]
+    with module.open(path, 'rt') as fobj:
+        lines = fobj.read().splitlines()
+    assert lines[0] == HistoryLog.HEADER
+    return lines[1:]
+
+@pytest.mark.parametrize('ext', ['.gz', '.bz2', '.xz'])
+def test_history_log_compressed(ext, mocker):
+    # Mock out atexit.register so the history isn't persisted after its directory is deleted
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history' + ext)
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=2)
+        for i in range(4):
+            run_cmd(app, 'help {}'.format(i))
+
+        # Each command is appended as its own member, which the standard library reads as one file
+        assert [json.loads(line)['raw'] for line in read_compressed_log(hist_file)] == \
+            ['help 0', 'help 1', 'help 2', 'help 3']
+
+        # Compaction rewrites the file
+        run_cmd(app, 'help 4')
+        assert len(read_compressed_log(hist_file)) == 2
+
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=2)
+        assert [item.raw for item in app.history] == ['help 3', 'help 4']
+        run_cmd(app, 'alias list')
+        assert len(read_compressed_log(hist_file)) == 3
+        app.history.persistent_log.close()
+
+@pytest.mark.parametrize('ext', ['.gz', '.bz2', '.xz'])
+def test_history_log_compressed_partial_member(ext, mocker):
+    from cmd2.history import HistoryLog
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history' + ext)
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'help')
+
+        other_log = HistoryLog(hist_file)
+        other_log.load()
+        other_log.share = True
+        run_cmd(app, 'alias list')
+        app.history.persistent_log.close()
+
+        # Simulate a crash while a command was being written
+        member = other_log._codec.compress(b'{"args": "", "raw": "shortcuts"}\n')
+        with open(hist_file, 'ab') as fobj:
+            fobj.write(member[:len(member) // 2])
+
+        # An incomplete member isn't read until it is complete
+        assert [statement.raw for statement in other_log.read_new(1)] == ['alias list']
+        other_log.close()
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        assert [item.raw for item in app.history] == ['help', 'alias list']
+
+        # The file is rewritten instead of appending to the incomplete member
+        assert app.history.persistent_log.needs_rewrite
+        run_cmd(app, 'help alias')
+        assert [json.loads(line)['raw'] for line in read_compressed_log(hist_file)][-1] == 'help alias'
+        app.history.persistent_log.close()
+
+def test_history_log_streams_lines(mocker):
+    from cmd2.history import HistoryLog, _LineReader
+    mocker.patch.object(_LineReader, 'CHUNK_SIZE', 16)
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        for name in ('history', 'history.gz'):
+            hist_file = os.path.join(test_dir, name)
+            app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+            for i in range(5):
+                run_cmd(app, 'help {}'.format(i))
+            app.history.persistent_log.close()
+
+            # Lines and compressed members which span several chunks are read correctly
+            log = HistoryLog(hist_file, max_length=3)
+            assert [item.raw for item in log.load()] == ['help 2', 'help 3', 'help 4']
+            assert log.record_count == 5
+            assert not log.needs_rewrite
+
+def test_share_history_setting():
+    base_app = cmd2.Cmd()
+    out, err = run_cmd(base_app, 'set share_history True')
+    assert 'requires a persistent history file' in err[0]
+    assert not base_app.share_history
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        app1 = cmd2.Cmd(persistent_history_file=hist_file)
+        app2 = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app1, 'set share_history True')
+        assert app1.share_history
+
+        run_cmd(app1, 'help')
+        run_cmd(app2, 'alias list')
+        run_cmd(app1, 'shortcuts')
+
+        # Commands of the other session are added after the ones run before they were read
+        app1._merge_shared_history()
+        out, err = run_cmd(app1, 'history')
+        assert out == ['    1  set share_history True', '    2  help', '    3  shortcuts', '    4  alias list']
+
+        # Commands this session ran aren't added again
+        app1._merge_shared_history()
+        assert len(app1.history) == 4
+
+        # The other session doesn't share
+        app2._merge_shared_history()
+        assert [item.raw for item in app2.history] == ['alias list']
+
+        app1.history.persistent_log.close()
+        app2.history.persistent_log.close()
+
+#
+# test timing and outcome of history items
+#
+def test_history_item_outcome(base_app):
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'alias create')
+    assert base_app.history[0].start_time > 0
+    assert base_app.history[0].duration >= 0
+    assert not base_app.history[0].error
+    assert base_app.history[1].error
+
+    run_cmd(base_app, 'quit')
+    assert base_app.history[2].stop
+
+def test_history_item_dict():
+    from cmd2.history import HistoryItem
+    statement = StatementParser().parse('help history')
+    untimed = HistoryItem(statement, 1)
+    assert 'outcome' not in untimed.to_dict()
+    assert HistoryItem.from_dict(untimed.to_dict(), 1) == untimed
+
+    timed = HistoryItem(statement, 2, 1600000000.5, 0.25, False, True)
+    assert HistoryItem.from_dict(json.loads(json.dumps(timed.to_dict())), 2) == timed
+
+def test_history_outcome_persisted():
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        script = os.path.join(test_dir, 'script.txt')
+        with open(script, 'w') as fobj:
+            fobj.write('help\nshortcuts\n')
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        run_cmd(app, 'run_script {}'.format(script))
+        run_cmd(app, 'alias create')
+
+        # A command which runs others is written before them once it finishes
+        assert [json.loads(line)['raw'] for line in read_log(hist_file)] == \
+            ['run_script {}'.format(script), 'help', 'shortcuts', 'alias create']
+
+        app = cmd2.Cmd(persistent_history_file=hist_file)
+        assert [item.idx for item in app.history] == [1, 2, 3, 4]
+        assert all(item.start_time > 0 for item in app.history)
+        assert app.history[0].duration >= app.history[1].duration
+        assert [item.error for item in app.history] == [False, False, False, True]
+        app.history.persistent_log.close()
+
+def test_history_time_span():
+    from cmd2.history import History, HistoryItem
+    parser = StatementParser()
+    history = History([HistoryItem(parser.parse('untimed'), 1),
+                       HistoryItem(parser.parse('second'), 2, 200.0),
+                       HistoryItem(parser.parse('first'), 3, 100.0),
+                       HistoryItem(parser.parse('third'), 4, 300.0)])
+    assert [item.raw for item in history.time_span()] == ['second', 'first', 'third']
+    assert [item.raw for item in history.time_span(150.0)] == ['second', 'third']
+    assert [item.raw for item in history.time_span(until=200.0)] == ['second', 'first']
+    assert [item.raw for item in history.time_span(150.0, 250.0)] == ['second']
+
+    # The index is kept up to date as items are added
+    history.start_session()
+    history.append_running(parser.parse('fourth'))
+    assert [item.raw for item in history.time_span(250.0)] == ['fourth']
+    assert [item.raw for item in history.time_span(250.0, include_persisted=True)] == ['third', 'fourth']
+
+    history.clear()
+    assert history.time_span() == []
+
+def test_parse_history_time():
+    import datetime
+    from cmd2.history import parse_history_time
+
+    assert parse_history_time('90s', now=1000.0) == 910.0
+    assert parse_history_time('2h', now=10000.0) == 10000.0 - 7200
+    assert parse_history_time('1w', now=1000000.0) == 1000000.0 - 7 * 24 * 3600
+    assert parse_history_time('2020-03-04 05:06') == \
+        datetime.datetime(2020, 3, 4, 5, 6).timestamp()
+    assert parse_history_time('2020-03-04T05:06:07') == \
+        datetime.datetime(2020, 3, 4, 5, 6, 7).timestamp()
+    with pytest.raises(ValueError):
+        parse_history_time('yesterday')
+
+def test_history_since_until(base_app):
+    import time
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'shortcuts')
+    run_cmd(base_app, 'help history')
+
+    out, err = run_cmd(base_app, 'history --since 1h help')
+    assert out == ['    1  help', '    3  help history']
+
+    out, err = run_cmd(base_app, 'history --until {}'.format(time.strftime('%Y-%m-%d', time.localtime(86400 * 365))))
+    assert out == []
+
+    out, err = run_cmd(base_app, 'history --since soon')
+    assert "invalid time 'soon'" in err[0]
+
+def test_history_stats(base_app):
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'shortcuts')
+    run_cmd(base_app, 'help history')
+    run_cmd(base_app, 'alias create')
+
+    out, err = run_cmd(base_app, 'history --stats')
+    assert out[0].split() == ['Command', 'Count', 'Errors', 'Total', '(ms)', 'Mean', '(ms)', 'Max', '(ms)']
+    assert [line.split()[:3] for line in out[1:4]] == [['help', '2', '0'], ['alias', '1', '1'], ['shortcuts', '1', '0']]
+    assert out[5] == 'Slowest commands:'
+    assert len(out) == 11
+
+    out, err = run_cmd(base_app, 'history --stats nothing')
+    assert out == ['No commands were selected']
+
+@pytest.mark.parametrize('history_class', ['History', 'BoundedHistory'])
+def test_history_max_length_evicts(history_class):
+    import cmd2.history
+    parser = StatementParser()
+    history = getattr(cmd2.history, history_class)(max_length=3)
+    for i in range(1, 6):
+        history.append(parser.parse('help {}'.format(i)))
+
+    # The oldest items are evicted as new ones are added, but indexes don't change
+    assert len(history) == 3
+    assert [item.idx for item in history] == [3, 4, 5]
+    assert history.get(3).raw == 'help 3'
+    assert history.get(-1).raw == 'help 5'
+    with pytest.raises(IndexError):
+        history.get(2)
+    assert [item.idx for item in history.span('2..4')] == [3, 4]
+    assert [item.idx for item in history.span('-2:')] == [4, 5]
+    assert [item.idx for item in history.str_search('help')] == [3, 4, 5]
+
+def test_bounded_history_list_methods():
+    from cmd2.history import BoundedHistory, History
+    parser = StatementParser()
+    history = History()
+    bounded_history = BoundedHistory()
+    for i in range(10):
+        history.append(parser.parse('help {}'.format(i)))
+        bounded_history.append(parser.parse('help {}'.format(i)))
+
+    assert bounded_history == history
+    assert list(reversed(bounded_history)) == list(reversed(history))
+    for key in [slice(None), slice(2, 5), slice(7, None), slice(-3, -1), slice(1, 9, 3), slice(None, None, -2)]:
+        assert bounded_history[key] == history[key]
+
+    item = history[4]
+    del history[2]
+    del bounded_history[2]
+    history[0:0] = [item]
+    bounded_history[0:0] = [item]
+    assert bounded_history == history
+    assert item in bounded_history
+
+    bounded_history.clear()
+    assert len(bounded_history) == 0
+    bounded_history.append(parser.parse('help'))
+    assert bounded_history.get(1).raw == 'help'
+
+def test_bounded_history_other_list_methods():
+    from cmd2.history import BoundedHistory, History
+    parser = StatementParser()
+    history = History()
+    bounded_history = BoundedHistory()
+    for i in range(3):
+        history.append(parser.parse('help {}'.format(i)))
+        bounded_history.append(parser.parse('help {}'.format(i)))
+
+    # None of the list methods use the list's own storage, which is empty
+    item = history[1]
+    assert bounded_history.count(item) == 1
+    assert bounded_history.index(item) == 1
+    assert bounded_history.copy() == history.copy()
+    assert bounded_history + [item] == history + [item]
+    assert [item] + bounded_history == [item] + history
+    assert bounded_history * 2 == history * 2
+    assert bounded_history <= history and not bounded_history < history
+
+    assert bounded_history.pop() == history.pop()
+    bounded_history.insert(0, item)
+    history.insert(0, item)
+    bounded_history.remove(item)
+    history.remove(item)
+    bounded_history.reverse()
+    history.reverse()
+    assert bounded_history == history
+    bounded_history.sort(key=lambda cur_item: cur_item.idx)
+    history.sort(key=lambda cur_item: cur_item.idx)
+    bounded_history += [item]
+    history += [item]
+    assert bounded_history == history
+    assert isinstance(bounded_history, BoundedHistory)
+
+def test_bounded_history_outcome_and_time_span():
+    from cmd2.history import BoundedHistory
+    parser = StatementParser()
+    history = BoundedHistory(max_length=2)
+    running = history.append_running(parser.parse('run_script script.txt'))
+    history.append_running(parser.parse('help'))
+    assert history.time_span() == history[:]
+
+    # The running item is evicted before its command finishes
+    history.append(parser.parse('alias list'))
+    history.record_outcome(running, duration=1.0)
+    assert [item.raw for item in history] == ['help', 'alias list']
+    assert [item.raw for item in history.time_span()] == ['help']
+
+def test_bounded_history_app(mocker):
+    mocker.patch('atexit.register')
+    from cmd2.history import BoundedHistory
+    from cmd2.rl_utils import readline
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history')
+        readline.clear_history()
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3, bounded_history=True)
+        assert isinstance(app.history, BoundedHistory)
+        for i in range(1, 6):
+            run_cmd(app, 'help {}'.format(i))
+            readline.add_history('help {}'.format(i))
+
+        out, err = run_cmd(app, 'history')
+        assert out == ['    3  help 3', '    4  help 4', '    5  help 5']
+
+        # readline history is trimmed to the same length
+        app._evict_readline_history()
+        assert readline.get_current_history_length() == 3
+        assert readline.get_history_item(1) == 'help 3'
+        readline.clear_history()
+        app.history.persistent_log.close()
+
+def test_history_item_search_key():
+    from cmd2.history import HistoryItem
+    parser = StatementParser()
+    item = HistoryItem(parser.parse('!LS -l'), 1)
+    assert item.search_key == '!ls -l\0shell ls -l'
+    assert item.search_key is item.search_key
+
+    item = HistoryItem(parser.parse('Straße'), 1)
+    assert item.search_key == 'strasse'
+
+def test_history_fuzzy_search():
+    from cmd2.history import History
+    parser = StatementParser()
+    history = History()
+    for command in ['history --stats', 'help history', 'alias create hs history -s', 'shortcuts', '!Hst']:
+        history.append(parser.parse(command))
+
+    assert [item.raw for item in history.fuzzy_search('hst stat')] == ['history --stats']
+    assert [item.raw for item in history.fuzzy_search('HST')] == ['history --stats', 'help history',
+                                                                   'alias create hs history -s', '!Hst']
+    assert [item.raw for item in history.fuzzy_search('shrt')] == ['shortcuts']
+
+    # A word isn't matched across the raw and expanded commands
+    assert history.fuzzy_search('hstshell') == []
+    assert history.fuzzy_search('') == history[:]
+
+def test_history_fuzzy_option(base_app):
+    run_cmd(base_app, 'help history')
+    run_cmd(base_app, 'shortcuts')
+    run_cmd(base_app, 'alias list')
+    out, err = run_cmd(base_app, 'history --fuzzy hhst')
+    assert out == ['    1  help history']
+    out, err = run_cmd(base_app, 'history --fuzzy "sh s"')
+    assert out == ['    2  shortcuts']
@@ -0,0 +1,138 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/memory.py module and the memstats command.
+"""
+import tracemalloc
+
+import pytest
+
+from cmd2 import memory
+from .conftest import run_cmd
+
+
+@pytest.fixture
+def tracker():
+    tracker = memory.MemoryTracker()
+    yield tracker
+    tracker.stop()
+
+leaked = []
+
+def leak(size):
+    leaked.append(bytearray(size))
+
+def test_tracker_start_stop(tracker):
+    assert not tracker.tracking
+    tracker.start()
+    assert tracker.tracking
+    assert tracemalloc.is_tracing()
+    tracker.stop()
+    assert not tracker.tracking
+    assert not tracemalloc.is_tracing()
+
+def test_tracker_leaves_existing_tracing(tracker):
+    tracemalloc.start()
+    try:
+        tracker.start()
+        assert tracker.tracking
+        tracker.stop()
+        assert not tracker.tracking
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_measure_retained(tracker):
+    with tracker.measure('leaky'):
+        leak(1000000)
+    with tracker.measure('leaky'):
+        leak(1000000)
+
+    leaky = tracker.get('leaky')
+    assert leaky.calls == 2
+    assert leaky.retained_bytes >= 2000000
+    assert leaky.peak_bytes >= 1000000
+    assert leaky.gc_objects >= 0
+
+    site, size = leaky.top_sites(1)[0]
+    assert site.endswith('test_memory.py:{}'.format(leak.__code__.co_firstlineno + 1))
+    assert size >= 2000000
+
+    del leaked[:]
+
+def test_measure_peak(tracker):
+    with tracker.measure('temporary'):
+        data = bytearray(2000000)
+        del data
+
+    temporary = tracker.get('temporary')
+    assert temporary.retained_bytes < 100000
+    if memory._reset_peak is not None:
+        assert temporary.peak_bytes >= 2000000
+
+@pytest.mark.skipif(memory._reset_peak is None, reason="requires tracemalloc.reset_peak()")
+def test_measure_nested_peak(tracker):
+    with tracker.measure('outer'):
+        data = bytearray(2000000)
+        del data
+        with tracker.measure('inner'):
+            pass
+
+    assert tracker.get('outer').peak_bytes >= 2000000
+    assert tracker.get('inner').peak_bytes < 2000000
+
+def test_sites_are_bounded(tracker):
+    tracker.top_sites = 1
+    memory_obj = memory.CommandMemory('cmd')
+    tracker._commands['cmd'] = memory_obj
+    for i in range(10):
+        tracker._record('cmd', 0, 0, 0, [('file.py:{}'.format(i), i)])
+    assert len(memory_obj.sites) <= 4
+    assert memory_obj.top_sites(1) == [('file.py:9', 9)]
+
+def test_tracker_reset(tracker):
+    with tracker.measure('cmd'):
+        pass
+    assert tracker.commands() == ['cmd']
+    assert tracker.snapshot()['cmd']['calls'] == 1
+    tracker.reset()
+    assert tracker.get('cmd') is None
+
+def test_track_memory_setting(base_app):
+    base_app.do_leak = lambda _: leak(500000)
+    try:
+        run_cmd(base_app, 'set track_memory True')
+        assert base_app.track_memory
+        run_cmd(base_app, 'leak')
+    finally:
+        run_cmd(base_app, 'set track_memory False')
+        del leaked[:]
+
+    assert not base_app.track_memory
+    assert base_app.memory_tracker.get('leak').retained_bytes >= 500000
+
+def test_memstats_command(base_app):
+    out, err = run_cmd(base_app, 'memstats')
+    assert 'Memory tracking is disabled' in out[0]
+
+    base_app.do_leak = lambda _: leak(500000)
+    base_app.track_memory = True
+    try:
+        out, err = run_cmd(base_app, 'memstats')
+        assert out == ['No memory usage has been recorded']
+
+        run_cmd(base_app, 'leak')
+        run_cmd(base_app, 'help')
+        out, err = run_cmd(base_app, 'memstats')
+        assert out[0].startswith('Command')
+        assert out[1].startswith('leak')
+
+        out, err = run_cmd(base_app, 'memstats -v leak')
+        assert out[1].startswith('leak')
+        assert 'test_memory.py' in out[2]
+
+        run_cmd(base_app, 'memstats --reset')
+        assert base_app.memory_tracker.commands() == ['memstats']
+    finally:
+        base_app.track_memory = False
+        del leaked[:]
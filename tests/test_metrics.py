@@ -0,0 +1,177 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/metrics.py module and the stats command.
+"""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from cmd2 import metrics
+from .conftest import run_cmd
+
+
+def test_histogram_empty():
+    hist = metrics.LatencyHistogram()
+    assert hist.count == 0
+    assert hist.percentile(50) == 0
+    assert hist.mean_ns == 0
+
+def test_histogram_small_values_are_exact():
+    hist = metrics.LatencyHistogram()
+    for value in range(1, 11):
+        hist.record(value)
+    assert hist.min_ns == 1
+    assert hist.max_ns == 10
+    assert hist.percentile(50) == 5
+    assert hist.percentile(100) == 10
+
+def test_histogram_percentiles_accuracy():
+    hist = metrics.LatencyHistogram()
+    for value in range(1, 100001):
+        hist.record(value * 1000)
+
+    for pct in metrics.PERCENTILES:
+        expected = pct * 1000 * 1000
+        assert abs(hist.percentile(pct) - expected) / expected < 1 / metrics.LatencyHistogram.SUB_BUCKETS
+
+    assert hist.percentile(100) == hist.max_ns == 100000 * 1000
+
+def test_histogram_to_dict():
+    hist = metrics.LatencyHistogram()
+    hist.record(2000)
+    summary = hist.to_dict()
+    assert summary['count'] == 1
+    assert summary['p50_ns'] == summary['p99_ns'] == 2000
+
+def test_command_timer_laps():
+    timer = metrics.CommandTimer()
+    time.sleep(0.01)
+    timer.lap(metrics.PHASE_COMMAND)
+    timer.lap(metrics.PHASE_HOOKS)
+    assert timer.phase_ns[metrics.PHASE_COMMAND] >= 10000000
+    assert timer.elapsed_ns == sum(timer.phase_ns.values())
+
+def test_registry_record_and_reset():
+    registry = metrics.MetricsRegistry()
+    timer = metrics.CommandTimer()
+    timer.lap(metrics.PHASE_COMMAND)
+    registry.record('cmd', timer)
+    registry.record('cmd', timer, error=True)
+
+    cmd_metrics = registry.get('cmd')
+    assert cmd_metrics.calls == 2
+    assert cmd_metrics.errors == 1
+    assert cmd_metrics.latency.count == 2
+    assert registry.commands() == ['cmd']
+    assert registry.snapshot()['cmd']['calls'] == 2
+
+    registry.reset()
+    assert registry.get('cmd') is None
+
+def test_registry_periodic_dump():
+    registry = metrics.MetricsRegistry()
+    registry.record('cmd', metrics.CommandTimer())
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'metrics.json')
+        registry.start_periodic_dump(path, 0.01)
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.01)
+        registry.stop_periodic_dump()
+
+        with open(path) as fobj:
+            data = json.load(fobj)
+        assert data['commands']['cmd']['calls'] == 1
+
+    with pytest.raises(ValueError):
+        registry.start_periodic_dump(path, 0)
+
+def test_commands_are_recorded(base_app):
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'shortcuts')
+
+    help_metrics = base_app.metrics.get('help')
+    assert help_metrics.calls == 2
+    assert help_metrics.errors == 0
+    assert help_metrics.phase_ns[metrics.PHASE_COMMAND] > 0
+    assert base_app.metrics.get('shortcuts').calls == 1
+
+def test_command_errors_are_recorded(base_app):
+    run_cmd(base_app, 'help --fake')
+    assert base_app.metrics.get('help').errors == 1
+
+def test_empty_statement_not_recorded(base_app):
+    run_cmd(base_app, '')
+    assert base_app.metrics.commands() == []
+
+def test_stats_command(base_app):
+    out, err = run_cmd(base_app, 'stats')
+    assert out == ['No metrics have been recorded']
+
+    run_cmd(base_app, 'help')
+    out, err = run_cmd(base_app, 'stats')
+    assert out[0].startswith('Command')
+    assert out[1].startswith('help')
+    assert out[2].startswith('stats')
+    assert len(out) == 3
+
+    out, err = run_cmd(base_app, 'stats -v help')
+    assert len(out) == 3
+    assert 'command:' in out[2]
+
+def test_stats_output_file(base_app):
+    run_cmd(base_app, 'help')
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'metrics.json')
+        run_cmd(base_app, 'stats -o {}'.format(path))
+        with open(path) as fobj:
+            data = json.load(fobj)
+    assert data['commands']['help']['calls'] == 1
+
+def test_stats_reset(base_app):
+    run_cmd(base_app, 'help')
+    run_cmd(base_app, 'stats --reset')
+    assert base_app.metrics.commands() == ['stats']
+
+def test_metrics_file_setting(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'metrics.json')
+        run_cmd(base_app, 'set metrics_interval 30')
+        run_cmd(base_app, 'set metrics_file {}'.format(path))
+        assert base_app.metrics_file == path
+        assert base_app.metrics.dump_path == path
+        assert os.path.exists(path)
+
+        # Changing the interval keeps writing the same file
+        run_cmd(base_app, 'set metrics_interval 0.01')
+        assert base_app.metrics.dump_path == path
+
+        # Turning off the setting writes the metrics recorded since the last write
+        run_cmd(base_app, 'help')
+        run_cmd(base_app, "set metrics_file ''")
+        assert base_app.metrics_file == ''
+        assert base_app.metrics.dump_path is None
+        with open(path) as fobj:
+            data = json.load(fobj)
+    assert data['commands']['help']['calls'] == 1
+
+def test_metrics_file_setting_errors(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'metrics.json')
+        run_cmd(base_app, 'set metrics_file {}'.format(path))
+
+        out, err = run_cmd(base_app, 'set metrics_file /this/dir/does/not/exist/metrics.json')
+        assert 'Error setting metrics_file' in err[0]
+        assert base_app.metrics_file == path
+
+        out, err = run_cmd(base_app, 'set metrics_interval 0')
+        assert 'Error setting metrics_interval' in err[0]
+        assert base_app.metrics_interval == 60.0
+        run_cmd(base_app, "set metrics_file ''")
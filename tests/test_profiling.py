@@ -0,0 +1,167 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/profiling.py module and the profile command.
+"""
+import os
+import pstats
+import tempfile
+import time
+
+import pytest
+
+from cmd2 import profiling
+from .conftest import run_cmd
+
+
+def test_run_profiled():
+    result, profiler, elapsed = profiling.run_profiled(sorted, [3, 1, 2], reverse=True)
+    assert result == [3, 2, 1]
+    assert elapsed >= 0
+    assert 'sorted' in profiling.format_stats(profiler)
+
+def test_save_profile_rotates():
+    result, profiler, elapsed = profiling.run_profiled(sorted, [3, 1, 2])
+    with tempfile.TemporaryDirectory() as test_dir:
+        profile_dir = os.path.join(test_dir, 'profiles')
+        saved = [profiling.save_profile(profiler, profile_dir, 'my cmd', max_files=2) for _ in range(3)]
+        assert profiling.list_profile_files(profile_dir) == saved[1:]
+        assert os.path.basename(saved[0]).endswith('_my_cmd.prof')
+
+        # The saved file can be loaded by pstats
+        pstats.Stats(saved[-1])
+
+def test_list_profile_files_missing_dir():
+    assert profiling.list_profile_files('/this/dir/does/not/exist') == []
+
+def test_profile_command(base_app):
+    out, err = run_cmd(base_app, 'profile --sort tottime --limit 5 help')
+    assert 'Documented commands' in out[0]
+    assert any('function calls' in line for line in out)
+
+    # The profiled command is not added to history a second time
+    assert len(base_app.history) == 1
+
+def test_profile_command_output_file(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'help.prof')
+        out, err = run_cmd(base_app, 'profile -o {} help'.format(path))
+        assert 'Documented commands' in out[0]
+        pstats.Stats(path)
+
+def test_profile_command_redirect_profiled_command(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'out.txt')
+        out, err = run_cmd(base_app, 'profile help ">" {}'.format(path))
+        assert not any('Documented commands' in line for line in out)
+        with open(path) as fobj:
+            assert 'Documented commands' in fobj.read()
+
+def test_profile_setting(base_app):
+    base_app.do_slow = lambda _: time.sleep(0.05)
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        run_cmd(base_app, 'set profile_dir {}'.format(test_dir))
+        run_cmd(base_app, 'set profile_threshold 0.03')
+        run_cmd(base_app, 'set profile True')
+
+        run_cmd(base_app, 'help')
+        assert profiling.list_profile_files(test_dir) == []
+
+        out, err = run_cmd(base_app, 'slow')
+        saved = profiling.list_profile_files(test_dir)
+        assert len(saved) == 1
+        assert saved[0].endswith('_slow.prof')
+        assert 'Profile results saved to' in err[0]
+
+        # The profile command is never profiled automatically since profilers can't be nested
+        run_cmd(base_app, 'profile slow')
+        assert len(profiling.list_profile_files(test_dir)) == 1
+
+def test_profile_setting_save_error(base_app):
+    base_app.do_slow = lambda _: time.sleep(0.01)
+    base_app.profile = True
+    base_app.profile_threshold = 0
+
+    with tempfile.NamedTemporaryFile() as not_a_dir:
+        base_app.profile_dir = not_a_dir.name
+        out, err = run_cmd(base_app, 'slow')
+    assert 'Failed to save profile results' in err[0]
+
+def test_profile_command_not_nested(base_app):
+    base_app._profiling = True
+    out, err = run_cmd(base_app, 'profile help')
+    assert 'Cannot run profile' in err[0]
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_sampling_profiler():
+    with profiling.SamplingProfiler(interval=0.001) as sampler:
+        busy_wait(0.05)
+
+    assert sampler.sample_count > 0
+    assert sampler.elapsed >= 0.05
+    assert any('busy_wait (test_profiling.py:' in line for line in sampler.collapsed())
+
+    # Each line is a stack, outermost frame first, followed by a count
+    stack, count = sampler.collapsed()[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert stack.split(';')[0]
+
+    label, self_count, total_count = sampler.top_functions(1)[0]
+    assert 0 < self_count <= total_count <= sampler.sample_count
+
+def test_sampling_profiler_invalid_interval():
+    with pytest.raises(ValueError):
+        profiling.SamplingProfiler(interval=0)
+
+def test_save_samples():
+    with profiling.SamplingProfiler(interval=0.001) as sampler:
+        busy_wait(0.01)
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = profiling.save_samples(sampler, test_dir, 'busy')
+        assert profiling.list_profile_files(test_dir, profiling.COLLAPSED_FILE_EXT) == [path]
+        assert profiling.list_profile_files(test_dir) == []
+        with open(path) as fobj:
+            assert fobj.read().splitlines() == sampler.collapsed()
+
+def test_sample_command(base_app):
+    base_app.do_busy = lambda _: busy_wait(0.05)
+    out, err = run_cmd(base_app, 'sample -i 0.001 -l 5 busy')
+    assert out[0].endswith('seconds')
+    assert out[1].split() == ['Self', '%', 'Total', '%', 'Function']
+    assert len(out) <= 7
+
+def test_sample_command_output_file(base_app):
+    base_app.do_busy = lambda _: busy_wait(0.05)
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'busy.collapsed')
+        run_cmd(base_app, 'sample -i 0.001 -o {} busy'.format(path))
+        with open(path) as fobj:
+            assert 'busy_wait' in fobj.read()
+
+def test_sample_command_invalid_interval(base_app):
+    out, err = run_cmd(base_app, 'sample -i 0 help')
+    assert 'Invalid interval' in err[0]
+
+def test_sample_setting(base_app):
+    base_app.do_busy = lambda _: busy_wait(0.05)
+    base_app.sample_interval = 0.001
+    base_app.profile_threshold = 0.03
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        base_app.profile_dir = test_dir
+        run_cmd(base_app, 'set sample True')
+        out, err = run_cmd(base_app, 'busy')
+        assert 'Sampled stacks saved to' in err[0]
+
+        saved = profiling.list_profile_files(test_dir, profiling.COLLAPSED_FILE_EXT)
+        assert len(saved) == 1
+        assert saved[0].endswith('_busy.collapsed')
+
+        # Only sampling is enabled, so no cProfile results are saved
+        assert profiling.list_profile_files(test_dir) == []
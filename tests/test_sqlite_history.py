@@ -0,0 +1,157 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/sqlite_history.py module
+"""
+import os
+import tempfile
+
+import pytest
+
+import cmd2
+from cmd2.history import History
+from cmd2.parsing import StatementParser
+from cmd2.sqlite_history import SqliteHistory, SqliteHistoryStore, _required_literal
+from .conftest import run_cmd
+
+COMMANDS = ['alias create one !echo one', 'help', 'ALIAS list', 'shortcuts', 'help alias',
+            'Straße', 'alias create "q q" !echo "quoted"', 'help -v']
+
+
+def build_histories():
+    parser = StatementParser()
+    history = History()
+    sqlite_history = SqliteHistory()
+    for i, command in enumerate(COMMANDS):
+        if i == 3:
+            history.start_session()
+            sqlite_history.start_session()
+        history.append(parser.parse(command))
+        sqlite_history.append(parser.parse(command))
+    return history, sqlite_history
+
+@pytest.mark.parametrize('search', ['alias', 'Alias', 'he', 'h', 'strasse', 'STRASSE', '"q q"', 'nothing', ''])
+@pytest.mark.parametrize('include_persisted', [True, False])
+def test_str_search_matches_history(search, include_persisted):
+    history, sqlite_history = build_histories()
+    assert sqlite_history.str_search(search, include_persisted) == history.str_search(search, include_persisted)
+
+@pytest.mark.parametrize('regex', ['/alias/', 'alias', '/^help/', '/one$/', '/al+ias/', '/[AH]/', 'he?lp',
+                                   '/(?i)alias/', '/help|alias/', r'/echo \"quoted\"/'])
+@pytest.mark.parametrize('include_persisted', [True, False])
+def test_regex_search_matches_history(regex, include_persisted):
+    history, sqlite_history = build_histories()
+    assert sqlite_history.regex_search(regex, include_persisted) == history.regex_search(regex, include_persisted)
+
+@pytest.mark.parametrize('pattern, literal', [
+    ('hello', 'hello'),
+    ('ab*cd', 'cd'),
+    ('abc+d', 'abc'),
+    ('a{2}bcd', 'bcd'),
+    ('x(abc)?yz', 'yz'),
+    ('foo|bar', ''),
+    ('(?i)abc', ''),
+    (r'[a\]b]xyz\.', 'xyz.'),
+    (r'^alias create\s+\w+', 'alias create'),
+])
+def test_required_literal(pattern, literal):
+    assert _required_literal(pattern) == literal
+
+def test_span_and_truncate():
+    history, sqlite_history = build_histories()
+    assert sqlite_history.span('2..4') == history.span('2..4')
+
+    sqlite_history.truncate(4)
+    assert [item.raw for item in sqlite_history] == COMMANDS[-4:]
+    assert [item.raw for item in sqlite_history.str_search('help', include_persisted=True)] == ['help alias', 'help -v']
+
+def test_clear():
+    history, sqlite_history = build_histories()
+    sqlite_history.clear()
+    assert sqlite_history.str_search('', include_persisted=True) == []
+
+    sqlite_history.append(StatementParser().parse('help'))
+    assert sqlite_history.str_search('help') == [sqlite_history.get(1)]
+
+def test_unindexed_store():
+    history, sqlite_history = build_histories()
+    sqlite_history.store.indexed = False
+    assert sqlite_history.str_search('alias', True) == history.str_search('alias', True)
+    assert sqlite_history.regex_search('/alias/', True) == history.regex_search('/alias/', True)
+
+def test_persistent_sqlite_history(mocker):
+    # Mock out atexit.register so the database isn't compacted after its directory is deleted
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history.db')
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        assert isinstance(app.history, SqliteHistory)
+        commands = ['help', 'alias list', 'shortcuts', 'help alias', 'alias create s shortcuts']
+        for command in commands:
+            run_cmd(app, command)
+        app._persist_history()
+        assert app.history.store.record_count == 3
+
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        assert [item.raw for item in app.history] == commands[2:]
+        assert app.history.get(3).statement.arg_list == ['create', 's', 'shortcuts']
+
+        run_cmd(app, 'help')
+        out, err = run_cmd(app, 'history -a help')
+        assert out == ['    2  help alias', '    4  help']
+        app.history.store.close()
+
+def test_store_read_error():
+    with tempfile.NamedTemporaryFile(suffix='.db') as not_a_db:
+        not_a_db.write(b'this is not a database' * 100)
+        not_a_db.flush()
+        with pytest.raises(OSError):
+            SqliteHistoryStore(not_a_db.name).load()
+
+def test_concurrent_sessions(mocker):
+    mocker.patch('atexit.register')
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        hist_file = os.path.join(test_dir, 'history.db')
+        app1 = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        app2 = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        run_cmd(app1, 'help alias')
+        run_cmd(app2, 'help history')
+        run_cmd(app1, 'alias list')
+
+        # Each session only finds its own commands
+        assert [item.raw for item in app1.history.str_search('alias')] == ['help alias', 'alias list']
+        assert [item.raw for item in app2.history.str_search('help')] == ['help history']
+
+        # Once sharing is enabled, commands the other session wrote since this one last wrote are
+        # added after those already in the list
+        app2.share_history = True
+        run_cmd(app2, 'shortcuts')
+        assert [item.raw for item in app2.history.merge_shared()] == ['alias list']
+        assert app2.history.merge_shared() == []
+        assert [item.raw for item in app2.history.str_search('alias')] == ['alias list']
+        assert [item.idx for item in app2.history.str_search('list')] == [3]
+
+        # Compaction keeps the most recent commands of both sessions
+        app1._persist_history()
+        assert app1.history.store.record_count == 3
+        app = cmd2.Cmd(persistent_history_file=hist_file, persistent_history_length=3)
+        assert [item.raw for item in app.history] == ['help history', 'alias list', 'shortcuts']
+
+        for cur_app in (app, app1, app2):
+            cur_app.history.store.close()
+
+def test_time_span_matches_history():
+    from cmd2.history import HistoryItem
+    parser = StatementParser()
+    items = [HistoryItem(parser.parse('untimed'), 1),
+             HistoryItem(parser.parse('second'), 2, 200.0, 0.5, False, True),
+             HistoryItem(parser.parse('first'), 3, 100.0),
+             HistoryItem(parser.parse('third'), 4, 300.0)]
+    history = History(items)
+    sqlite_history = SqliteHistory(items)
+    assert sqlite_history[1] == items[1]
+
+    for since, until in [(None, None), (150.0, None), (None, 200.0), (150.0, 250.0)]:
+        assert sqlite_history.time_span(since, until) == history.time_span(since, until)
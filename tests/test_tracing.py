@@ -0,0 +1,157 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/tracing.py module and command tracing.
+"""
+import json
+import os
+import tempfile
+
+import pytest
+
+from cmd2 import tracing
+from .conftest import run_cmd
+
+
+class ListExporter(tracing.SpanExporter):
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(spans)
+
+
+@pytest.fixture
+def exporter(base_app):
+    exporter = ListExporter()
+    base_app.tracer = tracing.Tracer(exporter)
+    return exporter
+
+def span_names(spans):
+    return [span.name for span in spans]
+
+def test_command_spans(base_app, exporter):
+    run_cmd(base_app, 'help')
+    assert len(exporter.traces) == 1
+
+    spans = exporter.traces[0]
+    root = spans[0]
+    assert root.name == tracing.SPAN_COMMAND
+    assert root.parent_id is None
+    assert root.attributes == {'command': 'help', 'statement_size': 4, 'status': 'ok', 'stop': False}
+
+    assert span_names(spans[1:]) == [tracing.SPAN_PARSE, tracing.SPAN_POSTPARSING_HOOKS,
+                                     tracing.SPAN_REDIRECTION_SETUP, tracing.SPAN_PRECMD_HOOKS,
+                                     tracing.SPAN_COMMAND_BODY, tracing.SPAN_POSTCMD_HOOKS,
+                                     tracing.SPAN_REDIRECTION_RESTORE, tracing.SPAN_FINALIZATION]
+    for span in spans[1:]:
+        assert span.trace_id == root.trace_id
+        assert span.parent_id == root.span_id
+        assert root.start_ns <= span.start_ns <= span.end_ns <= root.end_ns
+
+def test_error_status(base_app, exporter):
+    run_cmd(base_app, 'help --fake')
+    assert exporter.traces[0][0].attributes['status'] == 'error'
+
+def test_empty_statement_not_traced(base_app, exporter):
+    run_cmd(base_app, '')
+    assert exporter.traces == []
+    assert base_app._current_trace is None
+
+def test_macro_resolution_step(base_app, exporter):
+    run_cmd(base_app, 'macro create my_macro help')
+    run_cmd(base_app, 'my_macro')
+
+    spans = exporter.traces[-1]
+    macro_span = [span for span in spans if span.name == tracing.SPAN_MACRO_RESOLUTION][0]
+    parse_span = [span for span in spans if span.name == tracing.SPAN_PARSE][0]
+    assert macro_span.parent_id == parse_span.span_id
+    assert macro_span.attributes == {'macro': 'my_macro'}
+
+def test_pipe_steps(base_app, exporter):
+    run_cmd(base_app, 'help | cat')
+
+    spans = exporter.traces[0]
+    names = span_names(spans)
+    assert tracing.SPAN_PIPE_START in names
+    assert tracing.SPAN_PIPE_WAIT in names
+
+    by_id = {span.span_id: span for span in spans}
+    pipe_wait = spans[names.index(tracing.SPAN_PIPE_WAIT)]
+    assert by_id[pipe_wait.parent_id].name == tracing.SPAN_REDIRECTION_RESTORE
+
+def test_nested_commands_share_trace(base_app, exporter, request):
+    test_dir = os.path.dirname(request.module.__file__)
+    script = os.path.join(test_dir, 'scripts', 'help.txt')
+    run_cmd(base_app, 'run_script {}'.format(script))
+
+    inner, outer = exporter.traces
+    assert outer[0].attributes['command'] == 'run_script'
+    assert inner[0].attributes['command'] == 'help'
+    assert inner[0].trace_id == outer[0].trace_id
+    assert inner[0].parent_id == outer[0].span_id
+
+def test_json_lines_exporter():
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'trace.jsonl')
+        exporter = tracing.JsonLinesExporter(path, batch_size=2, flush_interval=60)
+        tracer = tracing.Tracer(exporter)
+        for _ in range(3):
+            trace = tracer.start_trace('test')
+            trace.record_phase('phase', 0, 0)
+            trace.finish(status='ok')
+        tracer.shutdown()
+
+        with open(path) as trace_file:
+            lines = [json.loads(line) for line in trace_file]
+    assert len(lines) == 6
+    assert lines[0]['name'] == 'test'
+    assert lines[0]['attributes'] == {'status': 'ok'}
+    assert lines[1]['parent_id'] == lines[0]['span_id']
+    assert exporter.dropped_spans == 0
+
+def test_json_lines_exporter_full_queue():
+    with tempfile.TemporaryDirectory() as test_dir:
+        exporter = tracing.JsonLinesExporter(os.path.join(test_dir, 'trace.jsonl'), max_queue_size=1)
+        spans = [tracing.Span('span', 'trace', None, 0) for _ in range(100)]
+        exporter.export(spans)
+        exporter.shutdown()
+    assert exporter.dropped_spans > 0
+
+def test_trace_file_setting(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'trace.jsonl')
+        run_cmd(base_app, 'set trace_file {}'.format(path))
+        assert base_app.trace_file == path
+        run_cmd(base_app, 'help')
+
+        # Turning off tracing writes all queued spans
+        run_cmd(base_app, "set trace_file ''")
+        assert base_app.tracer is None
+        assert base_app.trace_file == ''
+
+        with open(path) as trace_file:
+            commands = [json.loads(line)['attributes'].get('command') for line in trace_file]
+    assert 'help' in commands
+
+def test_trace_file_setting_error(base_app):
+    out, err = run_cmd(base_app, 'set trace_file /this/dir/does/not/exist/trace.jsonl')
+    assert 'Error setting trace_file' in err[0]
+    assert base_app.tracer is None
+
+def test_trace_file_setting_error_keeps_tracer(base_app):
+    with tempfile.TemporaryDirectory() as test_dir:
+        path = os.path.join(test_dir, 'trace.jsonl')
+        run_cmd(base_app, 'set trace_file {}'.format(path))
+        tracer = base_app.tracer
+
+        out, err = run_cmd(base_app, 'set trace_file /this/dir/does/not/exist/trace.jsonl')
+        assert 'Error setting trace_file' in err[0]
+        assert base_app.tracer is tracer
+        assert base_app.trace_file == path
+
+        run_cmd(base_app, 'help')
+        run_cmd(base_app, "set trace_file ''")
+        with open(path) as trace_file:
+            commands = [json.loads(line)['attributes'].get('command') for line in trace_file]
+    assert 'help' in commands
@@ -5,6 +5,7 @@ Unit testing for cmd2/utils.py module.
 """
 import signal
 import sys
+import threading
 import time
 
 import pytest
@@ -294,6 +295,218 @@ def test_context_flag_exit_err(context_flag):
         context_flag.__exit__()
 
 
+def test_background_worker():
+    worker = cu.BackgroundWorker('test worker')
+    results = []
+    first = worker.submit(time.sleep, 0.05)
+    second = worker.submit(results.append, 'second')
+    cancelled = worker.submit(results.append, 'cancelled')
+    assert cancelled.cancel()
+    failed = worker.submit(int, 'not a number')
+
+    # Functions run one at a time in the order they were submitted
+    assert first.result(5) is None
+    assert second.result(5) is None
+    with pytest.raises(ValueError):
+        failed.result(5)
+    assert results == ['second']
+    assert worker._thread.daemon
+
+
+def test_background_worker_abandon():
+    worker = cu.BackgroundWorker('test worker')
+    stop = threading.Event()
+    stuck = worker.submit(stop.wait, 5)
+    queued = worker.submit(int, '1')
+
+    # Functions which haven't started are cancelled
+    worker.abandon(queued)
+    assert queued.cancelled()
+
+    # Functions submitted after a running one is abandoned don't wait for it
+    while not stuck.running():
+        time.sleep(0.005)
+    worker.abandon(stuck)
+    assert worker.submit(int, '2').result(5) == 2
+    assert stuck.running()
+    stop.set()
+    assert stuck.result(5)
+
+
+def test_completion_index():
+    from cmd2.argparse_custom import CompletionItem
+    index = cu.CompletionIndex(['beta', 'alpha', 'alphabet', 3, CompletionItem('alps', 'mountains'), 'b'])
+    assert len(index) == 6
+    assert list(index) == ['3', 'alpha', 'alphabet', 'alps', 'b', 'beta']
+    assert 3 in index and 'alps' in index and 'al' not in index
+
+    assert index.complete('al') == ['alpha', 'alphabet', 'alps']
+    assert index.complete('al', exclude={'alpha'}) == ['alphabet', 'alps']
+    assert index.complete('alx') == []
+    assert index.complete('') == list(index)
+    assert index.complete('al')[2].description == 'mountains'
+
+    index.add('alpine')
+    assert index.complete('alp') == ['alpha', 'alphabet', 'alpine', 'alps']
+    assert cu.basic_complete('b', 'cmd b', 4, 5, index) == ['b', 'beta']
+
+
+@pytest.mark.parametrize('text, mode, expected', [
+    # Matches at the start come first, then those with the fewest characters between the matched ones
+    ('ET', 'substring', ['beta', 'settle', 'sunset', 'alphabet']),
+    ('set', 'substring', ['settle', 'sunset']),
+    ('bt', 'fuzzy', ['bat', 'beta', 'alphabet']),
+    ('sl', 'fuzzy', ['settle']),
+    ('q', 'fuzzy', []),
+    ('', 'fuzzy', ['beta', 'alphabet', 'settle', 'sunset', 'bat']),
+])
+def test_completion_modes(text, mode, expected):
+    strs = ['beta', 'alphabet', 'settle', 'sunset', 'bat']
+    assert cu.basic_complete(text, 'cmd ' + text, 4, 4 + len(text), strs, mode=mode) == expected
+
+    # An index returns the same ranking, except all of its strings are sorted when text is empty
+    assert cu.CompletionIndex(strs).complete(text, mode=mode) == (expected if text else sorted(strs))
+
+
+@pytest.mark.parametrize('mode', ['substring', 'fuzzy'])
+def test_completion_index_one_character(mode):
+    # Choices which start with one character come first, then those which contain it, both in sorted order
+    index = cu.CompletionIndex(['sunset', 'beta', 'Settle', 'alphabet', 'bat', 'east'])
+    assert index.complete('S', mode=mode) == ['Settle', 'sunset', 'east']
+    assert index.complete('s', exclude={'sunset'}, mode=mode) == ['Settle', 'east']
+    assert index.complete('q', mode=mode) == []
+
+
+def test_completion_mode_invalid():
+    with pytest.raises(ValueError):
+        cu.basic_complete('a', 'cmd a', 4, 5, ['alpha'], mode='exact')
+    with pytest.raises(ValueError):
+        cu.CompletionIndex(['alpha']).complete('', mode='exact')
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="relies on the executable bit of files")
+def test_get_exes_in_path(tmpdir, monkeypatch):
+    import os
+    bin_dir = tmpdir.mkdir('bin')
+    for name in ['tool', 'toolkit', '.hidden_tool', 'text.txt']:
+        bin_dir.join(name).write('')
+    for name in ['tool', 'toolkit', '.hidden_tool']:
+        bin_dir.join(name).chmod(0o755)
+    bin_dir.mkdir('tooldir')
+    monkeypatch.setenv('PATH', os.path.pathsep.join([str(bin_dir), str(tmpdir.join('missing'))]))
+
+    assert cu.get_exes_in_path('to') == ['tool', 'toolkit']
+    assert cu.get_exes_in_path('.h') == ['.hidden_tool']
+    assert cu.get_exes_in_path('t*') == []
+
+    # Unchanged directories are not read again
+    index = cu._path_exes.get_index()
+    assert cu._path_exes.get_index() is index
+
+    # A new file changes the directory's modification time
+    bin_dir.join('tooling').write('')
+    bin_dir.join('tooling').chmod(0o755)
+    dir_stat = os.stat(str(bin_dir))
+    os.utime(str(bin_dir), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 1000000000))
+    assert cu.get_exes_in_path('tool') == ['tool', 'tooling', 'toolkit']
+
+    # So does a change to PATH
+    other_dir = tmpdir.mkdir('other')
+    other_dir.join('tool2').write('')
+    other_dir.join('tool2').chmod(0o755)
+    monkeypatch.setenv('PATH', str(other_dir))
+    assert cu.get_exes_in_path('tool') == ['tool2']
+    assert str(bin_dir) not in cu._path_exes._dirs
+
+
+def test_scan_directory(tmpdir):
+    import os
+    tmpdir.join('file').write('')
+    tmpdir.mkdir('dir')
+    assert sorted(cu.scan_directory(str(tmpdir))) == [('dir', True), ('file', False)]
+
+    # Cached listings are reused until the directory changes
+    listing = cu.scan_directory(str(tmpdir), cache_ttl=60)
+    assert cu.scan_directory(str(tmpdir), cache_ttl=60) is listing
+    tmpdir.join('new').write('')
+    dir_stat = os.stat(str(tmpdir))
+    os.utime(str(tmpdir), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 1000000000))
+    assert len(cu.scan_directory(str(tmpdir), cache_ttl=60)) == 3
+
+    # Or until they expire
+    listing = cu.scan_directory(str(tmpdir), cache_ttl=0.001)
+    time.sleep(0.01)
+    assert cu.scan_directory(str(tmpdir), cache_ttl=0.001) is not listing
+
+    with pytest.raises(OSError):
+        cu.scan_directory(str(tmpdir.join('missing')), cache_ttl=60)
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="Windows has no password database")
+def test_get_users_with_home_dirs(tmpdir, monkeypatch):
+    import collections
+    import pwd
+    PwEntry = collections.namedtuple('PwEntry', ['pw_name', 'pw_dir'])
+    entries = [PwEntry('alice', str(tmpdir)), PwEntry('albert', str(tmpdir)), PwEntry('al', str(tmpdir.join('gone')))]
+    calls = []
+    release = threading.Event()
+    release.set()
+
+    def getpwall():
+        calls.append('getpwall')
+        release.wait()
+        return entries
+
+    def getpwnam(name):
+        calls.append(name)
+        for entry in entries:
+            if entry.pw_name == name:
+                return entry
+        raise KeyError(name)
+
+    def finish_read():
+        release.set()
+        reader = users._reader
+        if reader is not None:
+            reader.join()
+
+    monkeypatch.setattr(pwd, 'getpwall', getpwall)
+    monkeypatch.setattr(pwd, 'getpwnam', getpwnam)
+    users = cu._Users()
+    monkeypatch.setattr(cu, '_users', users)
+
+    # Users without an existing home directory are left out
+    assert cu.get_users_with_home_dirs('al') == ['albert', 'alice']
+    assert cu.get_users_with_home_dirs('ali') == ['alice']
+    assert calls == ['getpwall']
+
+    assert cu.get_users_with_home_dirs('al', cache_ttl=0) == ['albert', 'alice']
+    assert calls == ['getpwall', 'getpwall']
+
+    # Once the names have been read, expired ones are used while the database is read again in the background
+    users._read_time -= 60
+    release.clear()
+    assert cu.get_users_with_home_dirs('al', max_users=2) == ['albert', 'alice']
+    finish_read()
+    assert calls == ['getpwall'] * 3
+
+    # With too many users, only names typed in full are looked up and the database isn't read until cache_ttl passes
+    assert cu.get_users_with_home_dirs('al', max_users=2) == []
+    assert cu.get_users_with_home_dirs('alice', max_users=2) == ['alice']
+    assert cu.get_users_with_home_dirs('bob', max_users=2) == []
+    assert calls == ['getpwall'] * 3 + ['al', 'alice', 'bob']
+
+    # The number of users is checked again after cache_ttl without waiting for the database
+    del calls[:]
+    users._read_time -= 60
+    release.clear()
+    assert cu.get_users_with_home_dirs('al', max_users=3) == []
+    finish_read()
+    assert sorted(calls) == ['al', 'getpwall']
+    assert cu.get_users_with_home_dirs('al', max_users=3) == ['albert', 'alice']
+    assert len(calls) == 2
+
+
 def test_truncate_line():
     line = 'long'
     max_width = 3
@@ -0,0 +1,192 @@
+# coding=utf-8
+# flake8: noqa E302
+"""
+Unit testing for cmd2/watchdog.py module and the slow command settings.
+"""
+import os
+import signal
+import tempfile
+import threading
+import time
+
+import pytest
+
+from cmd2 import watchdog
+from .conftest import run_cmd
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < end:
+        time.sleep(0.005)
+    return condition()
+
+def test_format_stacks():
+    stacks = watchdog.format_stacks(threading.get_ident())
+    assert 'test_format_stacks' in stacks
+    assert stacks.count('Stack of thread') == 1
+
+def test_format_stacks_all_threads():
+    stop = threading.Event()
+    thread = threading.Thread(name='other_thread', target=stop.wait)
+    thread.start()
+    try:
+        stacks = watchdog.format_stacks(threading.get_ident(), all_threads=True)
+    finally:
+        stop.set()
+        thread.join()
+    assert "Stack of thread 'other_thread'" in stacks
+
+def test_watchdog_reports_slow_command():
+    reports = []
+    dog = watchdog.Watchdog(report=lambda watched, stacks: reports.append((watched, stacks)),
+                            cancel=lambda watched: None)
+    with dog.watch('slow', threshold=0.01) as watched:
+        assert wait_for(lambda: reports)
+    assert reports[0][0] is watched
+    assert 'test_watchdog_reports_slow_command' in reports[0][1]
+
+    # Fast commands aren't reported
+    with dog.watch('fast', threshold=1):
+        pass
+    time.sleep(0.01)
+    assert len(reports) == 1
+
+def test_watchdog_cancels_and_retries():
+    cancels = []
+    dog = watchdog.Watchdog(report=lambda watched, stacks: None, cancel=lambda watched: cancels.append(watched))
+    dog.CANCEL_RETRY_INTERVAL = 0.01
+    with dog.watch('hung', timeout=0.01) as watched:
+        assert wait_for(lambda: watched.cancel_attempts >= 2)
+    assert cancels[0] is watched
+
+    count = len(cancels)
+    time.sleep(0.03)
+    assert len(cancels) == count
+
+@pytest.mark.skipif(not hasattr(signal, 'pthread_kill'), reason='requires signal.pthread_kill')
+def test_watchdog_cancel_while_removing():
+    cancels = []
+    dog = watchdog.Watchdog(report=lambda watched, stacks: None, cancel=lambda watched: cancels.append(watched))
+    dog.CANCEL_RETRY_INTERVAL = 0.01
+    watched = dog.watch('hung', timeout=0.01)
+    watched.__enter__()
+    assert wait_for(lambda: cancels)
+
+    # Hold the lock so the command waits for it as it finishes, then interrupt that wait like a cancellation
+    locked = threading.Event()
+    interrupted = threading.Event()
+
+    def hold_lock():
+        with dog._cond:
+            locked.set()
+            time.sleep(0.05)
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+            interrupted.wait(2)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait()
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            watched.__exit__(None, None, None)
+    finally:
+        interrupted.set()
+        holder.join()
+
+    # The watchdog drops the command instead of cancelling it forever
+    assert wait_for(lambda: not dog._watched)
+    count = len(cancels)
+    time.sleep(0.05)
+    assert len(cancels) == count
+
+def test_watchdog_command_finishes_while_cancelling():
+    cancelling = threading.Event()
+    release = threading.Event()
+    finished_when_cancelled = []
+
+    def cancel(watched):
+        finished_when_cancelled.append(watched.finished)
+        cancelling.set()
+        release.wait(2)
+
+    dog = watchdog.Watchdog(report=lambda watched, stacks: None, cancel=cancel)
+    dog.CANCEL_RETRY_INTERVAL = 0.01
+    watched = dog.watch('hung', timeout=0.01)
+    watched.__enter__()
+    assert cancelling.wait(2)
+
+    # The command can't finish until the cancellation has been sent, and it isn't cancelled after it finishes
+    threading.Timer(0.05, release.set).start()
+    start = time.perf_counter()
+    watched.__exit__(None, None, None)
+    assert time.perf_counter() - start >= 0.04
+    time.sleep(0.05)
+    assert finished_when_cancelled and not any(finished_when_cancelled)
+
+def test_watchdog_nested_commands():
+    reports = []
+    dog = watchdog.Watchdog(report=lambda watched, stacks: reports.append(watched.command),
+                            cancel=lambda watched: None)
+    with dog.watch('outer', threshold=0.05):
+        with dog.watch('inner', threshold=0.01):
+            assert wait_for(lambda: reports == ['inner'])
+        assert wait_for(lambda: reports == ['inner', 'outer'])
+
+def test_slow_command_threshold(base_app, capsys):
+    base_app.do_slow = lambda _: time.sleep(0.1)
+    run_cmd(base_app, 'set slow_command_threshold 0.02')
+    base_app.onecmd_plus_hooks('slow')
+    out, err = capsys.readouterr()
+    assert "Command 'slow' has been running for" in err
+    assert 'test_watchdog.py' in err
+
+def test_slow_command_log(base_app):
+    base_app.do_slow = lambda _: time.sleep(0.1)
+    base_app.slow_command_threshold = 0.02
+    with tempfile.TemporaryDirectory() as test_dir:
+        base_app.slow_command_log = os.path.join(test_dir, 'slow.log')
+        run_cmd(base_app, 'slow')
+        assert wait_for(lambda: os.path.exists(base_app.slow_command_log))
+        with open(base_app.slow_command_log) as log_file:
+            assert "Command 'slow' has been running for" in log_file.read()
+
+def test_slow_command_timeout(base_app, capsys):
+    finished = []
+
+    def do_hang(_):
+        time.sleep(5)
+        finished.append(True)
+
+    base_app.do_hang = do_hang
+    base_app.slow_command_timeout = 0.05
+    start = time.perf_counter()
+    base_app.onecmd_plus_hooks('hang')
+    assert time.perf_counter() - start < 2
+    assert not finished
+
+    out, err = capsys.readouterr()
+    assert "Cancelling command 'hang'" in err
+    assert base_app.metrics.get('hang').errors == 1
+
+def test_slow_command_timeout_waits_for_sigint_protection(base_app, capsys):
+    def do_protected(_):
+        with base_app.sigint_protection:
+            time.sleep(0.1)
+        time.sleep(5)
+
+    base_app._watchdog.CANCEL_RETRY_INTERVAL = 0.01
+    base_app.do_protected = do_protected
+    base_app.slow_command_timeout = 0.02
+    start = time.perf_counter()
+    base_app.onecmd_plus_hooks('protected')
+    assert 0.1 <= time.perf_counter() - start < 2
+
+def test_slow_command_timeout_other_thread(base_app, capsys):
+    base_app.do_slow = lambda _: time.sleep(0.1)
+    base_app.slow_command_timeout = 0.02
+    thread = threading.Thread(target=base_app.onecmd_plus_hooks, args=['slow'])
+    thread.start()
+    thread.join()
+    out, err = capsys.readouterr()
+    assert "can't be cancelled" in err